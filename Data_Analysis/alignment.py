@@ -0,0 +1,311 @@
+# -*- coding: utf-8 -*-
+# Time alignment of the accelerometer and magnetometer streams.
+#
+# The notebooks pair the two CSVs by row position. Here every row gets a
+# sub-second timestamp first (date_created only has whole seconds, so the rows
+# sharing a second are spread evenly over it in id order), then the streams
+# are either
+#   merge_nearest  - magnetometer rows with the nearest accelerometer row
+#                    within a tolerance (pandas.merge_asof), or
+#   align          - both resampled onto one uniform grid at rate_hz by linear
+#                    interpolation, never across a gap longer than max_gap.
+# Both work per session: a run of rows with the same source/people_id/label.
+# Grid points inside a gap are dropped and the grid restarts after it, every
+# gap-free stretch gets its own `segment` number.
+#
+#   from alignment import align
+#   df = align(load_sensor('accelerometer'), load_sensor('magnetometer'), rate_hz=4)
+#
+# StreamAligner does the resampling incrementally, so iter_align can run over
+# chunks (pd.read_csv(chunksize=...), recording slices) of any length, and
+# any number of them per stream:
+#
+#   python alignment.py --acc_chunk 2000 --mag_chunk 1000
+# checks that iter_align over chunks gives the same frame as align.
+import argparse
+from itertools import zip_longest
+
+import numpy as np
+import pandas as pd
+
+from dataset import SENSOR_AXES
+
+SESSION_KEYS = ('source', 'people_id', 'label')
+NS = 10 ** 9
+
+
+# datetime64 values with second resolution -> int64 ns, rows sharing a second
+# spread evenly over it: (k + 0.5) / n of the way into the second
+def spread_timestamps(date_created):
+    seconds = np.asarray(date_created).astype('datetime64[ns]').astype(np.int64)
+    if not len(seconds):
+        return seconds
+    starts = np.flatnonzero(np.r_[True, seconds[1:] != seconds[:-1]])
+    counts = np.diff(np.r_[starts, len(seconds)])
+    rank = np.arange(len(seconds)) - np.repeat(starts, counts)
+    return seconds + ((rank + 0.5) * NS / np.repeat(counts, counts)).astype(np.int64)
+
+
+# Start/stop row of every run of equal session keys
+def session_bounds(df, keys=SESSION_KEYS):
+    keys = [key for key in keys if key in df]
+    if not len(df):
+        return []
+    changed = np.zeros(len(df), dtype=bool)
+    changed[0] = True
+    for key in keys:
+        # factorize: NaN people_id compares equal to itself
+        values = pd.factorize(df[key])[0]
+        changed[1:] |= values[1:] != values[:-1]
+    starts = np.flatnonzero(changed)
+    return list(zip(starts, np.r_[starts[1:], len(df)]))
+
+
+# Start/stop of the gap-free stretches of sorted ns timestamps
+def detect_gaps(t_ns, max_gap_ns):
+    t_ns = np.asarray(t_ns)
+    if not len(t_ns):
+        return []
+    breaks = np.flatnonzero(np.diff(t_ns) > max_gap_ns) + 1
+    starts = np.r_[0, breaks]
+    return list(zip(starts, np.r_[breaks, len(t_ns)]))
+
+
+def _with_time(df):
+    df = df.reset_index(drop=True)
+    t_ns = np.empty(len(df), dtype=np.int64)
+    for start, stop in session_bounds(df):
+        t_ns[start:stop] = spread_timestamps(df['date_created'].values[start:stop])
+    df['t_ns'] = t_ns
+    return df
+
+
+def _session_key(df, row=0):
+    key = []
+    for name in SESSION_KEYS:
+        if name in df:
+            value = df[name].iloc[row]
+            key.append(None if pd.isna(value) else str(value))
+    return tuple(key)
+
+
+# Magnetometer rows with the accelerometer axes of the nearest accelerometer row
+# of the same session, NaN when none is within tolerance_s
+def merge_nearest(df_acc, df_mag, tolerance_s=0.5):
+    df_acc, df_mag = _with_time(df_acc), _with_time(df_mag)
+    for df in (df_acc, df_mag):
+        df['_session'] = [repr(_session_key(df, row)) for row in range(len(df))] if len(df) else []
+    acc_columns = ['t_ns', '_session'] + list(SENSOR_AXES['accelerometer'])
+    merged = pd.merge_asof(
+        df_mag.sort_values('t_ns', kind='stable'),
+        df_acc[acc_columns].sort_values('t_ns', kind='stable'),
+        on='t_ns', by='_session', direction='nearest', tolerance=int(tolerance_s * NS))
+    return merged.sort_index().drop(columns='_session')
+
+
+class StreamAligner(object):
+    # Incremental resampler of several (t_ns, values) streams onto one grid.
+    # push() adds samples of one stream in time order, pop() returns every grid
+    # point no later than the newest sample of the slowest stream, finish()
+    # flushes the rest and starts a new grid for the next session. A grid point
+    # is kept only if in every stream it lies between two samples at most
+    # max_gap_ns apart; `segment` counts the gap-free stretches.
+
+    def __init__(self, streams, rate_hz, max_gap_ns):
+        self.streams = tuple(streams)
+        self.period_ns = int(round(NS / float(rate_hz)))
+        self.max_gap_ns = max_gap_ns
+        self.segment = -1
+        self._next_ns = None
+        self._in_gap = True
+        self._reset()
+
+    def _reset(self):
+        self._t = dict((name, np.empty(0, dtype=np.int64)) for name in self.streams)
+        self._values = dict((name, np.empty((0, 3))) for name in self.streams)
+
+    def push(self, name, t_ns, values):
+        values = np.asarray(values, dtype=np.float64).reshape(len(t_ns), -1)
+        self._t[name] = np.concatenate([self._t[name], np.asarray(t_ns, dtype=np.int64)])
+        self._values[name] = np.concatenate([self._values[name].reshape(-1, values.shape[1]), values])
+
+    def _interpolate(self, name, grid):
+        t, values = self._t[name], self._values[name]
+        after = np.searchsorted(t, grid, side='right')
+        before = after - 1
+        exact = (before >= 0) & (t[np.maximum(before, 0)] == grid)
+        after = np.where(exact, before, after)
+        valid = (before >= 0) & (after < len(t))
+        before, after = np.clip(before, 0, len(t) - 1), np.clip(after, 0, len(t) - 1)
+        span = t[after] - t[before]
+        valid &= span <= self.max_gap_ns
+        weight = ((grid - t[before]) / np.maximum(span, 1).astype(np.float64))[:, None]
+        return values[before] * (1 - weight) + values[after] * weight, valid
+
+    # Grid points up to horizon_ns as (t_ns, {stream: values}, segment)
+    def _emit(self, horizon_ns):
+        if any(not len(self._t[name]) for name in self.streams):
+            return self._empty()
+        if self._next_ns is None:
+            self._next_ns = max(int(self._t[name][0]) for name in self.streams)
+        if horizon_ns < self._next_ns:
+            return self._empty()
+        n = (horizon_ns - self._next_ns) // self.period_ns + 1
+        grid = self._next_ns + np.arange(n, dtype=np.int64) * self.period_ns
+        self._next_ns = int(grid[-1]) + self.period_ns
+
+        valid = np.ones(n, dtype=bool)
+        values = {}
+        for name in self.streams:
+            values[name], stream_valid = self._interpolate(name, grid)
+            valid &= stream_valid
+        # A new segment starts at every valid point that follows an invalid one
+        starts = valid & ~np.r_[not self._in_gap, valid[:-1]]
+        segment = self.segment + np.cumsum(starts)
+        self.segment = int(segment[-1])
+        self._in_gap = not valid[-1]
+
+        # Drop samples no later grid point can need
+        for name in self.streams:
+            keep = max(int(np.searchsorted(self._t[name], self._next_ns, side='right')) - 1, 0)
+            self._t[name] = self._t[name][keep:]
+            self._values[name] = self._values[name][keep:]
+        return grid[valid], dict((name, values[name][valid]) for name in self.streams), segment[valid]
+
+    def _empty(self):
+        return (np.empty(0, dtype=np.int64), dict((name, np.empty((0, 3))) for name in self.streams),
+                np.empty(0, dtype=np.int64))
+
+    def pop(self):
+        if any(not len(self._t[name]) for name in self.streams):
+            return self._empty()
+        return self._emit(min(int(self._t[name][-1]) for name in self.streams))
+
+    def finish(self):
+        result = self.pop()
+        self._next_ns = None
+        self._in_gap = True
+        self._reset()
+        return result
+
+
+def _frame(result, session):
+    grid, values, segment = result
+    data = {'date': pd.to_datetime(grid, unit='ns'), 'segment': segment}
+    for sensor in ('accelerometer', 'magnetometer'):
+        for n, axis in enumerate(SENSOR_AXES[sensor]):
+            data[axis] = values[sensor][:, n].astype(np.float32)
+    df = pd.DataFrame(data)
+    for name, value in zip(SESSION_KEYS, session):
+        df[name] = value
+    return df
+
+
+# Resamples both streams of every session onto a rate_hz grid. Output: date,
+# segment (increases at every gap and session change), Acc_*, Mag_* as
+# float32 and the session columns.
+def align(df_acc, df_mag, rate_hz=4.0, max_gap_s=2.0):
+    frames = list(iter_align([df_acc], [df_mag], rate_hz, max_gap_s))
+    if not frames:
+        return _frame(StreamAligner(SENSOR_AXES, rate_hz, 0)._empty(), ())
+    return pd.concat(frames, ignore_index=True)
+
+
+# Same as align over iterables of accelerometer and magnetometer chunks (both
+# in time order). The two streams may have different numbers of chunks, e.g.
+# at different data rates; the longer one is read on after the shorter one
+# ends. Yields one DataFrame per step, so memory stays bounded by the chunk
+# sizes plus one second of carried-over rows.
+def iter_align(acc_chunks, mag_chunks, rate_hz=4.0, max_gap_s=2.0):
+    sensors = ('accelerometer', 'magnetometer')
+    aligner = StreamAligner(sensors, rate_hz, int(max_gap_s * NS))
+    state = {'session': None, 'done': dict.fromkeys(sensors, False)}
+    pending = dict((sensor, None) for sensor in sensors)
+    exhausted = dict.fromkeys(sensors, False)
+
+    def rows_pending(sensor):
+        return pending[sensor] is not None and len(pending[sensor]) > 0
+
+    # Feeds pending rows of the current session to the aligner. Until its
+    # stream is exhausted, the rows of the last second of a chunk wait for the
+    # next one, the second may continue there and spread_timestamps needs all
+    # of its rows.
+    def feed():
+        out = []
+        while True:
+            heads = [sensor for sensor in sensors if rows_pending(sensor)]
+            if state['session'] is None:
+                waiting = [sensor for sensor in sensors if sensor not in heads and not exhausted[sensor]]
+                if not heads or waiting:
+                    break
+                # Sessions present in only one stream are consumed on their own
+                first = min(heads, key=lambda sensor: pending[sensor]['date_created'].iloc[0])
+                state['session'] = _session_key(pending[first])
+            for sensor in sensors:
+                df = pending[sensor]
+                if not rows_pending(sensor) or _session_key(df) != state['session']:
+                    state['done'][sensor] = rows_pending(sensor) or exhausted[sensor]
+                    continue
+                stop = session_bounds(df)[0][1]
+                ended = stop < len(df) or exhausted[sensor]
+                if not ended:
+                    seconds = df['date_created'].values
+                    stop = int(np.searchsorted(seconds[:stop], seconds[stop - 1], side='left'))
+                rows = df.iloc[:stop]
+                if len(rows):
+                    aligner.push(sensor, spread_timestamps(rows['date_created'].values),
+                                 rows[list(SENSOR_AXES[sensor])].values)
+                pending[sensor] = df.iloc[stop:]
+                state['done'][sensor] = ended
+            if all(state['done'].values()):
+                out.append(_frame(aligner.finish(), state['session']))
+                state['session'] = None
+                state['done'] = dict.fromkeys(sensors, False)
+                continue
+            out.append(_frame(aligner.pop(), state['session']))
+            break
+        out = [frame for frame in out if len(frame)]
+        return pd.concat(out, ignore_index=True) if out else None
+
+    for chunks in zip_longest(acc_chunks, mag_chunks):
+        for sensor, df in zip(sensors, chunks):
+            # None: this stream has no more chunks, its pending rows are final
+            if df is None:
+                exhausted[sensor] = True
+                continue
+            df = df.reset_index(drop=True)
+            pending[sensor] = df if pending[sensor] is None else pd.concat([pending[sensor], df], ignore_index=True)
+        frame = feed()
+        if frame is not None:
+            yield frame
+    if any(pending[sensor] is not None for sensor in sensors):
+        exhausted.update(dict.fromkeys(sensors, True))
+        frame = feed()
+        if frame is not None:
+            yield frame
+
+
+def _chunks(df, size):
+    return [df.iloc[start:start + size] for start in range(0, len(df), size)]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--acc_chunk', type=int, default=2000)
+    parser.add_argument('--mag_chunk', type=int, default=1000)
+    parser.add_argument('--rate_hz', type=float, default=4.0)
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    from dataset import load_sensor
+    df_acc, df_mag = load_sensor('accelerometer'), load_sensor('magnetometer')
+    expected = align(df_acc, df_mag, args.rate_hz)
+    acc_chunks, mag_chunks = _chunks(df_acc, args.acc_chunk), _chunks(df_mag, args.mag_chunk)
+    frames = list(iter_align(acc_chunks, mag_chunks, args.rate_hz))
+    chunked = pd.concat(frames, ignore_index=True) if frames else expected.iloc[:0]
+    print('%d accelerometer chunks, %d magnetometer chunks: %d rows chunked, %d rows from align' % (
+        len(acc_chunks), len(mag_chunks), len(chunked), len(expected)))
+    pd.testing.assert_frame_equal(chunked, expected)
+    print('iter_align matches align')
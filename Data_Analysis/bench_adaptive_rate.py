@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+# Readings kept by SimpleRequest.py --adaptive 1 on the recorded sessions,
+# against sampling at --active_hz all the time.
+#
+# Every session is replayed through raspberry_code/adaptive_rate.AdaptiveRate
+# on its own clock, the rows taken as sampled every --timestep_detect seconds.
+# Profiles slower than that skip rows to keep their rate, faster ones cannot
+# be replayed and count their readings at the profile's rate instead.
+# The empty chair statistics of all three accelerometer axes come from the
+# people_id == 'noone' rows, like a seeded --baseline.
+#
+#   python bench_adaptive_rate.py --hold_s 30
+import argparse
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'raspberry_code'))
+
+from dataset import load_dataset
+from features import empty_chair_stats
+
+from adaptive_rate import AdaptiveRate, ACCELEROMETER_COLUMNS, PROFILES
+
+
+class ReplayClock(object):
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+# Seconds spent in every profile and readings taken at the adaptive rates
+def replay(session, empty_chair, args):
+    clock = ReplayClock()
+    rates = {'idle': args.idle_hz, 'still': args.still_hz, 'active': args.active_hz}
+    adaptive = AdaptiveRate({}, rates, empty_chair, args.n_sigma, args.motion_lsb, args.motion_mag_lsb,
+                            args.hold_s, clock)
+    adaptive.start()
+    acc = session[list(ACCELEROMETER_COLUMNS)].values.tolist()
+    mag = session[['Mag_x', 'Mag_y', 'Mag_z']].values.tolist()
+    readings = 0.0
+    row = 0.0
+    while int(row) < len(acc):
+        clock.now = int(row) * args.timestep_detect
+        n = int(row)
+        profile = None
+        for typeSensor, xyz in (('magnetometer', mag[n]), ('accelerometer', acc[n])):
+            profile = adaptive.update(typeSensor, xyz) or profile
+        if profile is not None:
+            adaptive.switch(profile)
+        step = 1.0 / (adaptive.rate_hz * args.timestep_detect)
+        readings += max(1.0, 1.0 / step)
+        row += max(1.0, step)
+    clock.now = len(acc) * args.timestep_detect
+    return adaptive.stats(), readings
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--timestep_detect', type=float, default=0.1)
+    parser.add_argument('--idle_hz', type=float, default=0.5)
+    parser.add_argument('--still_hz', type=float, default=5)
+    parser.add_argument('--active_hz', type=float, default=50)
+    parser.add_argument('--n_sigma', type=float, default=5.0)
+    parser.add_argument('--motion_lsb', type=float, default=400)
+    parser.add_argument('--motion_mag_lsb', type=float, default=300)
+    parser.add_argument('--hold_s', type=float, default=30.0)
+    parser.add_argument('--sources', type=str, default='2')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    df = load_dataset(args.sources.split(','))
+    means_stds = empty_chair_stats(df)
+    empty_chair = dict((name, (means_stds.loc[name, 'mean'], means_stds.loc[name, 'std']))
+                       for name in ACCELEROMETER_COLUMNS)
+
+    print('%-10s %8s %8s %8s %8s %9s %10s %7s' % ('people_id', 'seconds', 'idle', 'still', 'active',
+                                                 'switches', 'readings', 'kept'))
+    total_readings, total_fixed = 0.0, 0.0
+    for people_id, session in df.groupby('people_id', sort=False):
+        stats, readings = replay(session, empty_chair, args)
+        seconds = len(session) * args.timestep_detect
+        fixed = seconds * args.active_hz
+        total_readings += readings
+        total_fixed += fixed
+        print('%-10s %8.0f %s %9d %10.0f %6.1f%%' % (
+            people_id, seconds, ' '.join('%7.0f%%' % (100.0 * stats['seconds_' + profile] / seconds)
+                                         for profile in PROFILES),
+            stats['switches'], readings, 100.0 * readings / fixed))
+    print('All sessions: %.0f readings instead of %.0f at %g Hz (%.1f%%)' % (
+        total_readings, total_fixed, args.active_hz, 100.0 * total_readings / total_fixed))
@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+# Parity check of features.py against the Final_project_1.ipynb functions and
+# throughput of both, in windows per second:
+#
+#   python bench_features.py --window_len 150 --step 150
+#
+# Exits with status 1 if any feature or mask differs from the notebook code
+# (features.py in mag_method='spline' mode, the notebook's derivative).
+import argparse
+import sys
+import time
+
+import numpy as np
+from scipy.interpolate import splev, splrep
+
+from dataset import load_dataset
+from features import WINDOW_COLUMNS, compute_features, empty_chair_stats, make_windows, window_columns
+
+
+# Notebook functions, unchanged apart from means_stds being passed in
+def get_lean_back_portion(acc_z, means_stds, n_sigma=5):
+    acc_z_mean = means_stds.loc['Acc_z', 'mean']
+    acc_z_std = means_stds.loc['Acc_z', 'std']
+
+    acc_z_min = acc_z_mean - n_sigma * acc_z_std
+    acc_z_max = acc_z_mean + n_sigma * acc_z_std
+
+    lean_back_portion = (acc_z < acc_z_min).mean()
+    return lean_back_portion
+
+
+def get_mess_mask_acc(acc_data, percentile2crop=10, n_sigma=10):
+    lower_bound, upper_bound, median = np.percentile(acc_data, [percentile2crop, 100 - percentile2crop, 50])
+    acc_data_filtered = acc_data[(lower_bound < acc_data) & (acc_data < upper_bound)]
+    std = np.std(acc_data_filtered)
+    oscillation = std / (25 * n_sigma)
+    calm_state_lower_bound = median - n_sigma * std
+    calm_state_upper_bound = median + n_sigma * std
+    mask_calm = ((calm_state_lower_bound < acc_data) & (acc_data < calm_state_upper_bound))
+    return mask_calm, oscillation
+
+
+def get_mess_mask_mag(mag_data, w=0.05, max_calm_derivative=30):
+    y = mag_data
+    x = np.arange(len(y))
+    splines = splrep(x, y, w=w * np.ones_like(y))
+    derivatives = splev(x, splines, der=1)
+    mask_calm = abs(derivatives) < max_calm_derivative
+    return mask_calm
+
+
+# The loop over X_ass_add.index, one window per iteration
+def notebook_features(windows, means_stds):
+    rows, acc_mask_list, mag_mask_list = [], [], []
+    for window in windows:
+        columns = dict((name, window[:, n]) for n, name in enumerate(WINDOW_COLUMNS))
+        mask_calm_acc_x, oscillation_acc_x = get_mess_mask_acc(columns['Acc_x'])
+        mask_calm_acc_y, oscillation_acc_y = get_mess_mask_acc(columns['Acc_y'])
+        mask_calm_acc_z, oscillation_acc_z = get_mess_mask_acc(columns['Acc_z'])
+        mask_calm_acc = mask_calm_acc_x & mask_calm_acc_y & mask_calm_acc_z
+
+        mask_calm_mag_x = get_mess_mask_mag(columns['Mag_x'])
+        mask_calm_mag_y = get_mess_mask_mag(columns['Mag_y'])
+        mask_calm_mag_z = get_mess_mask_mag(columns['Mag_z'])
+        mask_calm_mag = mask_calm_mag_x & mask_calm_mag_y & mask_calm_mag_z
+
+        rows.append({
+            'Lean back': get_lean_back_portion(columns['Acc_z'], means_stds),
+            'Momentum': 1 - mask_calm_acc.mean(),
+            'Oscillations': oscillation_acc_z,
+            'Rotational movement': 1 - mask_calm_mag.mean(),
+        })
+        acc_mask_list.append(np.stack([mask_calm_acc_x, mask_calm_acc_y, mask_calm_acc_z], axis=1))
+        mag_mask_list.append(np.stack([mask_calm_mag_x, mask_calm_mag_y, mask_calm_mag_z], axis=1))
+    return rows, np.array(acc_mask_list), np.array(mag_mask_list)
+
+
+def timed(function, *args, **kwargs):
+    start = time.perf_counter()
+    result = function(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--window_len', type=int, default=150)
+    parser.add_argument('--step', type=int, default=150)
+    parser.add_argument('--sources', type=str, default='2,3')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+
+    df = load_dataset(args.sources.split(','))
+    means_stds = empty_chair_stats(df)
+    windows = make_windows(window_columns(df), args.window_len, args.step)
+    print('%d windows of %d samples, step %d' % (len(windows), args.window_len, args.step))
+
+    (reference, ref_acc, ref_mag), reference_time = timed(notebook_features, windows, means_stds)
+    (features, acc, mag), batched_time = timed(compute_features, windows, means_stds, mag_method='spline')
+
+    ok = np.array_equal(ref_acc, acc) and np.array_equal(ref_mag, mag)
+    print('acc masks equal: %s, mag masks equal: %s' % (np.array_equal(ref_acc, acc), np.array_equal(ref_mag, mag)))
+    for name in features:
+        expected = np.array([row[name] for row in reference], dtype=np.float64)
+        error = np.nanmax(np.abs(expected - features[name])) if len(expected) else 0.0
+        same_nan = np.array_equal(np.isnan(expected), np.isnan(features[name]))
+        ok &= bool(error < 1e-9) and same_nan
+        print('%-20s max abs diff %.3g' % (name, error))
+
+    print('notebook loop: %8.0f windows/s' % (len(windows) / reference_time))
+    print('batched:       %8.0f windows/s' % (len(windows) / batched_time))
+    _, savgol_time = timed(compute_features, windows, means_stds, mag_method='savgol')
+    print('batched, Savitzky-Golay derivative: %8.0f windows/s' % (len(windows) / savgol_time))
+
+    if not ok:
+        print('PARITY FAILED')
+        sys.exit(1)
@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+# Upload volume of --upload_mode raw / summary / hybrid on the recorded data.
+#
+# The accelerometer/magnetometer rows are replayed as if sampled every
+# --timestep_detect seconds and uploaded every --timestep_send seconds,
+# through the same StreamingFeatures / WindowAggregator / SimpleRequest.encodeBatch
+# path as the device, and every request body is measured the way
+# http_client.UploadClient sends it (gzip unless already compressed):
+#
+#   python bench_upload_modes.py --timestep_detect 0.1 --window_len 150
+import argparse
+import gzip
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'raspberry_code'))
+
+from dataset import load_dataset
+from features import empty_chair_stats
+
+from aggregation import WindowAggregator, UPLOAD_MODES
+from buffers import SampleBatch
+from SimpleRequest import SimpleRequest
+from streaming_features import StreamingFeatures
+
+PAYLOADS = ('records', 'columnar', 'binary')
+
+
+# Batches one run would upload, one dict per --timestep_send
+def replay(rows, mode, means_stds, args):
+    features = StreamingFeatures(means_stds.loc['Acc_z', 'mean'], means_stds.loc['Acc_z', 'std'], args.window_len)
+    aggregator = None
+    if mode != 'raw':
+        aggregator = WindowAggregator(mode, args.motion_threshold, 'replay', '', 'replay')
+    batch_size = int(args.timestep_send / args.timestep_detect)
+    step_ns = int(args.timestep_detect * 1e9)
+    batches = []
+    raw = None
+    for n, (mag, acc) in enumerate(rows):
+        t_ns = 10 ** 12 + n * step_ns
+        if n % batch_size == 0:
+            if n:
+                batches.append(aggregator.take() if aggregator is not None else raw)
+            raw = dict((typeSensor, SampleBatch(typeSensor, 'replay', '', 'replay'))
+                       for typeSensor in ('accelerometer', 'magnetometer'))
+        for typeSensor, xyz in (('magnetometer', mag), ('accelerometer', acc)):
+            if aggregator is not None:
+                aggregator.add(typeSensor, xyz, t_ns)
+            else:
+                raw[typeSensor].append(xyz[0], xyz[1], xyz[2], timestamp=t_ns)
+            if typeSensor == 'magnetometer':
+                features.update_magnetometer(*xyz)
+                continue
+            for window in features.update(*xyz):
+                if aggregator is not None:
+                    aggregator.finish_window(window)
+    return batches, aggregator
+
+
+def body_bytes(simple_request, batches):
+    n_bytes, n_requests = 0, 0
+    for batch in batches:
+        for sensor_batch in batch.values():
+            data, headers = simple_request.encodeBatch(sensor_batch)
+            if isinstance(data, str):
+                data = data.encode('utf-8')
+            if simple_request.client.gzip_body:
+                data = gzip.compress(data, 6)
+            n_bytes += len(data)
+            n_requests += 1
+    return n_bytes, n_requests
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--timestep_detect', type=float, default=0.1)
+    parser.add_argument('--timestep_send', type=float, default=10)
+    parser.add_argument('--window_len', type=int, default=150)
+    parser.add_argument('--motion_threshold', type=float, default=0.05)
+    parser.add_argument('--sources', type=str, default='2,3')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    df = load_dataset(args.sources.split(','))
+    means_stds = empty_chair_stats(df)
+    rows = list(zip(df[['Mag_x', 'Mag_y', 'Mag_z']].values.tolist(), df[['Acc_x', 'Acc_y', 'Acc_z']].values.tolist()))
+    hours = len(rows) * args.timestep_detect / 3600.0
+
+    print('%d readings per sensor at %.0f Hz (%.2f h), windows of %d, uploads every %g s' % (
+        len(rows), 1 / args.timestep_detect, hours, args.window_len, args.timestep_send))
+    print('%-8s %-9s %12s %11s %10s %11s' % ('mode', 'payload', 'bytes/hour', 'req/hour', 'vs raw', 'raw windows'))
+    for payload in PAYLOADS:
+        simple_request = SimpleRequest('http://localhost', payload=payload)
+        raw_bytes = None
+        for mode in UPLOAD_MODES:
+            batches, aggregator = replay(rows, mode, means_stds, args)
+            n_bytes, n_requests = body_bytes(simple_request, batches)
+            if raw_bytes is None:
+                raw_bytes = n_bytes
+            raw_windows = ''
+            if aggregator is not None:
+                raw_windows = '%d / %d' % (aggregator.raw_windows, aggregator.windows)
+            print('%-8s %-9s %12.0f %11.0f %9.1fx %11s' % (
+                mode, payload, n_bytes / hours, n_requests / hours, raw_bytes / float(n_bytes), raw_windows))
+        simple_request.close()
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+# Error of the on-device streaming features (raspberry_code/streaming_features.py)
+# against the batch notebook versions (features.py), window by window, for the
+# default exact windows and for the P2 estimates (exact=False). Rotational
+# movement is the same in both and compared with features.mag_masks (savgol).
+#
+# On accelerometer2/3.csv, 150-reading windows, |error| mean / p95 / max:
+#   Lean back              0       / 0      / 0        both
+#   Momentum               0       / 0      / 0        exact
+#                          0.0066  / 0.027  / 0.107    P2 (values 0 .. 0.107)
+#   Oscillations           0       / 0      / 0        exact
+#                          0.025   / 0.059  / 0.121    P2 (values 0.030 .. 1.08)
+#   Rotational movement    0.0065  / 0.017  / 0.020    both (values 0 .. 0.907)
+#
+#   python compare_streaming_features.py --window_len 150
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'raspberry_code'))
+
+from dataset import load_dataset
+from features import (ACC, ACC_Z, MAG, acc_masks, empty_chair_stats, lean_back_portion, mag_masks, make_windows,
+                      window_columns)
+from streaming_features import StreamingFeatures
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--window_len', type=int, default=150)
+    parser.add_argument('--step', type=int, default=None)
+    parser.add_argument('--sources', type=str, default='2,3')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    step = args.step or args.window_len
+
+    df = load_dataset(args.sources.split(','))
+    means_stds = empty_chair_stats(df)
+    acc_z_mean, acc_z_std = means_stds.loc['Acc_z', 'mean'], means_stds.loc['Acc_z', 'std']
+    data = window_columns(df)
+    windows = make_windows(data, args.window_len, step)
+
+    mask_calm_acc, oscillation_acc = acc_masks(windows[:, :, ACC])
+    batch = {
+        'Lean back': lean_back_portion(windows[:, :, ACC_Z], acc_z_mean, acc_z_std),
+        'Momentum': 1 - mask_calm_acc.all(axis=2).mean(axis=1),
+        'Oscillations': oscillation_acc[:, ACC_Z],
+        'Rotational movement': 1 - mag_masks(windows[:, :, MAG]).all(axis=2).mean(axis=1),
+    }
+
+    for exact in (True, False):
+        features = StreamingFeatures(acc_z_mean, acc_z_std, args.window_len, step, exact=exact)
+        streamed = []
+        start = time.perf_counter()
+        for acc, mag in zip(data[:, ACC].tolist(), data[:, MAG].tolist()):
+            features.update_magnetometer(*mag)
+            streamed.extend(features.update(*acc))
+        elapsed = time.perf_counter() - start
+        print('%s: %d windows, %.1f us per accelerometer + magnetometer reading' % (
+            'exact' if exact else 'P2', len(streamed), elapsed / len(data) * 1e6))
+
+        for name in ('Lean back', 'Momentum', 'Oscillations', 'Rotational movement'):
+            expected = batch[name][:len(streamed)]
+            error = np.abs(np.array([window[name] for window in streamed]) - expected)
+            print('  %-19s range %8.3f .. %-8.3f |error| mean %.4f  p95 %.4f  max %.4f' % (
+                name, np.nanmin(expected), np.nanmax(expected),
+                np.nanmean(error), np.nanpercentile(error, 95), np.nanmax(error)))
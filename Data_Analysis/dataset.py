@@ -0,0 +1,237 @@
+# -*- coding: utf-8 -*-
+# One loader for the accelerometer*/magnetometer* CSVs in data/.
+#
+# Every CSV is parsed once into a typed columnar cache under
+# data/.cache/<csv name>/ (one .npy per column: int16 axes, int64 id and
+# datetime64 date_created, label/people_id as int16 category codes, plus a
+# meta.json with the categories and the fingerprint of the source). The cache
+# is rebuilt when the source's size or mtime changes and its sha1 differs, so a
+# fresh checkout or touched file costs one hash, not a re-parse.
+#
+#   from dataset import load_dataset, load_sensor
+#   df = load_dataset()             # same columns as the notebooks after rename_dict
+#   df = load_dataset(['2', '3'])   # only accelerometer2/3 + magnetometer2/3
+#   df_acc = load_sensor('accelerometer')   # one sensor with its own id/date_created
+import argparse
+import hashlib
+import json
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+CACHE_VERSION = 2
+
+# '' is accelerometer.csv / magnetometer.csv, '1' accelerometer1.csv / ... and so on
+SOURCES = ('', '1', '2', '3')
+SENSORS = ('accelerometer', 'magnetometer')
+
+rename_dict = {
+    'x': 'Mag_x',
+    'y': 'Mag_y',
+    'z': 'Mag_z',
+    'ax': 'Acc_x',
+    'ay': 'Acc_y',
+    'az': 'Acc_z',
+}
+AXES = tuple(rename_dict.values())
+SENSOR_AXES = {
+    'accelerometer': ('Acc_x', 'Acc_y', 'Acc_z'),
+    'magnetometer': ('Mag_x', 'Mag_y', 'Mag_z'),
+}
+CATEGORIES = ('label', 'people_id')
+
+
+def _csv_path(sensor, source, data_dir):
+    return os.path.join(data_dir, '%s%s.csv' % (sensor, source))
+
+
+def _cache_dir(sensor, source, data_dir):
+    return os.path.join(data_dir, '.cache', '%s%s' % (sensor, source))
+
+
+def _sha1(path):
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _stat(path):
+    st = os.stat(path)
+    return {'size': st.st_size, 'mtime_ns': st.st_mtime_ns}
+
+
+def _read_meta(cache_dir):
+    try:
+        with open(os.path.join(cache_dir, 'meta.json')) as f:
+            return json.load(f)
+    except (IOError, OSError, ValueError):
+        return None
+
+
+def _write_meta(cache_dir, meta):
+    tmp = os.path.join(cache_dir, 'meta.json.tmp')
+    with open(tmp, 'w') as f:
+        json.dump(meta, f, indent=2)
+    os.replace(tmp, os.path.join(cache_dir, 'meta.json'))
+
+
+# True if the cache still matches the CSV. Only hashes a source whose
+# size/mtime moved, and records the new mtime when the content is unchanged.
+def _is_fresh(meta, path, cache_dir):
+    if meta is None or meta.get('version') != CACHE_VERSION:
+        return False
+    fingerprint = meta['source']
+    stat = _stat(path)
+    if stat['size'] == fingerprint['size'] and stat['mtime_ns'] == fingerprint['mtime_ns']:
+        return True
+    if stat['size'] != fingerprint['size'] or _sha1(path) != fingerprint['sha1']:
+        return False
+    fingerprint.update(stat)
+    _write_meta(cache_dir, meta)
+    return True
+
+
+def _as_int16(values, name):
+    values = np.asarray(values)
+    if values.min() < -32768 or values.max() > 32767:
+        raise ValueError('%s does not fit into int16' % name)
+    return values.astype(np.int16)
+
+
+def _as_codes(series):
+    # Labels are sometimes parsed as numbers (accelerometer3.csv), keep them as text
+    series = series.where(series.isna(), series.astype(str))
+    categorical = pd.Categorical(series)
+    return categorical.codes.astype(np.int16), [str(category) for category in categorical.categories]
+
+
+# Parses one CSV and writes its cache
+def build_cache(sensor, source, data_dir=DATA_DIR):
+    path = _csv_path(sensor, source, data_dir)
+    df = pd.read_csv(path)
+    df.rename(columns=rename_dict, inplace=True)
+
+    columns = {
+        'id': df['id'].values.astype(np.int64),
+        'date_created': pd.to_datetime(df['date_created']).values.astype('datetime64[ns]'),
+    }
+    for axis in SENSOR_AXES[sensor]:
+        columns[axis] = _as_int16(df[axis].values, axis)
+    categories = {}
+    for name in CATEGORIES:
+        columns[name], categories[name] = _as_codes(df[name])
+
+    cache_dir = _cache_dir(sensor, source, data_dir)
+    if not os.path.isdir(cache_dir):
+        os.makedirs(cache_dir)
+    for name, values in columns.items():
+        np.save(os.path.join(cache_dir, name + '.npy'), values)
+    meta = {
+        'version': CACHE_VERSION,
+        'rows': len(df),
+        'columns': sorted(columns),
+        'categories': categories,
+        'source': dict(_stat(path), sha1=_sha1(path)),
+    }
+    _write_meta(cache_dir, meta)
+    return meta
+
+
+def _load_csv(sensor, source, data_dir, columns):
+    path = _csv_path(sensor, source, data_dir)
+    cache_dir = _cache_dir(sensor, source, data_dir)
+    meta = _read_meta(cache_dir)
+    if not _is_fresh(meta, path, cache_dir):
+        meta = build_cache(sensor, source, data_dir)
+    data = {}
+    for name in columns:
+        values = np.load(os.path.join(cache_dir, name + '.npy'))
+        if name in CATEGORIES:
+            values = pd.Categorical.from_codes(values, meta['categories'][name])
+        data[name] = values
+    return pd.DataFrame(data, columns=list(columns))
+
+
+# sha1 of every CSV behind load_dataset(sources), from the cache metadata, so
+# caches of anything derived from the data can be keyed by its content
+def fingerprint(sources=SOURCES, data_dir=DATA_DIR):
+    digests = {}
+    for sensor in SENSORS:
+        for source in sources:
+            cache_dir = _cache_dir(sensor, source, data_dir)
+            meta = _read_meta(cache_dir)
+            if not _is_fresh(meta, _csv_path(sensor, source, data_dir), cache_dir):
+                meta = build_cache(sensor, source, data_dir)
+            digests['%s%s' % (sensor, source)] = meta['source']['sha1']
+    return digests
+
+
+# Concatenates per-source frames, label/people_id become categoricals over the
+# union of all sources and `source` tells which CSV a row came from
+def _concat(frames, sources, with_source):
+    for name in CATEGORIES:
+        if name in frames[0]:
+            union = pd.api.types.union_categoricals([frame[name] for frame in frames])
+            for frame in frames:
+                frame[name] = pd.Categorical(frame[name], categories=union.categories)
+    if with_source:
+        for frame, source in zip(frames, sources):
+            frame['source'] = source
+    df = pd.concat(frames, ignore_index=True)
+    if with_source:
+        df['source'] = df['source'].astype('category')
+    return df
+
+
+# One sensor, every row with its own id and date_created
+def load_sensor(sensor, sources=SOURCES, data_dir=DATA_DIR, columns=None, with_source=True):
+    if columns is None:
+        columns = ('id', 'date_created') + CATEGORIES + SENSOR_AXES[sensor]
+    frames = [_load_csv(sensor, source, data_dir, columns) for source in sources]
+    return _concat(frames, sources, with_source)
+
+
+# The merged dataset of the given sources, in order. Columns are the notebooks'
+# label, people_id, Mag_*, Acc_* plus date_created. Like the notebooks, the
+# accelerometer axes are joined to the magnetometer rows by position; see
+# alignment.py for a merge by time.
+def load_dataset(sources=SOURCES, data_dir=DATA_DIR, columns=None, with_source=True):
+    if columns is None:
+        columns = CATEGORIES + AXES + ('date_created',)
+    mag_columns = [name for name in columns if name not in SENSOR_AXES['accelerometer']]
+    acc_columns = [name for name in columns if name in SENSOR_AXES['accelerometer']]
+    frames = []
+    for source in sources:
+        frame = _load_csv('magnetometer', source, data_dir, mag_columns)
+        if acc_columns:
+            frame = frame.join(_load_csv('accelerometer', source, data_dir, acc_columns))
+        frames.append(frame[list(columns)])
+    return _concat(frames, sources, with_source)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--data_dir', type=str, default=DATA_DIR)
+    parser.add_argument('--rebuild', type=bool, default=False)
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+
+    if args.rebuild:
+        start = time.perf_counter()
+        for sensor in SENSORS:
+            for source in SOURCES:
+                build_cache(sensor, source, args.data_dir)
+        print('Cache rebuilt in %.1f ms' % ((time.perf_counter() - start) * 1e3))
+
+    start = time.perf_counter()
+    df = load_dataset(data_dir=args.data_dir)
+    print('Loaded %d rows in %.1f ms' % (len(df), (time.perf_counter() - start) * 1e3))
+    print(df.dtypes)
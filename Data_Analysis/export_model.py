@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+# Trains a stress classifier on the window features and exports it, with the
+# minmax_scale bounds, for raspberry_code/predictor.py:
+#
+#   python export_model.py --model random_forest --output ../raspberry_code/stress_model.npz
+#
+# In a notebook, any fitted model of the supported kinds exports with
+#   export_model('stress_model.npz', clf, X_train.min(axis=0), X_train.max(axis=0), feature_names)
+import argparse
+import os
+import sys
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'raspberry_code'))
+
+from dataset import load_dataset
+from features import FEATURES, binary_stress, compute_features, empty_chair_stats, session_windows, stress_classes
+from predictor import StressModel
+
+
+# How sklearn turns the decision values of a multi-class model into
+# probabilities: 'multinomial' (softmax) or 'ovr' (one sigmoid per class,
+# normalized). LogisticRegression is multinomial unless multi_class='ovr' or
+# the liblinear solver, which only fits one-vs-rest.
+def _multi_class(model):
+    from sklearn.multiclass import OneVsRestClassifier
+    if isinstance(model, OneVsRestClassifier) or not hasattr(model, 'predict_proba'):
+        return 'ovr'
+    multi_class = getattr(model, 'multi_class', 'auto')
+    if multi_class == 'ovr' or multi_class in ('auto', 'deprecated', 'warn') and model.solver == 'liblinear':
+        return 'ovr'
+    return 'multinomial'
+
+
+def _linear_arrays(model):
+    from sklearn.multiclass import OneVsRestClassifier
+    if isinstance(model, OneVsRestClassifier):
+        estimators = model.estimators_
+        coef = np.vstack([estimator.coef_ for estimator in estimators])
+        intercept = np.hstack([np.ravel(estimator.intercept_) for estimator in estimators])
+        multilabel = model.label_binarizer_.y_type_ == 'multilabel-indicator'
+        first = estimators[0]
+    else:
+        coef, intercept, multilabel, first = model.coef_, np.ravel(model.intercept_), False, model
+    return {
+        'kind': 'linear',
+        'coef': coef,
+        'intercept': intercept,
+        'link': 'logistic' if hasattr(first, 'predict_proba') else 'none',
+        'multi_class': _multi_class(model),
+        'multilabel': multilabel,
+    }
+
+
+def _forest_arrays(model):
+    trees = [estimator.tree_ for estimator in getattr(model, 'estimators_', [model])]
+    offsets = np.cumsum([0] + [tree.node_count for tree in trees[:-1]])
+    children_left, children_right = [], []
+    for tree, offset in zip(trees, offsets):
+        for children, out in ((tree.children_left, children_left), (tree.children_right, children_right)):
+            out.append(np.where(children >= 0, children + offset, -1))
+    value = np.vstack([tree.value[:, 0, :] for tree in trees]).astype(np.float64)
+    value /= np.maximum(value.sum(axis=1, keepdims=True), 1e-12)
+    return {
+        'kind': 'forest',
+        'children_left': np.concatenate(children_left).astype(np.int32),
+        'children_right': np.concatenate(children_right).astype(np.int32),
+        'feature': np.concatenate([np.maximum(tree.feature, 0) for tree in trees]).astype(np.int32),
+        'threshold': np.concatenate([tree.threshold for tree in trees]).astype(np.float64),
+        'value': value,
+        'tree_roots': offsets.astype(np.int32),
+        'multilabel': False,
+    }
+
+
+def export_model(path, model, data_min, data_max, feature_names=FEATURES):
+    if hasattr(model, 'estimators_') and hasattr(model.estimators_[0], 'tree_') or hasattr(model, 'tree_'):
+        arrays = _forest_arrays(model)
+    else:
+        arrays = _linear_arrays(model)
+    arrays.update({
+        'feature_names': np.array(feature_names),
+        'classes': np.asarray(model.classes_) if not arrays['multilabel'] else np.arange(len(arrays['intercept'])),
+        'data_min': np.asarray(data_min, dtype=np.float64),
+        'data_max': np.asarray(data_max, dtype=np.float64),
+    })
+    np.savez_compressed(path, **arrays)
+
+
+def make_model(name):
+    from sklearn.ensemble import RandomForestClassifier
+    from sklearn.linear_model import LogisticRegression
+    from sklearn.svm import LinearSVC
+    return {
+        'logistic': lambda: LogisticRegression(),
+        'linear_svc': lambda: LinearSVC(random_state=42),
+        'random_forest': lambda: RandomForestClassifier(n_estimators=36, random_state=24),
+    }[name]()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--model', type=str, default='random_forest', choices=('logistic', 'linear_svc', 'random_forest'))
+    parser.add_argument('--target', type=str, default='binary', choices=('binary', 'classes'))
+    parser.add_argument('--window_len', type=int, default=150)
+    parser.add_argument('--output', type=str, default='stress_model.npz')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    from sklearn.preprocessing import minmax_scale
+
+    df = load_dataset()
+    windows, stress, _ = session_windows(df, args.window_len)
+    features = compute_features(windows, empty_chair_stats(df))[0]
+    X = np.column_stack([features[name] for name in FEATURES])
+    y = binary_stress(stress) if args.target == 'binary' else stress_classes(stress)
+
+    model = make_model(args.model).fit(minmax_scale(X), y)
+    export_model(args.output, model, X.min(axis=0), X.max(axis=0))
+
+    exported = StressModel.load(args.output)
+    agreement = (exported.predict(X) == model.predict(minmax_scale(X))).mean()
+    print('%s on %d windows, exported to %s (%d bytes), predictions identical for %.1f%% of windows' % (
+        args.model, len(X), args.output, os.path.getsize(args.output), agreement * 100))
+    if hasattr(model, 'predict_proba'):
+        proba_error = np.abs(exported.predict_proba(X) - model.predict_proba(minmax_scale(X))).max()
+        print('predict_proba differs from scikit-learn by at most %.2g' % proba_error)
+        if proba_error > 1e-6:
+            sys.exit('exported probabilities do not match scikit-learn')
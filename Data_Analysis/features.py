@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+# Batched versions of the Final_project_1.ipynb features.
+#
+# Input is one (n_windows, window_len, 6) array with the columns WINDOW_COLUMNS,
+# usually a copy-free sliding window view made by make_windows. Every feature is
+# computed for all windows and axes at once:
+#   Lean back            share of Acc_z below the empty chair mean - n_sigma * std
+#   Momentum             share of samples where any accelerometer axis leaves its calm band
+#   Oscillations         Acc_z spread inside the 10..90 percentile band / (25 * n_sigma)
+#   Rotational movement  share of samples where any magnetometer axis moves faster
+#                        than max_calm_derivative
+#
+# The magnetometer derivative comes from a Savitzky-Golay filter (one matrix
+# product for all windows) by default; mag_method='spline' is the notebook's
+# splrep/splev smoothing spline, kept as the reference. python compare_derivative.py
+# reports how well the two masks agree.
+#
+#   windows = make_windows(window_columns(df), window_len=150)
+#   features = features_frame(windows, empty_chair_stats(df))
+#
+# With step == window_len (the default) the windows are the notebook's
+# X.Acc_x.values.reshape(-1, num_timestamp) rows.
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+
+WINDOW_COLUMNS = ('Acc_x', 'Acc_y', 'Acc_z', 'Mag_x', 'Mag_y', 'Mag_z')
+FEATURES = ('Lean back', 'Momentum', 'Rotational movement', 'Oscillations')
+ACC = slice(0, 3)
+MAG = slice(3, 6)
+ACC_Z = 2
+
+
+def window_columns(df):
+    return np.ascontiguousarray(df[list(WINDOW_COLUMNS)].values)
+
+
+# (n_windows, window_len, n_columns) view of an (n_samples, n_columns) array,
+# one window every `step` samples, without copying
+def make_windows(data, window_len=150, step=None):
+    data = np.asarray(data)
+    if step is None:
+        step = window_len
+    if len(data) < window_len:
+        return np.empty((0, window_len, data.shape[1]), dtype=data.dtype)
+    windows = np.lib.stride_tricks.sliding_window_view(data, window_len, axis=0)[::step]
+    return windows.transpose(0, 2, 1)
+
+
+# Mean and std of every column on the empty chair (people_id == 'noone'),
+# the notebook's means_stds as a DataFrame indexed by column name
+def empty_chair_stats(df, people_id='noone'):
+    df_noone = df.loc[df['people_id'] == people_id, list(WINDOW_COLUMNS)]
+    return pd.DataFrame({'mean': df_noone.mean(axis=0), 'std': df_noone.std(axis=0)})
+
+
+def lean_back_portion(acc_z, acc_z_mean, acc_z_std, n_sigma=5):
+    return (acc_z < acc_z_mean - n_sigma * acc_z_std).mean(axis=-1)
+
+
+# get_mess_mask_acc for (n_windows, window_len, n_axes): calm masks of the same
+# shape and oscillations of shape (n_windows, n_axes)
+def acc_masks(acc, percentile2crop=10, n_sigma=10):
+    lower, upper, median = np.percentile(acc, [percentile2crop, 100 - percentile2crop, 50], axis=1)
+    inner = (lower[:, None] < acc) & (acc < upper[:, None])
+    count = inner.sum(axis=1)
+    # np.std of the values strictly inside the band, NaN when there are none
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = np.where(inner, acc, 0).sum(axis=1) / count
+        std = np.sqrt(np.where(inner, (acc - mean[:, None]) ** 2, 0).sum(axis=1) / count)
+    oscillation = std / (25 * n_sigma)
+    mask_calm = (median - n_sigma * std)[:, None] < acc
+    mask_calm &= acc < (median + n_sigma * std)[:, None]
+    return mask_calm, oscillation
+
+
+# (window_len, window_len) matrix D with D.dot(series) = first derivative of
+# the series by a Savitzky-Golay filter: a least-squares polynomial of degree
+# polyorder over savgol_window samples around each point (shifted inwards at the
+# edges, like scipy's mode='interp'). For polyorder 2 the interior rows are
+# k / sum(k^2), k = -m..m, the form streaming_features.SavgolDerivative uses.
+@lru_cache(maxsize=16)
+def savgol_derivative_matrix(window_len, savgol_window=5, polyorder=2):
+    half = savgol_window // 2
+    matrix = np.zeros((window_len, window_len))
+    for i in range(window_len):
+        start = min(max(i - half, 0), window_len - savgol_window)
+        rows = np.arange(start, start + savgol_window)
+        vandermonde = np.vander(rows - i, polyorder + 1, increasing=True).astype(np.float64)
+        matrix[i, rows] = np.linalg.pinv(vandermonde)[1]
+    return matrix
+
+
+def _spline_derivatives(mag, w):
+    from scipy.interpolate import splev, splrep
+    n_windows, window_len, n_axes = mag.shape
+    x = np.arange(window_len)
+    weights = w * np.ones(window_len)
+    derivatives = np.empty(mag.shape)
+    for n in range(n_windows):
+        for axis in range(n_axes):
+            splines = splrep(x, mag[n, :, axis], w=weights)
+            derivatives[n, :, axis] = splev(x, splines, der=1)
+    return derivatives
+
+
+# First derivative per sample of (n_windows, window_len, n_axes) readings.
+# method 'savgol': Savitzky-Golay, all windows in one matrix product.
+# method 'spline': the notebook's smoothing spline, one FITPACK call per
+# window and axis.
+def mag_derivatives(mag, method='savgol', w=0.05, savgol_window=5, polyorder=2):
+    if method == 'spline':
+        return _spline_derivatives(mag, w)
+    if method != 'savgol':
+        raise ValueError('unknown derivative method ' + repr(method))
+    matrix = savgol_derivative_matrix(mag.shape[1], savgol_window, polyorder)
+    return np.matmul(matrix, mag.astype(np.float64))
+
+
+# get_mess_mask_mag for (n_windows, window_len, n_axes): |d/dt| below
+# max_calm_derivative
+def mag_masks(mag, w=0.05, max_calm_derivative=30, method='savgol', savgol_window=5, polyorder=2):
+    return np.abs(mag_derivatives(mag, method, w, savgol_window, polyorder)) < max_calm_derivative
+
+
+# All four features for every window. means_stds: empty_chair_stats() or
+# anything with means_stds.loc['Acc_z', 'mean'] / ['std'].
+# Returns (features dict of (n_windows,) arrays, acc masks, mag masks).
+def compute_features(windows, means_stds, n_sigma_lean=5, percentile2crop=10, n_sigma_acc=10,
+                     w=0.05, max_calm_derivative=30, mag_method='savgol'):
+    acc, mag = windows[:, :, ACC], windows[:, :, MAG]
+    mask_calm_acc, oscillation_acc = acc_masks(acc, percentile2crop, n_sigma_acc)
+    mask_calm_mag = mag_masks(mag, w, max_calm_derivative, mag_method)
+    features = {
+        'Lean back': lean_back_portion(windows[:, :, ACC_Z], means_stds.loc['Acc_z', 'mean'],
+                                       means_stds.loc['Acc_z', 'std'], n_sigma_lean),
+        'Momentum': 1 - mask_calm_acc.all(axis=2).mean(axis=1),
+        'Rotational movement': 1 - mask_calm_mag.all(axis=2).mean(axis=1),
+        'Oscillations': oscillation_acc[:, ACC_Z],
+    }
+    return features, mask_calm_acc, mask_calm_mag
+
+
+# The notebook's df_features
+def features_frame(windows, means_stds, **kwargs):
+    features = compute_features(windows, means_stds, **kwargs)[0]
+    return pd.DataFrame(features, columns=list(FEATURES))
+
+
+# Windows cut inside every people_id/label session with a numeric stress label
+# (the notebook's lab2 part of the data), so no window straddles two sessions.
+# Returns (windows, stress labels 0..100, people_id of every window).
+def session_windows(df, window_len=150, step=None):
+    from alignment import session_bounds
+    data = window_columns(df)
+    labels = df['label'].astype(str).values
+    people = df['people_id'].astype(str).values
+    parts, stress, groups = [], [], []
+    for start, stop in session_bounds(df):
+        if not labels[start].isdigit():
+            continue
+        windows = make_windows(data[start:stop], window_len, step)
+        parts.append(windows)
+        stress.extend([int(labels[start])] * len(windows))
+        groups.extend([people[start]] * len(windows))
+    if not parts:
+        return np.empty((0, window_len, len(WINDOW_COLUMNS)), dtype=data.dtype), np.empty(0, dtype=int), np.empty(0, dtype=object)
+    return np.concatenate(parts), np.array(stress), np.array(groups, dtype=object)
+
+
+# The notebook's targets: stress / 100 binarized at 0.64, or four classes
+# <=25, <=50, <=75, above
+def binary_stress(stress, threshold=0.64):
+    return (np.asarray(stress) / 100.0 > threshold).astype(int)
+
+
+def stress_classes(stress):
+    return np.digitize(np.asarray(stress), [25, 50, 75], right=True)
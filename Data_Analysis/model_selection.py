@@ -0,0 +1,262 @@
+# -*- coding: utf-8 -*-
+# Grouped cross-validation and hyperparameter search for the stress models,
+# the replacement for validation_mine / custom_cross_validate / do_grid_search
+# in Final_project_1.ipynb:
+#
+#   python model_selection.py --models logistic,random_forest --feature_sets features,features+stats
+#
+# - Folds never split a person (--group_by people) or a recording session
+#   (--group_by session): GroupKFold, or LeaveOneGroupOut with --n_splits 0.
+#   The notebook's KFold(shuffle=True) put windows of the same person on
+#   both sides.
+# - Min-max scaling is fitted inside every fold.
+# - Every (candidate, fold) pair is one task on a process pool (--n_jobs).
+# - Feature matrices are cached in data/.cache/features/<key>.npz, keyed by
+#   the sha1 of the source CSVs, of features.py and model_selection.py and of
+#   the window and feature set parameters, so repeated searches load them
+#   instead of recomputing.
+# - Every run appends one row per candidate to --report (CSV) and prints the
+#   best score of every model and feature set over all runs in that file.
+import argparse
+import hashlib
+import json
+import os
+import time
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from dataset import DATA_DIR, fingerprint, load_dataset
+from features import (FEATURES, WINDOW_COLUMNS, binary_stress, compute_features, empty_chair_stats,
+                      session_windows, stress_classes)
+
+FEATURE_CACHE_VERSION = 1
+FEATURE_CACHE_DIR = os.path.join(DATA_DIR, '.cache', 'features')
+FEATURES_SOURCE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'features.py')
+# Builds the 'stats' and 'features+stats' matrices (_window_stats)
+MODEL_SELECTION_SOURCE = os.path.abspath(__file__)
+
+# Same searches as the notebook's do_grid_search, plus the linear models
+SEARCH_SPACES = {
+    'logistic': {'C': [0.01, 0.1, 1.0, 10.0, 100.0]},
+    'linear_svc': {'C': [0.01, 0.1, 1.0, 10.0]},
+    'random_forest': {
+        'max_depth': [3, None],
+        'max_features': [1, 2, 'sqrt', None],
+        'min_samples_split': [2, 5, 10],
+        'bootstrap': [True, False],
+        'criterion': ['gini', 'entropy'],
+    },
+}
+METRICS = ('accuracy', 'balanced_accuracy', 'f1_macro', 'train_accuracy')
+
+
+def _window_stats(windows):
+    names = ['%s %s' % (column, stat) for stat in ('mean', 'std', 'min', 'max') for column in WINDOW_COLUMNS]
+    matrix = np.hstack([windows.mean(axis=1), windows.std(axis=1), windows.min(axis=1), windows.max(axis=1)])
+    return matrix, names
+
+
+def _window_features(windows, means_stds):
+    features = compute_features(windows, means_stds)[0]
+    return np.column_stack([features[name] for name in FEATURES]), list(FEATURES)
+
+
+def _features_and_stats(windows, means_stds):
+    features, feature_names = _window_features(windows, means_stds)
+    stats, stat_names = _window_stats(windows)
+    return np.hstack([features, stats]), feature_names + stat_names
+
+
+# feature set name -> function(windows, means_stds) returning (matrix, column names)
+FEATURE_SETS = {
+    'features': _window_features,
+    'stats': lambda windows, means_stds: _window_stats(windows),
+    'features+stats': _features_and_stats,
+}
+
+
+def _sha1_file(path):
+    with open(path, 'rb') as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+def feature_key(sources, feature_set, window_len, step):
+    description = {
+        'version': FEATURE_CACHE_VERSION,
+        'data': fingerprint(sources),
+        'features.py': _sha1_file(FEATURES_SOURCE),
+        'model_selection.py': _sha1_file(MODEL_SELECTION_SOURCE),
+        'feature_set': feature_set,
+        'window_len': window_len,
+        'step': step,
+    }
+    return hashlib.sha1(json.dumps(description, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+# Path of the cached matrix of one feature set, computed on a miss. The .npz
+# holds X, names, stress (0..100), people and session of every window.
+def feature_matrix(sources, feature_set, window_len=150, step=None):
+    key = feature_key(sources, feature_set, window_len, step)
+    path = os.path.join(FEATURE_CACHE_DIR, key + '.npz')
+    if os.path.exists(path):
+        return path, True
+    df = load_dataset(sources)
+    windows, stress, people = session_windows(df, window_len, step)
+    X, names = FEATURE_SETS[feature_set](windows, empty_chair_stats(df))
+    sessions = np.array(['%s/%d' % pair for pair in zip(people, stress)])
+    if not os.path.isdir(FEATURE_CACHE_DIR):
+        os.makedirs(FEATURE_CACHE_DIR)
+    tmp = path + '.tmp.npz'
+    np.savez(tmp, X=X, names=np.array(names), stress=stress, people=people.astype(str), sessions=sessions)
+    os.replace(tmp, path)
+    return path, False
+
+
+def load_matrix(path, target='binary', group_by='people'):
+    with np.load(path, allow_pickle=False) as data:
+        y = binary_stress(data['stress']) if target == 'binary' else stress_classes(data['stress'])
+        groups = data['people'] if group_by == 'people' else data['sessions']
+        return data['X'], y, groups
+
+
+def make_folds(y, groups, n_splits=5):
+    from sklearn.model_selection import GroupKFold, LeaveOneGroupOut
+    n_groups = len(np.unique(groups))
+    if n_splits == 0 or n_splits >= n_groups:
+        cv = LeaveOneGroupOut()
+    else:
+        cv = GroupKFold(n_splits=n_splits)
+    return list(cv.split(np.zeros((len(y), 1)), y, groups))
+
+
+# Every grid point, or n_iter of them sampled like RandomizedSearchCV
+def candidates(model, n_iter=None, random_state=24):
+    from sklearn.model_selection import ParameterGrid, ParameterSampler
+    grid = ParameterGrid(SEARCH_SPACES[model])
+    if n_iter is None or n_iter >= len(grid):
+        return list(grid)
+    return list(ParameterSampler(SEARCH_SPACES[model], n_iter, random_state=random_state))
+
+
+_worker_data = {}
+
+
+def _init_worker(path, target, group_by):
+    warnings.filterwarnings('ignore')
+    _worker_data['X'], _worker_data['y'], _ = load_matrix(path, target, group_by)
+
+
+# One candidate on one fold, in a pool process
+def _evaluate(task):
+    from sklearn.metrics import accuracy_score, balanced_accuracy_score, f1_score
+    from sklearn.pipeline import make_pipeline
+    from sklearn.preprocessing import MinMaxScaler
+    from export_model import make_model
+    model, params, train, test = task
+    X, y = _worker_data['X'], _worker_data['y']
+    estimator = make_pipeline(MinMaxScaler(), make_model(model).set_params(**params))
+    start = time.perf_counter()
+    try:
+        estimator.fit(X[train], y[train])
+    except ValueError:
+        # e.g. a training fold with a single class
+        return dict((name, np.nan) for name in METRICS + ('fit_s',))
+    fit_s = time.perf_counter() - start
+    predicted = estimator.predict(X[test])
+    return {
+        'accuracy': accuracy_score(y[test], predicted),
+        'balanced_accuracy': balanced_accuracy_score(y[test], predicted),
+        'f1_macro': f1_score(y[test], predicted, average='macro'),
+        'train_accuracy': accuracy_score(y[train], estimator.predict(X[train])),
+        'fit_s': fit_s,
+    }
+
+
+# Scores of every candidate of every model on one cached matrix, as rows of
+# mean and std over the folds
+def search(path, models, target='binary', group_by='people', n_splits=5, n_iter=None, n_jobs=None):
+    X, y, groups = load_matrix(path, target, group_by)
+    folds = make_folds(y, groups, n_splits)
+    tasks, keys = [], []
+    for model in models:
+        for params in candidates(model, n_iter):
+            for train, test in folds:
+                tasks.append((model, params, train, test))
+                keys.append((model, json.dumps(params, sort_keys=True)))
+
+    with ProcessPoolExecutor(max_workers=n_jobs, initializer=_init_worker,
+                             initargs=(path, target, group_by)) as pool:
+        results = list(pool.map(_evaluate, tasks, chunksize=max(1, len(tasks) // (8 * (n_jobs or os.cpu_count() or 1)))))
+
+    scores = pd.DataFrame(results)
+    scores['model'] = [key[0] for key in keys]
+    scores['params'] = [key[1] for key in keys]
+    rows = scores.groupby(['model', 'params'], sort=False).agg(['mean', 'std'])
+    rows.columns = ['%s_%s' % column for column in rows.columns]
+    rows['n_folds'] = len(folds)
+    return rows.reset_index()
+
+
+# Best row of every model and feature set over all runs in the report
+def best_per_model(report, score='balanced_accuracy'):
+    ranked = report.sort_values(score + '_mean', ascending=False)
+    best = ranked.groupby(['feature_set', 'model', 'target', 'group_by'], sort=False).head(1)
+    return best[['feature_set', 'model', 'target', 'group_by', 'window_len', score + '_mean', score + '_std', 'params', 'run']]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--models', type=str, default='logistic,linear_svc,random_forest')
+    parser.add_argument('--feature_sets', type=str, default='features,stats,features+stats')
+    parser.add_argument('--target', type=str, default='binary', choices=('binary', 'classes'))
+    parser.add_argument('--group_by', type=str, default='people', choices=('people', 'session'))
+    parser.add_argument('--n_splits', type=int, default=5)
+    parser.add_argument('--n_iter', type=int, default=None)
+    parser.add_argument('--n_jobs', type=int, default=None)
+    parser.add_argument('--window_len', type=int, default=150)
+    parser.add_argument('--step', type=int, default=None)
+    parser.add_argument('--sources', type=str, default='')
+    parser.add_argument('--score', type=str, default='balanced_accuracy', choices=METRICS)
+    parser.add_argument('--report', type=str, default='model_selection.csv')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    from dataset import SOURCES
+    sources = args.sources.split(',') if args.sources else list(SOURCES)
+    models = args.models.split(',')
+    run = time.strftime('%Y-%m-%dT%H:%M:%S')
+
+    rows = []
+    for feature_set in args.feature_sets.split(','):
+        start = time.perf_counter()
+        path, cached = feature_matrix(sources, feature_set, args.window_len, args.step)
+        features_s = time.perf_counter() - start
+        start = time.perf_counter()
+        result = search(path, models, args.target, args.group_by, args.n_splits, args.n_iter, args.n_jobs)
+        print('%-15s features %s in %.2f s, %d candidates x %d folds in %.1f s' % (
+            feature_set, 'cached' if cached else 'computed', features_s,
+            len(result), result['n_folds'].iloc[0], time.perf_counter() - start))
+        result.insert(0, 'run', run)
+        result.insert(1, 'feature_set', feature_set)
+        result.insert(2, 'feature_key', os.path.basename(path)[:12])
+        result.insert(3, 'sources', ','.join(sources))
+        result.insert(4, 'window_len', args.window_len)
+        result.insert(5, 'step', args.step or args.window_len)
+        result.insert(6, 'target', args.target)
+        result.insert(7, 'group_by', args.group_by)
+        rows.append(result)
+
+    run_rows = pd.concat(rows, ignore_index=True)
+    run_rows.to_csv(args.report, mode='a', header=not os.path.exists(args.report), index=False)
+
+    score = args.score + '_mean'
+    print('\nTop candidates of this run by %s:' % args.score)
+    top = run_rows.sort_values(score, ascending=False).head(5)
+    print(top[['feature_set', 'model', score, args.score + '_std', 'train_accuracy_mean', 'params']].to_string(index=False))
+    print('\nBest per model and feature set in %s:' % args.report)
+    print(best_per_model(pd.read_csv(args.report), args.score).to_string(index=False))
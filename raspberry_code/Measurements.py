@@ -5,18 +5,16 @@ from datetime import datetime
 import sys
 import time
 import argparse
-import FaBo9Axis_MPU9250
 import time
 import sys
-import joblib
 import os
 
+from scheduler import FixedRateScheduler
+
 sys.path.append('../')
 
 TIME_FORMAT = '%H:%M:%S'
 
-mpu9250 = FaBo9Axis_MPU9250.MPU9250()
-
 # class SimpleRequest:
 #
 #     url = ""
@@ -85,6 +83,7 @@ def parse_args():
     parser.add_argument('--meta', type=str, default='')
     parser.add_argument('--peopleId', type=str, default='')
     parser.add_argument('--folder', type=str, default=None)
+    parser.add_argument('--format', type=str, default='recording', choices=['recording', 'joblib'])
     return parser.parse_args()
 
 
@@ -101,10 +100,15 @@ if __name__ == '__main__':
     send_data = args.send_data
     save_data = args.save_data
     folder = args.folder
+    save_format = args.format
 
     batch_size = int(timestep_send / timestep_detect)  # Количество измерений в одной отправке
     n_batches = int(max_time / timestep_send) # Количество отправок
 
+    # Imported and created here so the module can be imported without the sensor
+    import FaBo9Axis_MPU9250
+    mpu9250 = FaBo9Axis_MPU9250.MPU9250()
+
     # simple_request = SimpleRequest(url="http://smart-chair-iot-dev.us-east-1.elasticbeanstalk.com")
 
     time_start = datetime.now().strftime(TIME_FORMAT)
@@ -115,6 +119,16 @@ if __name__ == '__main__':
     os.mkdir(folder)
     prefix = folder + '/'
 
+    if save_format == 'recording':
+        # One columnar file for the whole session, see recording.py
+        from recording import RecordingWriter
+        recording = RecordingWriter(prefix + 'recording.screc')
+    else:
+        import joblib
+
+    scheduler = FixedRateScheduler(timestep_detect)
+    scheduler.start()
+
     for n_batch in range(n_batches):
 
         results_list = []
@@ -151,12 +165,22 @@ if __name__ == '__main__':
 
             results_list.append(result)
 
-            time.sleep(timestep_detect)
+            scheduler.wait()
 
-        joblib.dump(results_list, prefix +  '' + str(n_batch))
+        if save_format == 'recording':
+            for result in results_list:
+                recording.append_result(result)
+            recording.flush()
+        else:
+            joblib.dump(results_list, prefix +  '' + str(n_batch))
         # simple_request.sendData()
 
 
+    if save_format == 'recording':
+        recording.close()
+
+    scheduler.print_report()
+
     print('---------------------------')
     print('----End of measurements----')
     print('---------------------------')
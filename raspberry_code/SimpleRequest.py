@@ -1,78 +1,158 @@
 # -*- coding: utf-8 -*-
-import requests
+import heapq
 import json
 from datetime import datetime
+import platform
 import sys
 import time
 import argparse
+from concurrent.futures import ThreadPoolExecutor
 
 sys.path.append('../')
 
 from accel import LIS331DLH
+from acquisition import DataReadyReader
+from adaptive_rate import AdaptiveRate, ACCELEROMETER_COLUMNS
+from aggregation import WindowAggregator, UPLOAD_MODES
+from baseline import BaselineStore, EmptyChairDetector
+from buffers import SampleBatch, SummaryBatch
+from http_client import UploadClient
 from magnet import LIS3MDL
+from metrics import Metrics, MetricsServer, Reporter
+from scheduler import FixedRateScheduler
+from spool import Spool
+from streaming_features import StreamingFeatures
+from uploader import UploadQueue, UploadWorker, SpoolWorker, BACKPRESSURE_POLICIES
+from wire_format import encode_batch, encode_record, encode_summaries, CONTENT_TYPE
 
 TIME_FORMAT = '%H:%M:%S'
 
 class TroykaIMU(object):
-    def __init__(self):
-        self.magnetometer = LIS3MDL()
-        self.accelerometer = LIS331DLH()
+    def __init__(self, bus=None):
+        self.magnetometer = LIS3MDL(bus=bus)
+        self.accelerometer = LIS331DLH(bus=bus)
 
 class SimpleRequest:
 
     url = ""
-    dataAccelerometer = []
-    dataMagnetometer = []
-
-    def __init__(self, url="http://localhost:8080"):
+    endpoints = {
+        'accelerometer': '/api/accelerometer',
+        'magnetometer': '/api/magnetometer',
+        'summary': '/api/summary',
+    }
+
+    # payload: 'records' sends one dict per sample (the original format),
+    # 'columnar' sends metadata once per batch and the axes as columns,
+    # 'binary' sends the wire_format encoding, zlib-compressed if compress is set.
+    # upload_threads: concurrent POSTs per sendData, one per sensor stream by
+    # default, more for gateway.py batches of many devices
+    # verbose prints every response; requests and failures are counted in
+    # metrics either way (Reporter summaries)
+    def __init__(self, url="http://localhost:8080", payload='records', compress=True, gzip_body=True, metrics=None,
+                 upload_threads=None, verbose=False):
         self.url = url
+        self.verbose = verbose
+        self.payload = payload
+        self.compress = compress
+        self.metrics = metrics if metrics is not None else Metrics()
+        # An already zlib-compressed binary body does not shrink under gzip
+        if payload == 'binary' and compress:
+            gzip_body = False
+        upload_threads = upload_threads or len(self.endpoints)
+        self.client = UploadClient(url, gzip_body=gzip_body, metrics=self.metrics, pool_size=max(4, upload_threads))
+        self._executor = ThreadPoolExecutor(max_workers=upload_threads)
+        self.dataAccelerometer = SampleBatch('accelerometer')
+        self.dataMagnetometer = SampleBatch('magnetometer')
+        # Sampling rate in effect, stamped on every batch taken (adaptive acquisition)
+        self.rate_hz = None
 
     def collectAccelerometer(self, ax, ay, az, label, metainfo, peopleId, typeSensor):
-        req = {
-            'dateCreated':datetime.now().isoformat(),
-            'label':label,
-            'metaInfo':metainfo,
-            'peopleId':peopleId,
-            'typeSensor':typeSensor,
-            'ax':ax,
-            'ay':ay,
-            'az':az,
-            # 'time': datetime.now().time().strftime(TIME_FORMAT),
-            # 'timestep_detect': timestep_detect
-        }
-        self.dataAccelerometer.append(req)
+        if not len(self.dataAccelerometer):
+            self.dataAccelerometer.set_meta(label, metainfo, peopleId)
+        self.dataAccelerometer.append(ax, ay, az)
 
     def collectMagnetometer(self, x, y, z, label, metainfo, peopleId, typeSensor):
-        req = {
-            'x':x,
-            'y':y,
-            'z':z,
-            'dateCreated':datetime.now().isoformat(),
-            'label':label,
-            'metaInfo':metainfo,
-            'peopleId':peopleId,
-            'typeSensor':typeSensor,
-            # 'time': datetime.now().time().strftime(TIME_FORMAT),
+        if not len(self.dataMagnetometer):
+            self.dataMagnetometer.set_meta(label, metainfo, peopleId)
+        self.dataMagnetometer.append(x, y, z)
+
+    # Frames read from a shm_ring consumer (fields 'xyz' and 't_ns')
+    def collectFrames(self, frames, label, metainfo, peopleId, typeSensor):
+        batch = self.dataMagnetometer if typeSensor == 'magnetometer' else self.dataAccelerometer
+        if not len(batch):
+            batch.set_meta(label, metainfo, peopleId)
+        batch.extend(frames['xyz'], frames['t_ns'])
+
+    # Hands the collected readings over as one batch and starts a new one
+    def takeBatch(self):
+        batch = {
+            'accelerometer': self.dataAccelerometer,
+            'magnetometer': self.dataMagnetometer,
         }
-        self.dataMagnetometer.append(req)
-
-    def sendData(self):
-        response = requests.post(url=self.url + "/api/accelerometer", data=json.dumps(self.dataAccelerometer), headers={'content-type': 'application/json', 'Accept-Charset': 'UTF-8'})
-        print("Acc Responce: " + response.content.decode("utf-8"))
-        if (response.ok == False):
-            print("an error occupied by you")
-
-        # self.dataAccelerometer.clear()
-        self.dataAccelerometer = []
-
-        response = requests.post(url=self.url + "/api/magnetometer", data=json.dumps(self.dataMagnetometer), headers={'content-type': 'application/json', 'Accept-Charset': 'UTF-8'})
-        print(json.dumps(self.dataMagnetometer))
-        print("Mag Responce: " + response.content.decode("utf-8"))
-        if (response.ok == False):
-            print("an error occurred in you")
-
-        # self.dataMagnetometer.clear()
-        self.dataMagnetometer = []
+        for sensor_batch in batch.values():
+            sensor_batch.rate_hz = self.rate_hz
+        self.dataAccelerometer = SampleBatch('accelerometer')
+        self.dataMagnetometer = SampleBatch('magnetometer')
+        return batch
+
+    def encodeBatch(self, sensor_batch):
+        # Batches restored from the spill directory come back as plain dicts
+        if isinstance(sensor_batch, dict):
+            if sensor_batch['typeSensor'] == SummaryBatch.typeSensor:
+                sensor_batch = SummaryBatch.from_dict(sensor_batch)
+            else:
+                sensor_batch = SampleBatch.from_dict(sensor_batch)
+        # Window summaries are JSON, zlib-compressed with the binary payload
+        # since the body is not gzipped then
+        if isinstance(sensor_batch, SummaryBatch):
+            if self.payload == 'binary':
+                return encode_summaries(sensor_batch, self.compress), {'content-type': CONTENT_TYPE}
+            data = sensor_batch.to_dict()
+        elif self.payload == 'binary':
+            return encode_batch(sensor_batch, self.compress), {'content-type': CONTENT_TYPE}
+        elif self.payload == 'columnar':
+            data = sensor_batch.to_dict()
+        else:
+            data = sensor_batch.to_records()
+        return json.dumps(data), {'content-type': 'application/json', 'Accept-Charset': 'UTF-8'}
+
+    # batch: {stream: sensor batch}, the stream is the sensor type here and a
+    # device name in gateway.py, the endpoint follows the batch's typeSensor
+    def sendData(self, batch=None):
+        if batch is None:
+            batch = self.takeBatch()
+
+        # All streams are posted at the same time over the shared session
+        futures = {}
+        for stream in list(batch):
+            sensor_batch = batch[stream]
+            typeSensor = sensor_batch['typeSensor'] if isinstance(sensor_batch, dict) else sensor_batch.typeSensor
+            start = time.perf_counter()
+            data, headers = self.encodeBatch(sensor_batch)
+            self.metrics.observe('serialize', time.perf_counter() - start)
+            futures[stream] = (typeSensor, self._executor.submit(self.client.post, self.endpoints[typeSensor],
+                                                                 data, headers))
+
+        ok = True
+        for stream, (typeSensor, future) in futures.items():
+            response = future.result()
+            name = {'accelerometer': 'Acc', 'magnetometer': 'Mag'}.get(typeSensor, 'Summary')
+            if stream != typeSensor:
+                name += ' ' + stream
+            if response is not None and self.verbose:
+                print(name + " Responce: " + response.content.decode("utf-8"))
+            if response is None or response.ok == False:
+                if self.verbose:
+                    print("an error occurred in " + stream + " upload")
+                ok = False
+            else:
+                # Acknowledged streams are not sent again when the batch is retried
+                del batch[stream]
+        return ok
+
+    def close(self):
+        self._executor.shutdown()
+        self.client.close()
 
 
 def parse_args():
@@ -81,11 +161,54 @@ def parse_args():
     parser.add_argument('--timestep_send', type=float, default=10)
     parser.add_argument('--max_time', type=float, default=60)
     parser.add_argument('--verbose', type=bool, default=True)
+    parser.add_argument('--print_samples', type=bool, default=False)
+    parser.add_argument('--summary_interval', type=float, default=5.0)
+    parser.add_argument('--metrics_file', type=str, default=None)
+    parser.add_argument('--metrics_port', type=int, default=None)
     parser.add_argument('--send_data', type=bool, default=True)
+    parser.add_argument('--payload', type=str, default='records', choices=('records', 'columnar', 'binary'))
+    parser.add_argument('--compress', type=bool, default=True)
+    parser.add_argument('--gzip', type=bool, default=True)
     parser.add_argument('--label', type=str, default='')
     parser.add_argument('--meta', type=str, default='')
     parser.add_argument('--peopleId', type=str, default='')
-    return parser.parse_args()
+    parser.add_argument('--simulate', type=bool, default=False)
+    parser.add_argument('--url', type=str, default='http://smart-chair-iot-dev.us-east-1.elasticbeanstalk.com')
+    parser.add_argument('--sampler_process', type=bool, default=False)
+    parser.add_argument('--acquisition', type=str, default='timer', choices=('timer', 'data_ready'))
+    parser.add_argument('--adaptive', type=bool, default=False)
+    parser.add_argument('--idle_hz', type=float, default=0.5)
+    parser.add_argument('--still_hz', type=float, default=5)
+    parser.add_argument('--active_hz', type=float, default=50)
+    parser.add_argument('--motion_lsb', type=float, default=400)
+    parser.add_argument('--motion_mag_lsb', type=float, default=300)
+    parser.add_argument('--hold_s', type=float, default=30)
+    parser.add_argument('--async_upload', type=bool, default=False)
+    parser.add_argument('--queue_size', type=int, default=6)
+    parser.add_argument('--backpressure', type=str, default='drop_oldest', choices=BACKPRESSURE_POLICIES)
+    parser.add_argument('--spill_dir', type=str, default='spill')
+    parser.add_argument('--spool_dir', type=str, default=None)
+    parser.add_argument('--spool_max_mb', type=float, default=64)
+    parser.add_argument('--replay_rate', type=float, default=2.0)
+    parser.add_argument('--features', type=bool, default=False)
+    parser.add_argument('--p2_features', type=bool, default=False)
+    parser.add_argument('--window_len', type=int, default=150)
+    parser.add_argument('--window_step', type=int, default=None)
+    parser.add_argument('--acc_z_mean', type=float, default=16790)
+    parser.add_argument('--acc_z_std', type=float, default=27.9)
+    parser.add_argument('--model', type=str, default=None)
+    parser.add_argument('--baseline', type=str, default=None)
+    parser.add_argument('--device_id', type=str, default=None)
+    parser.add_argument('--upload_mode', type=str, default='raw', choices=UPLOAD_MODES)
+    parser.add_argument('--motion_threshold', type=float, default=0.05)
+    args = parser.parse_args()
+    # Summaries and baseline updates are one per tumbling window
+    if (args.upload_mode != 'raw' or args.baseline is not None) and args.window_step not in (None, args.window_len):
+        parser.error('--upload_mode %s and --baseline need tumbling windows, leave out --window_step' % args.upload_mode)
+    # Rates are switched in the timer loop, and only raw batches carry them
+    if args.adaptive and (args.sampler_process or args.acquisition != 'timer' or args.upload_mode != 'raw'):
+        parser.error('--adaptive needs --acquisition timer, --upload_mode raw and no --sampler_process')
+    return args
 
 
 if __name__ == '__main__':
@@ -99,34 +222,310 @@ if __name__ == '__main__':
     peopleId = args.peopleId
     meta = args.meta
     send_data = args.send_data
+    async_upload = args.async_upload
 
     batch_size = int(timestep_send / timestep_detect)  # Количество измерений в одной отправке
     n_batches = int(max_time / timestep_send) # Количество отправок
 
-    imu = TroykaIMU()  # Troyka card
-
-    simple_request = SimpleRequest(url="http://smart-chair-iot-dev.us-east-1.elasticbeanstalk.com")
-
-    for n_batch in range(n_batches):
-
-        for n_measurement in range(batch_size):
-            data_magnetometer = imu.magnetometer.read_xyz()
-            data_accelerometer = imu.accelerometer.read_xyz()
-
+    sampler = None
+    if args.sampler_process:
+        # Sensors are read by a separate process into shared-memory rings,
+        # this process only drains them once per batch
+        from shm_ring import SamplerProcess
+        sampler = SamplerProcess(timestep_detect, acquisition=args.acquisition, simulate=args.simulate)
+        consumers = dict((typeSensor, sampler.consumer(typeSensor)) for typeSensor in sampler.rings)
+        sampler.start()
+    elif args.simulate:
+        # Simulated I2C bus with the Troyka register maps, no hardware needed
+        from sim_bus import SimulatedSMBus
+        imu = TroykaIMU(bus=SimulatedSMBus())
+    else:
+        imu = TroykaIMU()  # Troyka card
+
+    # Stage timings and counters (metrics.py). --verbose prints a summary every
+    # --summary_interval seconds instead of every reading (--print_samples 1
+    # for those), --metrics_file appends the same snapshots as JSON lines and
+    # --metrics_port serves them for Prometheus on /metrics.
+    metrics = Metrics()
+    reporter = Reporter(metrics, args.summary_interval, args.metrics_file, verbose,
+                        rate_counter='samples_accelerometer')
+    metrics_server = None
+    if args.metrics_port is not None:
+        metrics_server = MetricsServer(metrics, ('0.0.0.0', args.metrics_port))
+        metrics_server.start()
+    if sampler is not None:
+        metrics.add_collector(lambda: dict(('frames_lost_' + typeSensor, consumer.frames_lost)
+                                           for typeSensor, consumer in consumers.items()))
+
+    simple_request = SimpleRequest(url=args.url, payload=args.payload, compress=args.compress, gzip_body=args.gzip,
+                                   metrics=metrics, verbose=verbose)
+
+    # Sampler hands finished batches to a spool on disk or a bounded in-memory
+    # queue, a background thread uploads them
+    upload_worker = None
+    spool = None
+    if send_data and args.spool_dir is not None:
+        spool = Spool(args.spool_dir, max_bytes=int(args.spool_max_mb * (1 << 20)))
+        if len(spool):
+            print('Replaying %d spooled batches' % len(spool))
+        upload_worker = SpoolWorker(simple_request, spool, replay_rate=args.replay_rate)
+        upload_worker.start()
+        metrics.add_collector(lambda: {
+            'spool_pending_records': len(spool),
+            'spool_evicted_records': spool.evicted_records,
+        })
+    elif send_data and async_upload:
+        upload_queue = UploadQueue(max_batches=args.queue_size, policy=args.backpressure, spill_dir=args.spill_dir)
+        upload_worker = UploadWorker(simple_request, upload_queue)
+        upload_worker.start()
+        metrics.add_collector(lambda: {
+            'upload_queue_depth': upload_queue.depth(),
+            'dropped_batches': upload_queue.dropped_batches,
+            'dropped_samples': upload_queue.dropped_samples,
+        })
+
+    # timer: one reading of each sensor per --timestep_detect tick
+    # data_ready: every sensor is read at its own ODR, driven by STATUS_REG
+    data_ready_reader = None
+    if args.acquisition == 'data_ready' and sampler is None:
+        data_ready_reader = DataReadyReader({
+            'accelerometer': imu.accelerometer,
+            'magnetometer': imu.magnetometer,
+        }, metrics=metrics)
+        metrics.add_collector(lambda: {
+            'overruns_accelerometer': imu.accelerometer.overruns,
+            'overruns_magnetometer': imu.magnetometer.overruns,
+        })
+
+    # Lean back / Momentum / Oscillations / Rotational movement per window of readings,
+    # computed while sampling (see streaming_features.py). The empty chair
+    # Acc_z statistics default to those of Data_Analysis/data.
+    # Empty chair baseline of this device (baseline.py): replaces --acc_z_mean /
+    # --acc_z_std once it has enough readings, and is updated from every window
+    # that looks like an empty chair (every window with --peopleId noone)
+    baseline_store = None
+    empty_chair = None
+    saved_windows = 0
+    acc_z_mean, acc_z_std = args.acc_z_mean, args.acc_z_std
+    if args.baseline is not None:
+        device_id = args.device_id or platform.node()
+        baseline_store = BaselineStore(args.baseline)
+        baseline = baseline_store.get(device_id)
+        empty_chair = EmptyChairDetector(baseline, always=peopleId == 'noone')
+        if baseline.count('Acc_z') >= empty_chair.min_count:
+            acc_z_mean, acc_z_std = baseline.mean('Acc_z'), baseline.std('Acc_z')
+        print('Baseline of %s: Acc_z %.1f +- %.2f (%d readings)' % (
+            device_id, acc_z_mean, acc_z_std, baseline.count('Acc_z')))
+
+    streaming_features = None
+    if args.features or args.model is not None or args.upload_mode != 'raw' or empty_chair is not None:
+        # --p2_features 1 trades exact Momentum / Oscillations for constant memory
+        streaming_features = StreamingFeatures(acc_z_mean, acc_z_std, args.window_len, args.window_step,
+                                               exact=not args.p2_features)
+
+    # Exported by Data_Analysis/export_model.py, scores every window locally
+    stress_model = None
+    if args.model is not None:
+        from predictor import StressModel
+        stress_model = StressModel.load(args.model)
+
+    # summary / hybrid: one summary per features window is uploaded instead of
+    # the readings, hybrid adds the readings of windows with motion (aggregation.py)
+    aggregator = None
+    if args.upload_mode != 'raw':
+        aggregator = WindowAggregator(args.upload_mode, args.motion_threshold, label, meta, peopleId)
+
+    # Empty chair mean and std of the axes tested for occupancy: all three
+    # accelerometer axes once the baseline has them, Acc_z otherwise
+    def empty_chair_axes():
+        if empty_chair is not None and empty_chair.baseline.count('Acc_z') >= empty_chair.min_count:
+            baseline = empty_chair.baseline
+            return dict((name, (baseline.mean(name), baseline.std(name))) for name in ACCELEROMETER_COLUMNS)
+        return {'Acc_z': (acc_z_mean, acc_z_std)}
+
+    # --adaptive: host loop and sensor data rates follow occupancy and motion
+    # (adaptive_rate.py), every batch is stamped with the rate it was taken at
+    adaptive = None
+    if args.adaptive:
+        adaptive = AdaptiveRate({'accelerometer': imu.accelerometer, 'magnetometer': imu.magnetometer},
+                                {'idle': args.idle_hz, 'still': args.still_hz, 'active': args.active_hz},
+                                empty_chair_axes(), motion_lsb=args.motion_lsb,
+                                motion_mag_lsb=args.motion_mag_lsb, hold_s=args.hold_s)
+        adaptive.start()
+        simple_request.rate_hz = adaptive.rate_hz
+        metrics.add_collector(lambda: {'rate_hz': adaptive.rate_hz, 'rate_switches': adaptive.switches})
+
+    def finish_window(window):
+        if stress_model is not None and window['Rotational movement'] is not None:
+            window['Stress'] = stress_model.predict_window(window).tolist()
+        if aggregator is not None:
+            aggregator.finish_window(window)
+        if empty_chair is not None and empty_chair.finish_window(window):
+            baseline = empty_chair.baseline
+            if baseline.count('Acc_z') >= empty_chair.min_count:
+                streaming_features.set_empty_chair(baseline.mean('Acc_z'), baseline.std('Acc_z'))
+                if adaptive is not None:
+                    adaptive.empty_chair = empty_chair_axes()
+        if args.features or stress_model is not None:
+            print('Features: ', window)
+
+    def update_features(xyz):
+        for window in streaming_features.update(*xyz):
+            finish_window(window)
+
+    # Feeds one reading to the aggregator and the features
+    def observe(typeSensor, xyz, t_ns=None):
+        if aggregator is not None:
+            aggregator.add(typeSensor, xyz, t_ns)
+        if empty_chair is not None:
+            empty_chair.add(typeSensor, xyz)
+        if streaming_features is not None:
+            if typeSensor == 'accelerometer':
+                update_features(xyz)
+            else:
+                streaming_features.update_magnetometer(*xyz)
+
+    def take_batch():
+        if aggregator is not None:
+            return aggregator.take()
+        return simple_request.takeBatch()
+
+    # A reading equal to the previous one of the same sensor is counted as a
+    # duplicate, usually the host reading faster than the sensor's data rate
+    previous_readings = {}
+
+    def collect(typeSensor, xyz):
+        if args.print_samples:
+            print(typeSensor.capitalize() + ' data: ', xyz)
+        metrics.inc('samples_' + typeSensor)
+        if previous_readings.get(typeSensor) == xyz:
+            metrics.inc('duplicates_' + typeSensor)
+        previous_readings[typeSensor] = xyz
+        start = time.perf_counter()
+        observe(typeSensor, xyz)
+        if send_data and aggregator is None:
+            x, y, z = xyz
+            if typeSensor == 'magnetometer':
+                simple_request.collectMagnetometer(x, y, z, label, meta, peopleId, typeSensor)
+            else:
+                simple_request.collectAccelerometer(x, y, z, label, meta, peopleId, typeSensor)
+        metrics.observe('buffer', time.perf_counter() - start)
+        reporter.tick()
+
+    def read(typeSensor, sensor):
+        start = time.perf_counter()
+        xyz = sensor.read_xyz()
+        metrics.observe('read_' + typeSensor, time.perf_counter() - start)
+        return xyz
+
+    # Hands one finished batch to the spool, the upload queue or the server
+    def upload(batch):
+        if spool is not None:
+            for sensor_batch in batch.values():
+                start = time.perf_counter()
+                record = encode_record(sensor_batch, simple_request.compress)
+                metrics.observe('serialize', time.perf_counter() - start)
+                spool.append(record)
+            upload_worker.notify()
+            if verbose:
+                print('Spool: ', upload_worker.stats())
+        elif upload_worker is not None:
+            upload_worker.upload_queue.put(batch)
             if verbose:
-                print('Magnetometer data: ', data_magnetometer)
-                print('Accelerometer data: ', data_accelerometer)
+                print('Upload queue: ', upload_worker.stats())
+        else:
+            simple_request.sendData(batch)
 
-            if send_data:
-                ax, ay, az = data_magnetometer
-                simple_request.collectMagnetometer(ax, ay, az, label, meta, peopleId, 'magnetometer')
+    scheduler = FixedRateScheduler(1.0 / adaptive.rate_hz if adaptive is not None else timestep_detect)
+    scheduler.start()
+    if sampler is None and data_ready_reader is None:
+        metrics.add_collector(lambda: {
+            'skipped_ticks': scheduler.skipped_ticks,
+            'overruns': scheduler.overruns,
+        })
 
-                ax, ay, az = data_accelerometer
-                simple_request.collectAccelerometer(ax, ay, az, label, meta, peopleId, 'accelerometer')
+    batch_deadline = time.monotonic()
 
-            time.sleep(timestep_detect)
+    for n_batch in range(n_batches):
 
-        simple_request.sendData()
+        if sampler is not None:
+            batch_deadline += timestep_send
+            time.sleep(max(0.0, batch_deadline - time.monotonic()))
+            readings = []
+            for typeSensor, consumer in consumers.items():
+                frames = consumer.read_all()
+                metrics.inc('samples_' + typeSensor, len(frames))
+                if verbose:
+                    print(typeSensor.capitalize() + ' frames: ', len(frames), ' lost: ', consumer.frames_lost)
+                if streaming_features is not None:
+                    readings.append([(t_ns, typeSensor, xyz) for t_ns, xyz in
+                                     zip(frames['t_ns'].tolist(), frames['xyz'].tolist())])
+                if send_data and aggregator is None:
+                    simple_request.collectFrames(frames, label, meta, peopleId, typeSensor)
+            # Both sensors in time order, so magnetometer readings land in the right window
+            for t_ns, typeSensor, xyz in heapq.merge(*readings):
+                observe(typeSensor, xyz, t_ns)
+            reporter.tick()
+        elif data_ready_reader is not None:
+            data_ready_reader.run(timestep_send, collect)
+        elif adaptive is not None:
+            # Batches are cut by time, their length follows the rate
+            batch_deadline += timestep_send
+            while time.monotonic() < batch_deadline:
+                profile = None
+                for typeSensor in ('magnetometer', 'accelerometer'):
+                    xyz = read(typeSensor, adaptive.sensors[typeSensor])
+                    collect(typeSensor, xyz)
+                    profile = adaptive.update(typeSensor, xyz) or profile
+                if profile is not None:
+                    # Readings at the old rate go out as a batch of their own
+                    upload(take_batch())
+                    simple_request.rate_hz = adaptive.switch(profile)
+                    scheduler.set_period(1.0 / adaptive.rate_hz)
+                    if verbose:
+                        print('Rate: %s, %g Hz (%s)' % (profile, adaptive.rate_hz, ', '.join(
+                            '%s %g Hz' % item for item in sorted(adaptive.odr_hz.items()))))
+                scheduler.wait()
+        else:
+            for n_measurement in range(batch_size):
+                collect('magnetometer', read('magnetometer', imu.magnetometer))
+                collect('accelerometer', read('accelerometer', imu.accelerometer))
+
+                scheduler.wait()
+
+        # The last, partial window is closed with what it has, so a run
+        # shorter than a window still uploads its summary
+        if n_batch == n_batches - 1 and streaming_features is not None:
+            for window in streaming_features.flush():
+                finish_window(window)
+
+        if empty_chair is not None and empty_chair.merged_windows > saved_windows:
+            baseline_store.save()
+            saved_windows = empty_chair.merged_windows
+
+        upload(take_batch())
+
+    if upload_worker is not None:
+        upload_worker.stop(timeout=timestep_send)
+        print('Upload stats: ', upload_worker.stats())
+    if spool is not None:
+        spool.close()
+    simple_request.close()
+    print('HTTP stats: ', simple_request.client.stats())
+    if aggregator is not None:
+        print('Aggregation stats: ', aggregator.stats())
+    if adaptive is not None:
+        print('Adaptive rate stats: ', adaptive.stats())
+    reporter.report()
+    if metrics_server is not None:
+        metrics_server.shutdown()
+
+    if sampler is not None:
+        sampler.stop()
+    elif data_ready_reader is not None:
+        print('Data-ready stats: ', data_ready_reader.stats())
+    else:
+        scheduler.print_report()
 
     print('---------------------------')
     print('----End of measurements----')
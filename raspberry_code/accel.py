@@ -1,4 +1,10 @@
-﻿import smbus
+﻿import struct
+
+try:
+    import smbus
+except ImportError:
+    # Not a Raspberry Pi: pass bus= explicitly (e.g. sim_bus.SimulatedSMBus)
+    smbus = None
 
 
 class LIS331DLH(object):
@@ -57,6 +63,26 @@ class LIS331DLH(object):
         'NORMAL 1000Hz'     : 0b00111,
     }
 
+    data_rate_hz = {
+        0b01000             : 0.5,
+        0b01100             : 1,
+        0b10000             : 2,
+        0b10100             : 5,
+        0b11000             : 10,
+        0b00100             : 50,
+        0b00101             : 100,
+        0b00110             : 400,
+        0b00111             : 1000,
+    }
+
+    # OUT_X_L..OUT_Z_H: three little-endian int16
+    _XYZ = struct.Struct('<hhh')
+
+    # STATUS_REG bits
+    # ZYXOR ZOR YOR XOR ZYXDA ZDA YDA XDA
+    STATUS_ZYXDA = 1 << 3
+    STATUS_ZYXOR = 1 << 7
+
     I2C_DEFAULT_ADDRESS = 0b0011000
     I2C_IDENTITY = 0x32
 
@@ -72,9 +98,10 @@ class LIS331DLH(object):
     def __init__(self, port=1,
                  address=I2C_DEFAULT_ADDRESS,
                  sens_range=range_fs[0],
-                 data_rate=output_data_rate['NORMAL 50Hz']):
-        # Подключаемся к шине I2C
-        self.wire = smbus.SMBus(port)
+                 data_rate=output_data_rate['NORMAL 50Hz'],
+                 bus=None):
+        # Подключаемся к шине I2C (или используем переданную шину)
+        self.wire = bus if bus is not None else smbus.SMBus(port)
         # Запоминаем адрес
         self._addr = address
         # Сбрасываем все регистры по умолчанию
@@ -89,6 +116,10 @@ class LIS331DLH(object):
         self.axis_y(True)
         # z axis enable
         self.axis_z(True)
+        # Data-ready acquisition counters
+        self.new_samples = 0
+        self.overruns = 0
+        self.not_ready = 0
 
     def identity(self):
         return self.wire.read_byte_data(self._addr, self.register['WHO_AM_I']) == self.I2C_IDENTITY
@@ -135,6 +166,21 @@ class LIS331DLH(object):
             self._ctrlReg1 &= ~(1 << 2)
         self.wire.write_byte_data(self._addr, self.register['CTRL_REG1'], self._ctrlReg1)
 
+    # Output data rate in effect, Hz (0 in power-down)
+    def odr_hz(self):
+        return self.data_rate_hz.get((self._ctrlReg1 >> 3) & 0b11111, 0)
+
+    # Slowest entry of the rate table (low-power 0.5..10 Hz, normal 50..1000 Hz)
+    # that delivers at least `hz` readings per second, the fastest if none
+    # does. Returns the data rate in effect.
+    def set_rate_hz(self, hz):
+        rates = sorted(self.data_rate_hz.items(), key=lambda item: item[1])
+        for code, rate in rates:
+            if rate >= hz:
+                break
+        self.set_output_data_rate(code)
+        return self.odr_hz()
+
     # Register 2 operations
     # BOOT HPM1 HPM0 FDS HPen2 HPen1 HPCF1 HPCF0
     # Reboot memory content. Default value: 0 (0: normal mode; 1: reboot memory content)
@@ -152,6 +198,37 @@ class LIS331DLH(object):
             self._mult = self.mult_sens[sens_range]
             self.wire.write_byte_data(self._addr, self.register['CTRL_REG4'], self._ctrlReg4)
 
+    # Register 3 operations
+    # IHL PP_OD LIR2 I2_CFG1 I2_CFG0 LIR1 I1_CFG1 I1_CFG0
+    # Route data ready to the INT1 pad (I1_CFG = 10), for hosts that wire INT1 to a GPIO
+    def data_ready_interrupt(self, enable=True):
+        self._ctrlReg3 &= ~0b11
+        if enable:
+            self._ctrlReg3 |= 0b10
+        self.wire.write_byte_data(self._addr, self.register['CTRL_REG3'], self._ctrlReg3)
+
+    def read_status(self):
+        return self.wire.read_byte_data(self._addr, self.register['STATUS_REG'])
+
+    def data_ready(self):
+        return bool(self.read_status() & self.STATUS_ZYXDA)
+
+    # Data-ready aware read: STATUS_REG and OUT_X_L..OUT_Z_H in one transaction.
+    # Returns None when the sensor has no new sample since the last read, so a
+    # host loop polling faster than the ODR never stores duplicates.
+    # ZYXOR means a sample was overwritten before it was read.
+    def read_xyz_if_ready(self):
+        # assert MSB to enable register address auto increment
+        values = self.wire.read_i2c_block_data(self._addr, self.register['STATUS_REG'] | (1 << 7), 7)
+        status = values[0]
+        if not status & self.STATUS_ZYXDA:
+            self.not_ready += 1
+            return None
+        if status & self.STATUS_ZYXOR:
+            self.overruns += 1
+        self.new_samples += 1
+        return self._XYZ.unpack_from(bytearray(values), 1)
+
     def read_axis(self, reg):
         # assert MSB to enable register address auto increment
         return self.signed_int32(self.wire.read_word_data(self._addr, reg | (1 << 7)))
@@ -159,9 +236,21 @@ class LIS331DLH(object):
     def read_xyz(self):
         # assert MSB to enable register address auto increment
         values = self.wire.read_i2c_block_data(self._addr, self.register['OUT_X_L'] | (1 << 7), 6)
-        return (self.signed_int32(values[1] << 8 | values[0]),
-                self.signed_int32(values[3] << 8 | values[2]),
-                self.signed_int32(values[5] << 8 | values[4]))
+        return self._XYZ.unpack(bytearray(values))
+
+    # Raw OUT_X_L..OUT_Z_H bytes, for buffering and decoding later in bulk
+    def read_xyz_raw(self):
+        # assert MSB to enable register address auto increment
+        return bytes(bytearray(self.wire.read_i2c_block_data(self._addr, self.register['OUT_X_L'] | (1 << 7), 6)))
+
+    # Decodes N buffered raw readings (read_xyz_raw results or one joined
+    # bytes object) into an (N, 3) int16 NumPy array in one call
+    @staticmethod
+    def decode_xyz_batch(raw_readings):
+        import numpy as np
+        if not isinstance(raw_readings, (bytes, bytearray)):
+            raw_readings = b''.join(raw_readings)
+        return np.frombuffer(raw_readings, dtype='<i2').reshape(-1, 3)
 
     def read_gx(self):
         return self.read_axis(self.register['OUT_X_L']) * self._mult
@@ -183,11 +272,13 @@ class LIS331DLH(object):
 
     def read_gxyz(self):
         gx, gy, gz = self.read_xyz()
-        return gx * self._mult, gy * self._mult, gz * self._mult
+        mult = self._mult
+        return gx * mult, gy * mult, gz * mult
 
     def read_axyz(self):
         gx, gy, gz = self.read_xyz()
-        return gx * self._mult * self.G, gy * self._mult * self.G, gz * self._mult * self.G
+        mult = self._mult * self.G
+        return gx * mult, gy * mult, gz * mult
 
     @staticmethod
     def signed_int32(number):
@@ -197,7 +288,10 @@ class LIS331DLH(object):
             return number & 65535
 
 class TroykaIMU(object):
-    def __init__(self):
-        self.accelerometer = LIS331DLH()
-imu = TroykaIMU()
-print(imu.accelerometer.read_axyz())
\ No newline at end of file
+    def __init__(self, bus=None):
+        self.accelerometer = LIS331DLH(bus=bus)
+
+
+if __name__ == '__main__':
+    imu = TroykaIMU()
+    print(imu.accelerometer.read_axyz())
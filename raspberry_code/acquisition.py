@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+import time
+
+
+class DataReadyReader(object):
+    # Reads each sensor at its own output data rate instead of the host timer.
+    # Every poll checks STATUS_REG of every sensor (read_xyz_if_ready) and only
+    # sensors with a new sample produce a reading, so a 50 Hz accelerometer and
+    # an 80 Hz magnetometer are both stored at their true rate, without duplicates.
+    # Polling runs at poll_factor times the fastest ODR to keep latency and
+    # overruns low. With metrics, every read is timed as the read_<name> stage.
+
+    def __init__(self, sensors, poll_factor=2.0, poll_interval=None, metrics=None):
+        # sensors: {'accelerometer': LIS331DLH, 'magnetometer': LIS3MDL}
+        self.sensors = sensors
+        self.metrics = metrics
+        if poll_interval is None:
+            fastest = max(sensor.odr_hz() for sensor in sensors.values())
+            poll_interval = 1.0 / (poll_factor * fastest)
+        self.poll_interval = poll_interval
+        self.polls = 0
+
+    # One pass over all sensors, returns [(name, (x, y, z)), ...] of the new samples
+    def poll(self):
+        self.polls += 1
+        readings = []
+        for name, sensor in self.sensors.items():
+            if self.metrics is not None:
+                start = time.perf_counter()
+                xyz = sensor.read_xyz_if_ready()
+                self.metrics.observe('read_' + name, time.perf_counter() - start)
+            else:
+                xyz = sensor.read_xyz_if_ready()
+            if xyz is not None:
+                readings.append((name, xyz))
+        return readings
+
+    # Polls for `duration` seconds and passes every new sample to callback(name, xyz)
+    def run(self, duration, callback):
+        deadline = time.monotonic() + duration
+        next_poll = time.monotonic()
+        while True:
+            now = time.monotonic()
+            if now >= deadline:
+                break
+            for name, xyz in self.poll():
+                callback(name, xyz)
+            next_poll += self.poll_interval
+            delay = next_poll - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                next_poll = time.monotonic()
+
+    def stats(self):
+        stats = {'polls': self.polls}
+        for name, sensor in self.sensors.items():
+            stats[name] = {
+                'odr_hz': sensor.odr_hz(),
+                'new_samples': sensor.new_samples,
+                'overruns': sensor.overruns,
+                'not_ready': sensor.not_ready,
+            }
+        return stats
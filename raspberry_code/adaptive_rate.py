@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+# Adaptive acquisition (SimpleRequest.py --adaptive 1): the sensors and the
+# host loop run at low-power rates while the chair is empty or nobody moves,
+# and switch to a high output data rate as soon as motion or occupancy shows up.
+#
+# Three profiles, each a host read rate; every sensor is set to the slowest
+# entry of its rate table that keeps up with it (set_rate_hz: LIS331DLH
+# low-power 0.5..10 Hz or normal 50..1000 Hz, LIS3MDL low-power 0.625 Hz,
+# 1.25..80 Hz or FAST_ODR):
+#   idle     chair empty            --idle_hz   (0.5)
+#   still    occupied, no motion    --still_hz  (5)
+#   active   motion                 --active_hz (50)
+#
+# Occupancy: an accelerometer axis more than n_sigma empty chair stds from
+# its empty chair mean. Only Acc_z is known without a --baseline, and Acc_z
+# alone misses some people on the recorded data, who mostly tilt the seat
+# along x; with a baseline all three axes are tested.
+# Motion: an axis changed by more than motion_lsb (accelerometer) or
+# motion_mag_lsb (magnetometer) since the previous reading of that sensor.
+# On the recorded data the empty chair never changes by more than 160 / 260
+# LSB between readings, people shifting on the seat by up to a few thousand.
+#
+# Switching up is immediate, switching down waits until the trigger has been
+# quiet for hold_s seconds. Batches are cut at every switch, so each one
+# carries a single rate (SampleBatch.rate_hz).
+#
+#   adaptive = AdaptiveRate({'accelerometer': imu.accelerometer, 'magnetometer': imu.magnetometer},
+#                           {'idle': 0.5, 'still': 5, 'active': 50}, {'Acc_z': (16790, 27.9)})
+#   adaptive.start()
+#   profile = adaptive.update('accelerometer', xyz)
+#   if profile is not None:
+#       adaptive.switch(profile)    # after the batch at the old rate is handed over
+import time
+
+PROFILES = ('idle', 'still', 'active')
+ACCELEROMETER_COLUMNS = ('Acc_x', 'Acc_y', 'Acc_z')
+
+
+class AdaptiveRate(object):
+
+    def __init__(self, sensors, rates, empty_chair, n_sigma=5.0, motion_lsb=400, motion_mag_lsb=300,
+                 hold_s=30.0, clock=time.monotonic):
+        # sensors: {'accelerometer': LIS331DLH, 'magnetometer': LIS3MDL}
+        # rates: {'idle': Hz, 'still': Hz, 'active': Hz}
+        # empty_chair: {'Acc_z': (mean, std), ...}, the axes tested for occupancy
+        self.sensors = sensors
+        self.rates = rates
+        self.empty_chair = empty_chair
+        self.n_sigma = n_sigma
+        self.motion_lsb = {'accelerometer': motion_lsb, 'magnetometer': motion_mag_lsb}
+        self.hold_s = hold_s
+        self._clock = clock
+
+        self.profile = None
+        self.rate_hz = None
+        self.odr_hz = {}
+        self.switches = 0
+        self.seconds = dict((profile, 0.0) for profile in PROFILES)
+        self.readings = dict((profile, 0) for profile in PROFILES)
+        self._since = None
+        self._last_motion = None
+        self._last_occupied = None
+        self._previous = {}
+
+    # Starts in `profile`, held for hold_s like after a trigger
+    def start(self, profile='active'):
+        now = self._clock()
+        if profile == 'active':
+            self._last_motion = now
+        if profile in ('active', 'still'):
+            self._last_occupied = now
+        self.switch(profile)
+
+    def occupied(self, xyz):
+        for name, value in zip(ACCELEROMETER_COLUMNS, xyz):
+            stats = self.empty_chair.get(name)
+            if stats is not None and abs(value - stats[0]) > self.n_sigma * stats[1]:
+                return True
+        return False
+
+    def moved(self, typeSensor, xyz):
+        previous = self._previous.get(typeSensor)
+        self._previous[typeSensor] = xyz
+        if previous is None:
+            return False
+        return max(abs(value - before) for value, before in zip(xyz, previous)) > self.motion_lsb[typeSensor]
+
+    def target(self, now):
+        if self._last_motion is not None and now - self._last_motion < self.hold_s:
+            return 'active'
+        if self._last_occupied is not None and now - self._last_occupied < self.hold_s:
+            return 'still'
+        return 'idle'
+
+    # One reading; returns the profile to switch to, None to stay
+    def update(self, typeSensor, xyz):
+        now = self._clock()
+        if self.profile is not None:
+            self.readings[self.profile] += 1
+        if self.moved(typeSensor, xyz):
+            self._last_motion = now
+        if typeSensor == 'accelerometer' and self.occupied(xyz):
+            self._last_occupied = now
+        profile = self.target(now)
+        return profile if profile != self.profile else None
+
+    # Sets the sensors' data rates for `profile`, returns the host rate
+    def switch(self, profile):
+        now = self._clock()
+        if self.profile is not None:
+            self.seconds[self.profile] += now - self._since
+            self.switches += 1
+        self.profile = profile
+        self._since = now
+        self.rate_hz = float(self.rates[profile])
+        for name, sensor in self.sensors.items():
+            self.odr_hz[name] = sensor.set_rate_hz(self.rate_hz)
+        return self.rate_hz
+
+    def stats(self):
+        seconds = dict(self.seconds)
+        if self.profile is not None:
+            seconds[self.profile] += self._clock() - self._since
+        stats = {'profile': self.profile, 'rate_hz': self.rate_hz, 'switches': self.switches}
+        for profile in PROFILES:
+            stats['seconds_' + profile] = round(seconds[profile], 1)
+            stats['readings_' + profile] = self.readings[profile]
+        return stats
@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+# Edge aggregation for --upload_mode summary and hybrid.
+#
+# Readings are cut into the tumbling windows of streaming_features
+# (window_len accelerometer readings; magnetometer readings belong to the
+# window open when they arrive). Instead of the readings, one summary per
+# window is uploaded to /api/summary:
+#   start, dateCreated, durationMs
+#   accelerometer, magnetometer   n, and [mean, std, min, max] of every axis
+#   Lean back, Momentum, Oscillations, Rotational movement (Stress with --model)
+#   raw                           whether the readings were uploaded as well
+# In 'hybrid' mode a window whose Momentum or Rotational movement exceeds
+# motion_threshold also has its readings uploaded as usual, so the backend
+# keeps full resolution around every movement and only summaries of the calm
+# stretches in between.
+#
+#   aggregator = WindowAggregator('hybrid', motion_threshold=0.05)
+#   aggregator.add('accelerometer', (ax, ay, az))   # before features.update()
+#   aggregator.finish_window(window)                # every completed features window
+#   simple_request.sendData(aggregator.take())
+#
+# python Data_Analysis/bench_upload_modes.py reports the bytes per hour of
+# every mode on the recorded data.
+from datetime import datetime
+import math
+import time
+
+from buffers import SampleBatch, SummaryBatch, SENSOR_AXES
+from streaming_features import RunningMoments
+
+UPLOAD_MODES = ('raw', 'summary', 'hybrid')
+FEATURE_DIGITS = 4
+STAT_DIGITS = 2
+
+
+class _AxisStats(object):
+
+    def __init__(self):
+        self.moments = RunningMoments()
+        self.min = None
+        self.max = None
+
+    def add(self, value):
+        self.moments.add(value)
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def summary(self):
+        return [round(self.moments.mean, STAT_DIGITS), round(self.moments.std(), STAT_DIGITS), self.min, self.max]
+
+
+class _WindowStats(object):
+    # Statistics, and in hybrid mode the readings, of one window
+
+    def __init__(self, keep_raw):
+        self.first_ns = None
+        self.last_ns = None
+        self.axes = dict((typeSensor, [_AxisStats() for _ in range(3)]) for typeSensor in SENSOR_AXES)
+        self.raw = None
+        if keep_raw:
+            self.raw = dict((typeSensor, SampleBatch(typeSensor)) for typeSensor in SENSOR_AXES)
+
+    def add(self, typeSensor, xyz, t_ns):
+        if self.first_ns is None:
+            self.first_ns = t_ns
+        self.last_ns = t_ns
+        for axis, value in zip(self.axes[typeSensor], xyz):
+            axis.add(value)
+        if self.raw is not None:
+            self.raw[typeSensor].append(xyz[0], xyz[1], xyz[2], timestamp=t_ns)
+
+    def sensor_summary(self, typeSensor):
+        axes = self.axes[typeSensor]
+        summary = {'n': axes[0].moments.count}
+        if summary['n']:
+            for name, axis in zip(SENSOR_AXES[typeSensor], axes):
+                summary[name] = axis.summary()
+        return summary
+
+
+class WindowAggregator(object):
+
+    def __init__(self, mode='summary', motion_threshold=0.05, label='', metaInfo='', peopleId=''):
+        if mode not in ('summary', 'hybrid'):
+            raise ValueError('unknown aggregation mode: ' + str(mode))
+        self.mode = mode
+        self.motion_threshold = motion_threshold
+        self.label = label
+        self.metaInfo = metaInfo
+        self.peopleId = peopleId
+
+        self._window = None
+        self._summaries = SummaryBatch(label, metaInfo, peopleId)
+        self._raw = self._new_raw()
+
+        self.windows = 0
+        self.raw_windows = 0
+
+    def _new_raw(self):
+        raw = {}
+        for typeSensor in SENSOR_AXES:
+            raw[typeSensor] = SampleBatch(typeSensor, self.label, self.metaInfo, self.peopleId)
+        return raw
+
+    # One reading; t_ns is time.monotonic_ns() of the reading, now by default
+    def add(self, typeSensor, xyz, t_ns=None):
+        if t_ns is None:
+            t_ns = time.monotonic_ns()
+        if self._window is None:
+            self._window = _WindowStats(self.mode == 'hybrid')
+        self._window.add(typeSensor, xyz, t_ns)
+
+    def is_interesting(self, features):
+        motion = max(features['Momentum'], features['Rotational movement'] or 0.0)
+        return motion > self.motion_threshold
+
+    # Closes the current window with the StreamingFeatures result for it
+    def finish_window(self, features):
+        window, self._window = self._window, None
+        if window is None:
+            return None
+        raw = self.mode == 'hybrid' and self.is_interesting(features)
+        wall_offset_ns = time.time_ns() - time.monotonic_ns()
+        summary = {
+            'start': features['start'],
+            'dateCreated': datetime.fromtimestamp((window.first_ns + wall_offset_ns) / 1e9).isoformat(),
+            'durationMs': (window.last_ns - window.first_ns) // 1000000,
+            'raw': raw,
+        }
+        for typeSensor in SENSOR_AXES:
+            summary[typeSensor] = window.sensor_summary(typeSensor)
+        for name, value in features.items():
+            if name == 'start':
+                continue
+            if isinstance(value, float):
+                # NaN (e.g. Oscillations of a window without inner readings) is
+                # not valid JSON, it goes out as null
+                value = None if math.isnan(value) else round(value, FEATURE_DIGITS)
+            summary[name] = value
+        self._summaries.append(summary)
+        self.windows += 1
+        if raw:
+            for typeSensor, sensor_batch in window.raw.items():
+                self._raw[typeSensor].extend_batch(sensor_batch)
+            self.raw_windows += 1
+        return summary
+
+    # Everything to upload since the last call, in the form SimpleRequest.sendData
+    # takes; empty streams are left out
+    def take(self):
+        batch = {}
+        if len(self._summaries):
+            batch['summary'] = self._summaries
+        for typeSensor, sensor_batch in self._raw.items():
+            if len(sensor_batch):
+                batch[typeSensor] = sensor_batch
+        self._summaries = SummaryBatch(self.label, self.metaInfo, self.peopleId)
+        self._raw = self._new_raw()
+        return batch
+
+    def stats(self):
+        return {
+            'mode': self.mode,
+            'windows': self.windows,
+            'raw_windows': self.raw_windows,
+        }
@@ -0,0 +1,211 @@
+# -*- coding: utf-8 -*-
+# Empty-chair baseline per device: mean and std of every axis while nobody
+# sits on the chair (the notebooks' means_stds), kept up to date incrementally.
+#
+# Every column is stored as (count, mean, M2). New readings are merged with
+# the pairwise form of Welford's update (Chan et al.), so one reading, one
+# window or a whole CSV costs the same three numbers and history is never
+# rescanned. All devices share one small JSON file, replaced atomically on save.
+#
+#   store = BaselineStore('baseline.json')
+#   baseline = store.get('chair-1')
+#   baseline.update('Acc_z', readings)
+#   baseline.mean('Acc_z'), baseline.std('Acc_z')
+#   compute_features(windows, baseline.means_stds())   # Data_Analysis/features.py
+#   store.save()
+#
+# On the device (SimpleRequest.py --baseline baseline.json) EmptyChairDetector
+# merges every features window that looks like an empty chair: the session is
+# labelled --peopleId noone, or the window is calm (no Momentum, no Rotational
+# movement) and its accelerometer means lie within n_sigma baseline stds.
+#
+#   python baseline.py --store baseline.json --device chair-1 --seed ../Data_Analysis
+# seeds a device from the people_id == 'noone' rows of the recorded data.
+import argparse
+import json
+import math
+import os
+import sys
+import time
+
+from streaming_features import RunningMoments
+
+STORE_VERSION = 1
+SENSOR_COLUMNS = {
+    'accelerometer': ('Acc_x', 'Acc_y', 'Acc_z'),
+    'magnetometer': ('Mag_x', 'Mag_y', 'Mag_z'),
+}
+COLUMNS = SENSOR_COLUMNS['accelerometer'] + SENSOR_COLUMNS['magnetometer']
+
+
+class Baseline(object):
+
+    def __init__(self, columns=None, updated=None):
+        # column -> [count, mean, M2]
+        self.columns = dict((name, list(moments)) for name, moments in (columns or {}).items())
+        self.updated = updated
+
+    def merge(self, name, count, mean, m2):
+        if not count:
+            return
+        n_a, mean_a, m2_a = self.columns.get(name, (0, 0.0, 0.0))
+        n = n_a + count
+        delta = mean - mean_a
+        self.columns[name] = [n, mean_a + delta * count / float(n), m2_a + m2 + delta * delta * n_a * count / float(n)]
+        self.updated = time.time()
+
+    def add(self, name, value):
+        self.merge(name, 1, float(value), 0.0)
+
+    # Any sequence or NumPy array of readings of one column
+    def update(self, name, values):
+        import numpy as np
+        values = np.asarray(values, dtype=np.float64)
+        if not len(values):
+            return
+        mean = values.mean()
+        self.merge(name, len(values), float(mean), float(((values - mean) ** 2).sum()))
+
+    def count(self, name):
+        return self.columns.get(name, (0, 0.0, 0.0))[0]
+
+    def mean(self, name):
+        count, mean, _ = self.columns.get(name, (0, float('nan'), 0.0))
+        return mean if count else float('nan')
+
+    # Sample std (ddof=1) like pandas, which the notebooks' means_stds used
+    def std(self, name, ddof=1):
+        count, _, m2 = self.columns.get(name, (0, 0.0, 0.0))
+        if count <= ddof:
+            return float('nan')
+        return math.sqrt(m2 / (count - ddof))
+
+    # DataFrame indexed by column with 'mean' and 'std', the layout of
+    # features.empty_chair_stats()
+    def means_stds(self):
+        import pandas as pd
+        names = [name for name in COLUMNS if name in self.columns]
+        return pd.DataFrame({'mean': [self.mean(name) for name in names],
+                             'std': [self.std(name) for name in names]}, index=names)
+
+    def to_dict(self):
+        return {'updated': self.updated, 'columns': self.columns}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data['columns'], data.get('updated'))
+
+
+class BaselineStore(object):
+
+    def __init__(self, path):
+        self.path = path
+        self.baselines = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                data = json.load(f)
+            if data.get('version') != STORE_VERSION:
+                raise ValueError('unsupported baseline store version: ' + str(data.get('version')))
+            for device_id, baseline in data['devices'].items():
+                self.baselines[device_id] = Baseline.from_dict(baseline)
+
+    def devices(self):
+        return sorted(self.baselines)
+
+    # The baseline of one device, an empty one the first time
+    def get(self, device_id):
+        baseline = self.baselines.get(device_id)
+        if baseline is None:
+            baseline = self.baselines[device_id] = Baseline()
+        return baseline
+
+    def save(self):
+        data = {
+            'version': STORE_VERSION,
+            'devices': dict((device_id, baseline.to_dict()) for device_id, baseline in self.baselines.items()),
+        }
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(data, f, separators=(',', ':'))
+        os.replace(tmp, self.path)
+
+
+class EmptyChairDetector(object):
+    # Collects per-axis moments of the current features window (add() for every
+    # reading, before StreamingFeatures.update) and merges them into the
+    # baseline when finish_window() decides the chair was empty. always=True
+    # merges every window, for sessions recorded on an empty chair.
+
+    def __init__(self, baseline, n_sigma=3, min_count=150, max_motion=0.0, always=False):
+        self.baseline = baseline
+        self.n_sigma = n_sigma
+        self.min_count = min_count
+        self.max_motion = max_motion
+        self.always = always
+        self.merged_windows = 0
+        self._window = self._new_window()
+
+    @staticmethod
+    def _new_window():
+        return dict((name, RunningMoments()) for name in COLUMNS)
+
+    def add(self, typeSensor, xyz):
+        window = self._window
+        for name, value in zip(SENSOR_COLUMNS[typeSensor], xyz):
+            window[name].add(value)
+
+    def is_empty(self, features, window):
+        if self.always:
+            return True
+        if features['Momentum'] > self.max_motion or (features['Rotational movement'] or 0.0) > self.max_motion:
+            return False
+        for name in SENSOR_COLUMNS['accelerometer']:
+            if self.baseline.count(name) < self.min_count:
+                return False
+            if abs(window[name].mean - self.baseline.mean(name)) > self.n_sigma * self.baseline.std(name):
+                return False
+        return True
+
+    # Returns True if the window went into the baseline
+    def finish_window(self, features):
+        window, self._window = self._window, self._new_window()
+        if not self.is_empty(features, window):
+            return False
+        for name, moments in window.items():
+            # RunningMoments keeps M2 as the population variance times count
+            self.baseline.merge(name, moments.count, moments.mean, moments.std() ** 2 * moments.count
+                                if moments.count else 0.0)
+        self.merged_windows += 1
+        return True
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--store', type=str, default='baseline.json')
+    parser.add_argument('--device', type=str, default=None)
+    parser.add_argument('--seed', type=str, default=None)
+    parser.add_argument('--people_id', type=str, default='noone')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    store = BaselineStore(args.store)
+
+    if args.seed is not None:
+        if args.device is None:
+            sys.exit('--seed needs --device')
+        # Data_Analysis directory with dataset.py
+        sys.path.append(args.seed)
+        from dataset import load_dataset
+        df = load_dataset()
+        baseline = store.get(args.device)
+        empty = df[df['people_id'] == args.people_id]
+        for name in COLUMNS:
+            baseline.update(name, empty[name].values)
+        store.save()
+        print('Seeded %s with %d rows of %s' % (args.device, len(empty), args.people_id))
+
+    for device_id in ([args.device] if args.device else store.devices()):
+        print(device_id)
+        print(store.get(device_id).means_stds())
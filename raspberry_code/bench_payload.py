@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+# Compares payload size and encode time of one batch in every upload format.
+#
+#   python bench_payload.py --batch_size 100
+import argparse
+import json
+import random
+import timeit
+
+from buffers import SampleBatch
+from wire_format import encode_batch, decode_batch
+
+
+# Synthetic accelerometer batch: gravity on z plus small noise and slow drift
+def make_batch(batch_size, timestep_detect=0.1, seed=0):
+    rng = random.Random(seed)
+    batch = SampleBatch('accelerometer', 'usual table sitting 0', '', 'anton')
+    timestamp = 10 ** 12
+    for n in range(batch_size):
+        batch.append(3472 + n // 10 + rng.randint(-40, 40),
+                     976 + rng.randint(-40, 40),
+                     16512 + rng.randint(-60, 60),
+                     timestamp=timestamp)
+        timestamp += int(timestep_detect * 1e9) + rng.randint(-200000, 200000)
+    return batch
+
+
+def bench(batch, repeat=20):
+    encoders = [
+        ('json records', lambda: json.dumps(batch.to_records()).encode('utf-8')),
+        ('json columnar', lambda: json.dumps(batch.to_dict()).encode('utf-8')),
+        ('binary', lambda: encode_batch(batch, compress=False)),
+        ('binary+zlib', lambda: encode_batch(batch, compress=True)),
+    ]
+    results = []
+    for name, encode in encoders:
+        size = len(encode())
+        seconds = min(timeit.repeat(encode, number=1, repeat=repeat))
+        results.append({
+            'format': name,
+            'bytes': size,
+            'bytes_per_sample': size / float(len(batch)),
+            'encode_ms': seconds * 1e3,
+        })
+    return results
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--batch_size', type=int, default=100)
+    parser.add_argument('--repeat', type=int, default=20)
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    batch = make_batch(args.batch_size)
+
+    decoded = decode_batch(encode_batch(batch))
+    assert list(decoded.x) == list(batch.x) and list(decoded.z) == list(batch.z)
+    # A reading hours after the previous one needs 64-bit time steps
+    gap = make_batch(3)
+    gap.append(3472, 976, 16512, timestamp=gap.timestamps[-1] + 3 * 3600 * 10 ** 9)
+    for compress in (False, True):
+        assert decode_batch(encode_batch(gap, compress)).to_dict() == gap.to_dict()
+
+    print('%-14s %10s %14s %11s' % ('format', 'bytes', 'bytes/sample', 'encode ms'))
+    for result in bench(batch, args.repeat):
+        print('%-14s %10d %14.1f %11.3f' % (result['format'], result['bytes'],
+                                           result['bytes_per_sample'], result['encode_ms']))
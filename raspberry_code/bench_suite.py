@@ -0,0 +1,229 @@
+# -*- coding: utf-8 -*-
+# Benchmarks of the acquisition and upload pipeline against the simulated I2C
+# bus (sim_bus.py) and a local stand-in server (stand_in_server.py), so they
+# run on any machine:
+#
+#   python bench_suite.py --output bench.json
+#   python bench_suite.py --compare bench.json     # after a change, exits 1 on a regression
+#
+# Groups, times in microseconds per call:
+#   driver     read_xyz, read_xyz_if_ready, read_all, signed_int32, calibrate
+#   buffering  collectAccelerometer / collectMagnetometer (SimpleRequest.py),
+#              RecordingWriter.append_result (Measurements.py)
+#   serialize  SimpleRequest.encodeBatch per payload, and the gzip pass of UploadClient
+#   pipeline   readings per second of the SimpleRequest.py loop run flat out
+#              (read, buffer, upload every --batch_size readings), per payload
+#   upload     POST latency to the stand-in, p50 and p99 in ms, per payload
+# A simulated transaction costs only its Python side; on the Pi the I2C
+# transfer comes on top, so driver times are a lower bound there.
+import argparse
+import contextlib
+import gzip
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import timeit
+from datetime import datetime
+
+from accel import LIS331DLH
+from bench_payload import make_batch
+from recording import RecordingWriter
+from scheduler import percentile
+from sim_bus import SimulatedSMBus
+from SimpleRequest import SimpleRequest, TroykaIMU
+from stand_in_server import StandInServer
+
+PAYLOADS = ('records', 'columnar', 'binary')
+
+
+def per_call_us(function, number, repeat):
+    return min(timeit.repeat(function, number=number, repeat=repeat)) / number * 1e6
+
+
+def result(group, name, value, unit='us', better='lower'):
+    return {'group': group, 'name': name, 'value': value, 'unit': unit, 'better': better}
+
+
+def bench_driver(number, repeat):
+    imu = TroykaIMU(bus=SimulatedSMBus())
+    accelerometer, magnetometer = imu.accelerometer, imu.magnetometer
+    magnetometer.calibrate_matrix([[1.02, 0.01, 0.0], [0.01, 0.98, 0.0], [0.0, 0.0, 1.0]], [120, -80, 35])
+    word = 0xFFF0
+    return [
+        result('driver', 'accelerometer.read_xyz', per_call_us(accelerometer.read_xyz, number, repeat)),
+        result('driver', 'magnetometer.read_xyz', per_call_us(magnetometer.read_xyz, number, repeat)),
+        result('driver', 'accelerometer.read_xyz_if_ready', per_call_us(accelerometer.read_xyz_if_ready, number, repeat)),
+        result('driver', 'magnetometer.read_all', per_call_us(magnetometer.read_all, number, repeat)),
+        result('driver', 'signed_int32', per_call_us(lambda: LIS331DLH.signed_int32(word), number, repeat)),
+        result('driver', 'magnetometer.calibrate', per_call_us(magnetometer.calibrate, number, repeat)),
+    ]
+
+
+def bench_buffering(number, repeat, directory):
+    simple_request = SimpleRequest('http://127.0.0.1:9')
+    xyz = (3472, 976, 16512)
+    results = [
+        result('buffering', 'collectAccelerometer', per_call_us(
+            lambda: simple_request.collectAccelerometer(xyz[0], xyz[1], xyz[2], 'label', '', 'people', 'accelerometer'),
+            number, repeat)),
+        result('buffering', 'collectMagnetometer', per_call_us(
+            lambda: simple_request.collectMagnetometer(xyz[0], xyz[1], xyz[2], 'label', '', 'people', 'magnetometer'),
+            number, repeat)),
+    ]
+    simple_request.close()
+
+    writer = RecordingWriter(os.path.join(directory, 'bench.screc'))
+    row = dict(('%s_%s' % (sensor, axis), 1.0) for sensor in ('accel', 'gyro', 'mag') for axis in 'xyz')
+    row['datetime_now'] = datetime.now()
+    results.append(result('buffering', 'RecordingWriter.append_result',
+                          per_call_us(lambda: writer.append_result(row), number, repeat)))
+    writer.close()
+    return results
+
+
+def bench_serialize(batch_size, repeat):
+    batch = make_batch(batch_size)
+    results = []
+    for payload in PAYLOADS:
+        simple_request = SimpleRequest('http://127.0.0.1:9', payload=payload)
+        body = simple_request.encodeBatch(batch)[0]
+        if isinstance(body, str):
+            body = body.encode('utf-8')
+        seconds = per_call_us(lambda: simple_request.encodeBatch(batch), 1, repeat) / 1e6
+        results.append(result('serialize', 'encodeBatch %s per sample' % payload, seconds / batch_size * 1e6))
+        if simple_request.client.gzip_body:
+            seconds = per_call_us(lambda: gzip.compress(body, 6), 1, repeat) / 1e6
+            results.append(result('serialize', 'gzip %s per sample' % payload, seconds / batch_size * 1e6))
+        results.append(result('serialize', 'body %s per sample' % payload, len(body) / float(batch_size), 'bytes'))
+        simple_request.close()
+    return results
+
+
+# The SimpleRequest.py loop without the scheduler: both sensors read and
+# buffered per tick, one synchronous upload every batch_size ticks
+def bench_pipeline(url, batch_size, duration):
+    results = []
+    for payload in PAYLOADS:
+        imu = TroykaIMU(bus=SimulatedSMBus())
+        simple_request = SimpleRequest(url, payload=payload)
+        ticks = 0
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            while time.perf_counter() - start < duration:
+                for _ in range(batch_size):
+                    x, y, z = imu.magnetometer.read_xyz()
+                    simple_request.collectMagnetometer(x, y, z, 'label', '', 'people', 'magnetometer')
+                    x, y, z = imu.accelerometer.read_xyz()
+                    simple_request.collectAccelerometer(x, y, z, 'label', '', 'people', 'accelerometer')
+                ticks += batch_size
+                simple_request.sendData()
+        elapsed = time.perf_counter() - start
+        simple_request.close()
+        results.append(result('pipeline', 'achievable rate %s' % payload, ticks / elapsed, 'Hz', 'higher'))
+    return results
+
+
+def bench_upload(url, batch_size, n_requests):
+    batch = make_batch(batch_size)
+    results = []
+    for payload in PAYLOADS:
+        simple_request = SimpleRequest(url, payload=payload)
+        data, headers = simple_request.encodeBatch(batch)
+        path = simple_request.endpoints['accelerometer']
+        latencies = []
+        for _ in range(n_requests):
+            start = time.perf_counter()
+            simple_request.client.post(path, data, headers)
+            latencies.append(time.perf_counter() - start)
+        simple_request.close()
+        results.append(result('upload', 'POST %s p50' % payload, percentile(latencies, 50) * 1e3, 'ms'))
+        results.append(result('upload', 'POST %s p99' % payload, percentile(latencies, 99) * 1e3, 'ms'))
+    return results
+
+
+def environment():
+    try:
+        commit = subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                         stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        'date': datetime.now().isoformat(),
+        'commit': commit,
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'platform': platform.platform(),
+    }
+
+
+# Prints old and new values side by side, returns the regressed results
+def compare(old, new, tolerance):
+    previous = dict(((item['group'], item['name']), item) for item in old['results'])
+    regressions = []
+    print('%-10s %-40s %12s %12s %8s' % ('group', 'name', 'old', 'new', 'change'))
+    for item in new['results']:
+        before = previous.get((item['group'], item['name']))
+        if before is None or not before['value']:
+            continue
+        ratio = item['value'] / float(before['value'])
+        worse = ratio > 1 + tolerance if item['better'] == 'lower' else ratio < 1 - tolerance
+        if worse:
+            regressions.append(item)
+        print('%-10s %-40s %12.3f %12.3f %+7.1f%%%s' % (item['group'], item['name'], before['value'],
+                                                      item['value'], (ratio - 1) * 100, '  <--' if worse else ''))
+    return regressions
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--groups', type=str, default='driver,buffering,serialize,pipeline,upload')
+    parser.add_argument('--number', type=int, default=2000)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--batch_size', type=int, default=200)
+    parser.add_argument('--duration', type=float, default=2.0)
+    parser.add_argument('--requests', type=int, default=50)
+    parser.add_argument('--output', type=str, default=None)
+    parser.add_argument('--compare', type=str, default=None)
+    parser.add_argument('--tolerance', type=float, default=0.2)
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    groups = args.groups.split(',')
+
+    server = StandInServer(('127.0.0.1', 0))
+    server.start()
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        if 'driver' in groups:
+            results.extend(bench_driver(args.number, args.repeat))
+        if 'buffering' in groups:
+            results.extend(bench_buffering(args.number, args.repeat, directory))
+    if 'serialize' in groups:
+        results.extend(bench_serialize(args.batch_size, args.repeat))
+    if 'pipeline' in groups:
+        results.extend(bench_pipeline(server.url(), args.batch_size, args.duration))
+    if 'upload' in groups:
+        results.extend(bench_upload(server.url(), args.batch_size, args.requests))
+    server.shutdown()
+
+    report = {'environment': environment(), 'config': vars(args), 'results': results}
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    if args.compare is not None:
+        with open(args.compare) as f:
+            regressions = compare(json.load(f), report, args.tolerance)
+        if regressions:
+            print('%d results regressed by more than %d%%' % (len(regressions), args.tolerance * 100))
+            sys.exit(1)
+    else:
+        for item in results:
+            print('%-10s %-40s %12.3f %s' % (item['group'], item['name'], item['value'], item['unit']))
@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+from array import array
+from datetime import datetime
+import time
+
+ACCELEROMETER_AXES = ('ax', 'ay', 'az')
+MAGNETOMETER_AXES = ('x', 'y', 'z')
+
+SENSOR_AXES = {
+    'accelerometer': ACCELEROMETER_AXES,
+    'magnetometer': MAGNETOMETER_AXES,
+}
+
+
+class SampleBatch(object):
+    # Raw int16 readings of one sensor, stored column-wise in typed arrays.
+    # Session metadata (label, metaInfo, peopleId, typeSensor) is kept once per
+    # batch, and every sample only costs 3 * 2 bytes of axes plus an 8 byte
+    # monotonic timestamp. Wall-clock time of a sample is recovered from the
+    # anchor pair (wall clock, monotonic clock) taken at the first sample.
+    # rate_hz is the sampling rate the readings were taken at, set by the
+    # adaptive acquisition (adaptive_rate.py), None for a fixed rate.
+
+    def __init__(self, typeSensor, label='', metaInfo='', peopleId=''):
+        self.typeSensor = typeSensor
+        self.label = label
+        self.metaInfo = metaInfo
+        self.peopleId = peopleId
+        self.axes = SENSOR_AXES[typeSensor]
+
+        self.x = array('h')
+        self.y = array('h')
+        self.z = array('h')
+        self.timestamps = array('q')     # time.monotonic_ns()
+
+        self.anchor_wall_ns = None       # time.time_ns() of the first sample
+        self.anchor_monotonic_ns = None  # time.monotonic_ns() of the first sample
+        self.rate_hz = None
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    def set_meta(self, label, metaInfo, peopleId):
+        self.label = label
+        self.metaInfo = metaInfo
+        self.peopleId = peopleId
+
+    def append(self, x, y, z, timestamp=None):
+        if timestamp is None:
+            timestamp = time.monotonic_ns()
+        if self.anchor_monotonic_ns is None:
+            self.anchor_wall_ns = time.time_ns() - (time.monotonic_ns() - timestamp)
+            self.anchor_monotonic_ns = timestamp
+        self.x.append(x)
+        self.y.append(y)
+        self.z.append(z)
+        self.timestamps.append(timestamp)
+
+    # Bulk append of an (N, 3) int16 NumPy array of readings and their
+    # time.monotonic_ns() timestamps, e.g. frames from a shm_ring consumer
+    def extend(self, xyz, timestamps):
+        if not len(timestamps):
+            return
+        if self.anchor_monotonic_ns is None:
+            first = int(timestamps[0])
+            self.anchor_wall_ns = time.time_ns() - (time.monotonic_ns() - first)
+            self.anchor_monotonic_ns = first
+        self.x.frombytes(xyz[:, 0].astype('=i2').tobytes())
+        self.y.frombytes(xyz[:, 1].astype('=i2').tobytes())
+        self.z.frombytes(xyz[:, 2].astype('=i2').tobytes())
+        self.timestamps.frombytes(timestamps.astype('=i8').tobytes())
+
+    # Appends the readings of another batch of the same sensor, e.g. one
+    # window kept by aggregation.WindowAggregator
+    def extend_batch(self, other):
+        if not len(other):
+            return
+        if self.anchor_monotonic_ns is None:
+            self.anchor_wall_ns = other.anchor_wall_ns
+            self.anchor_monotonic_ns = other.anchor_monotonic_ns
+        self.x.extend(other.x)
+        self.y.extend(other.y)
+        self.z.extend(other.z)
+        self.timestamps.extend(other.timestamps)
+
+    # Wall-clock time of every sample in nanoseconds since the epoch
+    def wall_times_ns(self):
+        offset = self.anchor_wall_ns - self.anchor_monotonic_ns if self.timestamps else 0
+        return [t + offset for t in self.timestamps]
+
+    def anchor_isoformat(self):
+        if self.anchor_wall_ns is None:
+            return None
+        return datetime.fromtimestamp(self.anchor_wall_ns / 1e9).isoformat()
+
+    # Compact JSON-friendly form: metadata once, columns of numbers, sample
+    # times as microsecond offsets from the anchor
+    def to_dict(self):
+        anchor = self.anchor_monotonic_ns or 0
+        ax, ay, az = self.axes
+        return {
+            'typeSensor': self.typeSensor,
+            'label': self.label,
+            'metaInfo': self.metaInfo,
+            'peopleId': self.peopleId,
+            'dateCreated': self.anchor_isoformat(),
+            'anchorWallNs': self.anchor_wall_ns,
+            'anchorMonotonicNs': self.anchor_monotonic_ns,
+            'offsetsUs': [(t - anchor) // 1000 for t in self.timestamps],
+            'rateHz': self.rate_hz,
+            ax: self.x.tolist(),
+            ay: self.y.tolist(),
+            az: self.z.tolist(),
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        batch = cls(data['typeSensor'], data['label'], data['metaInfo'], data['peopleId'])
+        ax, ay, az = batch.axes
+        batch.anchor_wall_ns = data['anchorWallNs']
+        batch.anchor_monotonic_ns = data['anchorMonotonicNs']
+        batch.rate_hz = data.get('rateHz')
+        anchor = batch.anchor_monotonic_ns or 0
+        batch.x = array('h', data[ax])
+        batch.y = array('h', data[ay])
+        batch.z = array('h', data[az])
+        batch.timestamps = array('q', [anchor + offset * 1000 for offset in data['offsetsUs']])
+        return batch
+
+    # One dict per sample, the format /api/accelerometer and /api/magnetometer
+    # have always accepted (plus rateHz when the rate is adaptive)
+    def to_records(self):
+        ax, ay, az = self.axes
+        records = []
+        for x, y, z, wall_ns in zip(self.x, self.y, self.z, self.wall_times_ns()):
+            record = {
+                'dateCreated': datetime.fromtimestamp(wall_ns / 1e9).isoformat(),
+                'label': self.label,
+                'metaInfo': self.metaInfo,
+                'peopleId': self.peopleId,
+                'typeSensor': self.typeSensor,
+                ax: x,
+                ay: y,
+                az: z,
+            }
+            if self.rate_hz is not None:
+                record['rateHz'] = self.rate_hz
+            records.append(record)
+        return records
+
+
+class SummaryBatch(object):
+    # Per-window summaries (aggregation.WindowAggregator) of one upload, posted
+    # to /api/summary as JSON. Session metadata is kept once per batch, like
+    # SampleBatch.
+
+    typeSensor = 'summary'
+
+    def __init__(self, label='', metaInfo='', peopleId='', windows=None):
+        self.label = label
+        self.metaInfo = metaInfo
+        self.peopleId = peopleId
+        self.windows = list(windows or [])
+
+    def __len__(self):
+        return len(self.windows)
+
+    def set_meta(self, label, metaInfo, peopleId):
+        self.label = label
+        self.metaInfo = metaInfo
+        self.peopleId = peopleId
+
+    def append(self, window):
+        self.windows.append(window)
+
+    def to_dict(self):
+        return {
+            'typeSensor': self.typeSensor,
+            'label': self.label,
+            'metaInfo': self.metaInfo,
+            'peopleId': self.peopleId,
+            'windows': self.windows,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data['label'], data['metaInfo'], data['peopleId'], data['windows'])
@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+# Hard/soft-iron calibration of the LIS3MDL for whole batches of readings.
+#
+# A calibrated reading is  M (raw - bias)  where bias is the hard-iron offset
+# and M the soft-iron correction, the same convention as
+# LIS3MDL.calibrate_matrix(calibration_matrix, bias). fit_ellipsoid estimates
+# both from a session where the chair was turned through as many orientations
+# as possible:
+#
+#   python calibration.py --duration 60 --output mag_calibration.json
+import argparse
+import json
+import time
+
+import numpy as np
+
+
+def apply_calibration(raw_xyz, calibration_matrix, bias):
+    raw_xyz = np.asarray(raw_xyz, dtype=np.float64)
+    return (raw_xyz - np.asarray(bias, dtype=np.float64)).dot(np.asarray(calibration_matrix, dtype=np.float64).T)
+
+
+# Heading in degrees [0, 360) for an (N, 3) array of calibrated readings
+def azimuth(calibrated_xyz):
+    calibrated_xyz = np.asarray(calibrated_xyz)
+    heading = np.arctan2(calibrated_xyz[:, 1], calibrated_xyz[:, 0])
+    return np.degrees(np.mod(heading, 2 * np.pi))
+
+
+# Least-squares fit of the quadric
+#   a x^2 + b y^2 + c z^2 + 2d xy + 2e xz + 2f yz + 2g x + 2h y + 2i z = 1
+# to the raw readings. Returns (calibration_matrix, bias) that map the fitted
+# ellipsoid onto a sphere of radius `radius` (default: the geometric mean of the
+# ellipsoid semi-axes, so the calibrated values keep the raw LSB scale).
+def fit_ellipsoid(raw_xyz, radius=None):
+    raw_xyz = np.asarray(raw_xyz, dtype=np.float64)
+    if raw_xyz.ndim != 2 or raw_xyz.shape[1] != 3 or len(raw_xyz) < 9:
+        raise ValueError('need an (N, 3) array with at least 9 readings')
+
+    # Center and scale first, the normal equations are badly conditioned in raw LSB
+    offset = raw_xyz.mean(axis=0)
+    scale = np.abs(raw_xyz - offset).max() or 1.0
+    x, y, z = ((raw_xyz - offset) / scale).T
+    design = np.column_stack([x * x, y * y, z * z, 2 * x * y, 2 * x * z, 2 * y * z, 2 * x, 2 * y, 2 * z])
+    coefficients = np.linalg.lstsq(design, np.ones_like(x), rcond=None)[0]
+    a, b, c, d, e, f, g, h, i = coefficients
+
+    quadric = np.array([[a, d, e],
+                        [d, b, f],
+                        [e, f, c]])
+    linear = np.array([g, h, i])
+    center = -np.linalg.solve(quadric, linear)
+    # (p - center)^T quadric (p - center) = 1 + center^T quadric center
+    quadric = quadric / (1.0 + center.dot(quadric).dot(center))
+
+    eigenvalues, eigenvectors = np.linalg.eigh(quadric)
+    if np.any(eigenvalues <= 0):
+        raise ValueError('readings do not describe an ellipsoid, rotate the sensor through more orientations')
+    semi_axes = 1.0 / np.sqrt(eigenvalues)
+    if radius is None:
+        radius = np.prod(semi_axes) ** (1.0 / 3) * scale
+    # Symmetric square root of the quadric maps the ellipsoid onto the unit sphere
+    matrix = eigenvectors.dot(np.diag(np.sqrt(eigenvalues))).dot(eigenvectors.T) * radius / scale
+
+    bias = center * scale + offset
+    return matrix, bias
+
+
+# Spread of |calibrated| relative to its mean, 0 for a perfect sphere
+def sphericity_error(raw_xyz, calibration_matrix, bias):
+    norms = np.linalg.norm(apply_calibration(raw_xyz, calibration_matrix, bias), axis=1)
+    return norms.std() / norms.mean()
+
+
+def save_calibration(path, calibration_matrix, bias):
+    with open(path, 'w') as f:
+        json.dump({
+            'calibration_matrix': np.asarray(calibration_matrix).tolist(),
+            'bias': np.asarray(bias).tolist(),
+        }, f, indent=2)
+
+
+def load_calibration(path):
+    with open(path) as f:
+        data = json.load(f)
+    return data['calibration_matrix'], data['bias']
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--duration', type=float, default=60)
+    parser.add_argument('--timestep_detect', type=float, default=0.02)
+    parser.add_argument('--output', type=str, default='mag_calibration.json')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+
+    from magnet import LIS3MDL
+    magnetometer = LIS3MDL()
+
+    print('Turn the chair slowly through every orientation for %d seconds' % args.duration)
+    readings = []
+    deadline = time.monotonic() + args.duration
+    while time.monotonic() < deadline:
+        readings.append(magnetometer.read_xyz())
+        time.sleep(args.timestep_detect)
+
+    matrix, bias = fit_ellipsoid(readings)
+    print('Bias: ', bias)
+    print('Calibration matrix: ', matrix)
+    print('Sphericity error: %.4f (uncalibrated %.4f)' % (sphericity_error(readings, matrix, bias),
+                                                         sphericity_error(readings, np.eye(3), np.zeros(3))))
+    save_calibration(args.output, matrix, bias)
@@ -0,0 +1,300 @@
+# -*- coding: utf-8 -*-
+# Gateway mode: one process samples any number of accelerometers and
+# magnetometers on one or more I2C buses and uploads all of them, instead of
+# one SimpleRequest.py per chair or sensor position.
+#
+# Devices are (bus, address, sensor type, chair id), each with its own read
+# rate and upload period. They come from a JSON file
+#
+#   {"devices": [
+#     {"bus": 1, "address": "0x18", "sensor": "accelerometer", "chair": "chair-1", "rate_hz": 50},
+#     {"bus": 1, "address": "0x1c", "sensor": "magnetometer", "chair": "chair-1", "rate_hz": 20},
+#     {"bus": 1, "address": "0x19", "sensor": "accelerometer", "chair": "chair-2", "send_s": 30,
+#      "peopleId": "p7"}
+#   ]}
+#
+#   python gateway.py --config gateway.json --url http://127.0.0.1:8080
+#
+# or from --device bus:address:sensor:chair[:rate_hz[:send_s]], repeated:
+#
+#   python gateway.py --simulate 1 --device 1:0x18:accelerometer:chair-1:50 --device 1:0x19:accelerometer:chair-2:10
+#
+# All devices share one timing loop: reads are kept on each device's grid of
+# ticks (missed ticks are skipped, like scheduler.FixedRateScheduler) and the
+# loop sleeps until the earliest one. Every device fills its own
+# buffers.SampleBatch, metaInfo names the device. The batches due at one
+# upload tick go out together as one UploadQueue entry, posted concurrently by
+# a single UploadWorker over one keep-alive session (SimpleRequest.sendData).
+# A device that fails to read is counted and retried on its next tick.
+import argparse
+import heapq
+import json
+import math
+import time
+
+from accel import LIS331DLH
+from buffers import SampleBatch
+from magnet import LIS3MDL
+from metrics import Metrics, MetricsServer, Reporter
+from SimpleRequest import SimpleRequest
+from uploader import UploadQueue, UploadWorker, BACKPRESSURE_POLICIES
+
+SENSORS = {
+    'accelerometer': LIS331DLH,
+    'magnetometer': LIS3MDL,
+}
+
+
+class Device(object):
+
+    def __init__(self, bus, address, sensor, chair, rate_hz=10.0, send_s=10.0, label='', meta=None, peopleId=''):
+        if sensor not in SENSORS:
+            raise ValueError('unknown sensor type: ' + str(sensor))
+        self.bus = int(bus)
+        self.address = int(address, 0) if isinstance(address, str) else int(address)
+        self.sensor = sensor
+        self.chair = chair
+        self.period = 1.0 / float(rate_hz)
+        self.send_period = float(send_s)
+        self.label = label
+        self.peopleId = peopleId
+        self.name = '%s/%s@%d:0x%02x' % (chair, sensor, self.bus, self.address)
+        self.meta = meta if meta is not None else self.name
+
+        self.driver = None
+        self.batch = self.new_batch()
+        self.samples = 0
+        self.skipped_ticks = 0
+        self.read_errors = 0
+        self._tick = 0
+        self._send_tick = 0
+
+    def new_batch(self):
+        return SampleBatch(self.sensor, self.label, self.meta, self.peopleId)
+
+    def open(self, bus):
+        self.driver = SENSORS[self.sensor](address=self.address, bus=bus)
+
+    # Deadline of the next read on the grid t0 + k * period, skipping ticks
+    # that already passed
+    def next_read(self, t0, now):
+        self._tick += 1
+        deadline = t0 + self._tick * self.period
+        if now > deadline:
+            tick = int(math.floor((now - t0) / self.period)) + 1
+            self.skipped_ticks += tick - self._tick
+            self._tick = tick
+            deadline = t0 + tick * self.period
+        return deadline
+
+    def next_send(self, t0):
+        self._send_tick += 1
+        return t0 + self._send_tick * self.send_period
+
+    def take_batch(self):
+        batch, self.batch = self.batch, self.new_batch()
+        return batch
+
+    def stats(self):
+        return {
+            'rate_hz': 1.0 / self.period,
+            'samples': self.samples,
+            'skipped_ticks': self.skipped_ticks,
+            'read_errors': self.read_errors,
+        }
+
+
+# 'bus:address:sensor:chair[:rate_hz[:send_s]]'
+def parse_device(spec, **defaults):
+    fields = spec.split(':')
+    if not 4 <= len(fields) <= 6:
+        raise ValueError('device should be bus:address:sensor:chair[:rate_hz[:send_s]], got ' + spec)
+    options = dict(defaults)
+    if len(fields) > 4:
+        options['rate_hz'] = float(fields[4])
+    if len(fields) > 5:
+        options['send_s'] = float(fields[5])
+    return Device(fields[0], fields[1], fields[2], fields[3], **options)
+
+
+def load_config(path, **defaults):
+    with open(path) as f:
+        config = json.load(f)
+    devices = []
+    for entry in config['devices']:
+        options = dict(defaults)
+        options.update(entry)
+        devices.append(Device(**options))
+    return devices
+
+
+# One SMBus per bus number, shared by every device on it. simulate builds
+# sim_bus.SimulatedSMBus buses holding the configured devices.
+def open_buses(devices, simulate=False):
+    addresses = set()
+    for device in devices:
+        if (device.bus, device.address) in addresses:
+            raise ValueError('two devices at bus %d address 0x%02x' % (device.bus, device.address))
+        addresses.add((device.bus, device.address))
+
+    buses = {}
+    for bus_number in sorted(set(device.bus for device in devices)):
+        if simulate:
+            from sim_bus import SimulatedSMBus, SimulatedLIS331DLH, SimulatedLIS3MDL
+            simulated = {'accelerometer': SimulatedLIS331DLH, 'magnetometer': SimulatedLIS3MDL}
+            buses[bus_number] = SimulatedSMBus(dict(
+                (device.address, simulated[device.sensor](seed=n))
+                for n, device in enumerate(devices) if device.bus == bus_number))
+        else:
+            import smbus
+            buses[bus_number] = smbus.SMBus(bus_number)
+    for device in devices:
+        device.open(buses[device.bus])
+    return buses
+
+
+class Gateway(object):
+
+    def __init__(self, devices, upload_queue=None, metrics=None, clock=time.monotonic, sleep=time.sleep):
+        self.devices = devices
+        self.upload_queue = upload_queue
+        self.metrics = metrics if metrics is not None else Metrics()
+        self._clock = clock
+        self._sleep = sleep
+        self.uploads = 0
+        self.metrics.add_collector(lambda: {
+            'skipped_ticks': sum(device.skipped_ticks for device in self.devices),
+            'read_errors': sum(device.read_errors for device in self.devices),
+        })
+
+    def read(self, device):
+        start = time.perf_counter()
+        try:
+            x, y, z = device.driver.read_xyz()
+        except IOError as e:
+            device.read_errors += 1
+            self.metrics.inc('read_errors_' + device.sensor)
+            print('read of %s failed: %s' % (device.name, e))
+            return
+        self.metrics.observe('read_' + device.sensor, time.perf_counter() - start)
+        device.batch.append(x, y, z)
+        device.samples += 1
+        self.metrics.inc('samples')
+        self.metrics.inc('samples_' + device.sensor)
+
+    # The batches of every device whose upload tick passed, as one upload
+    def flush(self, due):
+        batch = {}
+        for device in due:
+            if len(device.batch):
+                batch[device.name] = device.take_batch()
+        if batch and self.upload_queue is not None:
+            self.upload_queue.put(batch)
+            self.uploads += 1
+        return batch
+
+    # Samples every device for `duration` seconds, on_tick() is called after every read
+    def run(self, duration, on_tick=None):
+        t0 = self._clock()
+        end = t0 + duration
+        reads = [(t0, n) for n in range(len(self.devices))]
+        sends = [(device.next_send(t0), n) for n, device in enumerate(self.devices)]
+        heapq.heapify(sends)
+        while True:
+            deadline, n = reads[0]
+            if sends[0][0] <= deadline:
+                deadline = sends[0][0]
+            if deadline >= end:
+                break
+            delay = deadline - self._clock()
+            if delay > 0:
+                self._sleep(delay)
+
+            due = []
+            while sends[0][0] <= deadline:
+                _, n_send = heapq.heappop(sends)
+                due.append(self.devices[n_send])
+                heapq.heappush(sends, (self.devices[n_send].next_send(t0), n_send))
+            if due:
+                self.flush(due)
+                continue
+
+            device = self.devices[n]
+            self.read(device)
+            heapq.heapreplace(reads, (device.next_read(t0, self._clock()), n))
+            if on_tick is not None:
+                on_tick()
+        self.flush(self.devices)
+
+    def stats(self):
+        return dict((device.name, device.stats()) for device in self.devices)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--config', type=str, default=None)
+    parser.add_argument('--device', type=str, action='append', default=[])
+    parser.add_argument('--rate_hz', type=float, default=10.0)
+    parser.add_argument('--send_s', type=float, default=10.0)
+    parser.add_argument('--max_time', type=float, default=60)
+    parser.add_argument('--label', type=str, default='')
+    parser.add_argument('--peopleId', type=str, default='')
+    parser.add_argument('--simulate', type=bool, default=False)
+    parser.add_argument('--url', type=str, default='http://smart-chair-iot-dev.us-east-1.elasticbeanstalk.com')
+    parser.add_argument('--payload', type=str, default='binary', choices=('records', 'columnar', 'binary'))
+    parser.add_argument('--upload_threads', type=int, default=4)
+    parser.add_argument('--queue_size', type=int, default=6)
+    parser.add_argument('--backpressure', type=str, default='drop_oldest', choices=BACKPRESSURE_POLICIES)
+    parser.add_argument('--spill_dir', type=str, default='spill')
+    parser.add_argument('--verbose', type=bool, default=True)
+    parser.add_argument('--summary_interval', type=float, default=5.0)
+    parser.add_argument('--metrics_file', type=str, default=None)
+    parser.add_argument('--metrics_port', type=int, default=None)
+    args = parser.parse_args()
+    if args.config is None and not args.device:
+        parser.error('give the devices with --config or --device')
+    return args
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    defaults = {'rate_hz': args.rate_hz, 'send_s': args.send_s, 'label': args.label, 'peopleId': args.peopleId}
+    devices = load_config(args.config, **defaults) if args.config is not None else []
+    devices.extend(parse_device(spec, **defaults) for spec in args.device)
+    buses = open_buses(devices, args.simulate)
+    for device in devices:
+        print('%s: %g Hz, upload every %g s' % (device.name, 1.0 / device.period, device.send_period))
+
+    metrics = Metrics()
+    reporter = Reporter(metrics, args.summary_interval, args.metrics_file, args.verbose, rate_counter='samples')
+    metrics_server = None
+    if args.metrics_port is not None:
+        metrics_server = MetricsServer(metrics, ('0.0.0.0', args.metrics_port))
+        metrics_server.start()
+
+    simple_request = SimpleRequest(url=args.url, payload=args.payload, metrics=metrics,
+                                   upload_threads=args.upload_threads, verbose=args.verbose)
+    upload_queue = UploadQueue(max_batches=args.queue_size, policy=args.backpressure, spill_dir=args.spill_dir)
+    upload_worker = UploadWorker(simple_request, upload_queue)
+    upload_worker.start()
+    metrics.add_collector(lambda: {
+        'upload_queue_depth': upload_queue.depth(),
+        'dropped_batches': upload_queue.dropped_batches,
+        'dropped_samples': upload_queue.dropped_samples,
+    })
+
+    gateway = Gateway(devices, upload_queue, metrics)
+    gateway.run(args.max_time, reporter.tick)
+
+    upload_worker.stop(timeout=args.send_s)
+    print('Upload stats: ', upload_worker.stats())
+    simple_request.close()
+    print('HTTP stats: ', simple_request.client.stats())
+    reporter.report()
+    if metrics_server is not None:
+        metrics_server.shutdown()
+    for bus in buses.values():
+        bus.close()
+
+    for name, stats in sorted(gateway.stats().items()):
+        print('%s: %s' % (name, stats))
@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+import gzip
+import random
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from metrics import Histogram, Metrics
+
+# Status codes worth another attempt, anything else 4xx is a client error
+RETRY_STATUSES = (408, 429, 500, 502, 503, 504)
+# Servers that do not accept compressed request bodies answer with one of these.
+# 415 says so, 400 may as well be a malformed payload: gzip is only turned off
+# after the same body is accepted uncompressed.
+GZIP_REJECTED_STATUSES = (400, 415)
+GZIP_UNSUPPORTED_STATUS = 415
+
+
+class UploadClient(object):
+    # Keep-alive connection pool to the backend shared by every upload.
+    # Bodies are gzip-compressed unless the server turns that down, and failed
+    # requests are retried with bounded exponential backoff plus jitter. A body
+    # rejected compressed is resent once uncompressed right away, which is not
+    # counted as a retry. Every attempt is timed as the 'post' stage of metrics
+    # and in a latency histogram per path.
+
+    def __init__(self, url, gzip_body=True, timeout=(3.05, 10), max_retries=4,
+                 backoff=0.5, max_backoff=8.0, pool_size=4, metrics=None):
+        self.url = url
+        self.metrics = metrics if metrics is not None else Metrics()
+        self.gzip_body = gzip_body
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.retries = 0
+        self.failures = 0
+        self.bytes_sent = 0
+        self.latencies = {}  # path -> metrics.Histogram
+
+    def backoff_delay(self, attempt):
+        delay = min(self.max_backoff, self.backoff * (2 ** attempt))
+        return delay * random.uniform(0.5, 1.0)
+
+    # Returns the last response, or None if every attempt failed on the network
+    def post(self, path, data, headers):
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        headers = dict(headers)
+        body = data
+        if self.gzip_body:
+            body = gzip.compress(data, 6)
+            headers['Content-Encoding'] = 'gzip'
+
+        response = None
+        attempt = 0
+        uncompressed_resend = False
+        while True:
+            start = time.monotonic()
+            try:
+                response = self.session.post(self.url + path, data=body, headers=headers, timeout=self.timeout)
+            except requests.RequestException as e:
+                print('POST ' + path + ' failed: ' + str(e))
+                response = None
+            finally:
+                self._record(path, time.monotonic() - start, len(body))
+
+            if response is not None:
+                if response.status_code in GZIP_REJECTED_STATUSES and 'Content-Encoding' in headers:
+                    body = data
+                    del headers['Content-Encoding']
+                    if response.status_code == GZIP_UNSUPPORTED_STATUS:
+                        self._disable_gzip()
+                    else:
+                        uncompressed_resend = True
+                    continue
+                if uncompressed_resend and response.ok:
+                    self._disable_gzip()
+                uncompressed_resend = False
+                if response.status_code not in RETRY_STATUSES:
+                    break
+            if attempt >= self.max_retries:
+                break
+            attempt += 1
+            with self._lock:
+                self.retries += 1
+            self.metrics.inc('retries')
+            time.sleep(self.backoff_delay(attempt - 1))
+
+        if response is None or not response.ok:
+            with self._lock:
+                self.failures += 1
+            self.metrics.inc('upload_failures')
+        return response
+
+    def _disable_gzip(self):
+        if self.gzip_body:
+            print('Server does not accept gzip bodies, sending them uncompressed')
+            self.gzip_body = False
+
+    def _record(self, path, seconds, n_bytes):
+        with self._lock:
+            self.requests += 1
+            self.bytes_sent += n_bytes
+            if path not in self.latencies:
+                self.latencies[path] = Histogram()
+            self.latencies[path].observe(seconds)
+        self.metrics.observe('post', seconds)
+        self.metrics.inc('requests')
+        self.metrics.inc('bytes_sent', n_bytes)
+
+    def stats(self):
+        with self._lock:
+            stats = {
+                'requests': self.requests,
+                'retries': self.retries,
+                'failures': self.failures,
+                'bytes_sent': self.bytes_sent,
+            }
+            for path, histogram in self.latencies.items():
+                stats[path + ' p50_ms'] = histogram.percentile(50) * 1e3
+                stats[path + ' p99_ms'] = histogram.percentile(99) * 1e3
+            return stats
+
+    def close(self):
+        self.session.close()
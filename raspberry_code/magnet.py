@@ -1,4 +1,10 @@
-import smbus
+import struct
+
+try:
+    import smbus
+except ImportError:
+    # Not a Raspberry Pi: pass bus= explicitly (e.g. sim_bus.SimulatedSMBus)
+    smbus = None
 from math import atan2, pi, degrees
 
 class LIS3MDL(object):
@@ -62,6 +68,35 @@ class LIS3MDL(object):
         'ODR_80'            : 0b0011100,      # 80    Hz
     }
 
+    data_rate_hz = {
+        0b0000000           : 0.625,
+        0b0000100           : 1.25,
+        0b0001000           : 2.5,
+        0b0001100           : 5,
+        0b0010000           : 10,
+        0b0010100           : 20,
+        0b0011000           : 40,
+        0b0011100           : 80,
+    }
+
+    # With FAST_ODR the rate depends on the XY operating mode
+    fast_data_rate_hz = {
+        0b00000000          : 1000,
+        0b00100000          : 560,
+        0b01000000          : 300,
+        0b01100000          : 155,
+    }
+
+    # OUT_X_L..OUT_Z_H: three little-endian int16
+    _XYZ = struct.Struct('<hhh')
+    # STATUS_REG, OUT_X_L..OUT_Z_H, TEMP_OUT_L/H
+    _STATUS_XYZ_TEMP = struct.Struct('<Bhhhh')
+
+    # STATUS_REG bits
+    # ZYXOR ZOR YOR XOR ZYXDA ZDA YDA XDA
+    STATUS_ZYXDA = 1 << 3
+    STATUS_ZYXOR = 1 << 7
+
     temperature_measure = {'C',
                            'K',
                            'F',
@@ -95,10 +130,11 @@ class LIS3MDL(object):
                  sens_range=range_fs[0],
                  temperature_sensor_enable=True,
                  axis_operation_mode=axis_operation_mode['ULTRA_HIGH_PERF'],
-                 output_data_rate=configuration['ODR_80']
+                 output_data_rate=configuration['ODR_80'],
+                 bus=None
                  ):
         
-        self.wire = smbus.SMBus(port)
+        self.wire = bus if bus is not None else smbus.SMBus(port)
         
         self._address = address
         
@@ -115,6 +151,10 @@ class LIS3MDL(object):
         self.operation_mode_z_axis(axis_operation_mode)
         # Output Data Rate of 80 Hz Selected
         self.output_data_rate(output_data_rate)
+        # Data-ready acquisition counters
+        self.new_samples = 0
+        self.overruns = 0
+        self.not_ready = 0
 
     def identity(self):
         return self.wire.read_byte_data(self._address, self.register['WHO_AM_I']) == self.I2C_IDENTITY
@@ -137,9 +177,37 @@ class LIS3MDL(object):
 
     # Output data rate selection. Default value: 100
     def output_data_rate(self, rate=configuration['ODR_10']):
+        self._ctrlReg1 &= ~0b0011100
         self._ctrlReg1 |= rate
         self.wire.write_byte_data(self._address, self.register['CTRL_REG1'], self._ctrlReg1)
 
+    # Output data rate in effect, Hz. Low-power mode runs at 0.625 Hz
+    # whatever DO2..DO0 say
+    def odr_hz(self):
+        if self._ctrlReg3 & (1 << 5):
+            return self.data_rate_hz[self.configuration['ODR_0625']]
+        if self._ctrlReg1 & (1 << 1):
+            return self.fast_data_rate_hz[self._ctrlReg1 & 0b01100000]
+        return self.data_rate_hz[self._ctrlReg1 & 0b0011100]
+
+    # Slowest setting that delivers at least `hz` readings per second: low-power
+    # mode up to 0.625 Hz, then the ODR table, then FAST_ODR at the rate of the
+    # XY operating mode. Returns the data rate in effect.
+    def set_rate_hz(self, hz):
+        if hz <= self.data_rate_hz[self.configuration['ODR_0625']]:
+            self.fast_odr(False)
+            self.output_data_rate(self.configuration['ODR_0625'])
+            self.low_power(True)
+            return self.odr_hz()
+        self.low_power(False)
+        for code, rate in sorted(self.data_rate_hz.items(), key=lambda item: item[1]):
+            if rate >= hz:
+                self.fast_odr(False)
+                self.output_data_rate(code)
+                return self.odr_hz()
+        self.fast_odr(True)
+        return self.odr_hz()
+
     # FAST_ODR enables data rates higher than 80 Hz. Default value: 0
     # (0: Fast_ODR disabled; 1: FAST_ODR enabled)
     def fast_odr(self, enable=False):
@@ -177,9 +245,11 @@ class LIS3MDL(object):
     # Register 3 operations
     # 0 0 LP 0 0 SIM MD1 MD0
     # Low-power mode configuration. Default value: 0
-    def low_power(self):
-        self._ctrlReg3 |= (1 << 5)
-        self._ctrlReg1 |= self.configuration['ODR_0625']
+    def low_power(self, enable=True):
+        if enable:
+            self._ctrlReg3 |= (1 << 5)
+        else:
+            self._ctrlReg3 &= ~(1 << 5)
         self.wire.write_byte_data(self._address, self.register['CTRL_REG3'], self._ctrlReg3)
 
     # Power-Down mode
@@ -207,6 +277,29 @@ class LIS3MDL(object):
         self.wire.write_byte_data(self._address, self.register['CTRL_REG5'], self._ctrlReg5)
 
     # Getting data operations
+    def read_status(self):
+        return self.wire.read_byte_data(self._address, self.register['STATUS_REG'])
+
+    def data_ready(self):
+        return bool(self.read_status() & self.STATUS_ZYXDA)
+
+    # Data-ready aware read: STATUS_REG and OUT_X_L..OUT_Z_H in one transaction.
+    # Returns None when the sensor has no new sample since the last read, so a
+    # host loop polling faster than the ODR never stores duplicates.
+    # ZYXOR means a sample was overwritten before it was read.
+    # The DRDY pad of the LIS3MDL is always driven, no register setup is needed.
+    def read_xyz_if_ready(self):
+        # assert MSB to enable register address auto increment
+        values = self.wire.read_i2c_block_data(self._address, self.register['STATUS_REG'] | (1 << 7), 7)
+        status = values[0]
+        if not status & self.STATUS_ZYXDA:
+            self.not_ready += 1
+            return None
+        if status & self.STATUS_ZYXOR:
+            self.overruns += 1
+        self.new_samples += 1
+        return self._XYZ.unpack_from(bytearray(values), 1)
+
     def read_axis(self, reg):
         # assert MSB to enable register address auto increment
         return self.signed_int32(self.wire.read_word_data(self._address, reg | (1 << 7)))
@@ -214,9 +307,29 @@ class LIS3MDL(object):
     def read_xyz(self):
         # assert MSB to enable register address auto increment
         values = self.wire.read_i2c_block_data(self._address, self.register['OUT_X_L'] | (1 << 7), 6)
-        return (self.signed_int32(values[1] << 8 | values[0]),
-                self.signed_int32(values[3] << 8 | values[2]),
-                self.signed_int32(values[5] << 8 | values[4]))
+        return self._XYZ.unpack(bytearray(values))
+
+    # STATUS_REG, the three axes and the temperature in a single I2C transaction.
+    # Returns (status, x, y, z, temperature_raw)
+    def read_all(self):
+        # assert MSB to enable register address auto increment
+        values = self.wire.read_i2c_block_data(self._address, self.register['STATUS_REG'] | (1 << 7),
+                                               self._STATUS_XYZ_TEMP.size)
+        return self._STATUS_XYZ_TEMP.unpack(bytearray(values))
+
+    # Raw OUT_X_L..OUT_Z_H bytes, for buffering and decoding later in bulk
+    def read_xyz_raw(self):
+        # assert MSB to enable register address auto increment
+        return bytes(bytearray(self.wire.read_i2c_block_data(self._address, self.register['OUT_X_L'] | (1 << 7), 6)))
+
+    # Decodes N buffered raw readings (read_xyz_raw results or one joined
+    # bytes object) into an (N, 3) int16 NumPy array in one call
+    @staticmethod
+    def decode_xyz_batch(raw_readings):
+        import numpy as np
+        if not isinstance(raw_readings, (bytes, bytearray)):
+            raw_readings = b''.join(raw_readings)
+        return np.frombuffer(raw_readings, dtype='<i2').reshape(-1, 3)
 
     def read_gauss_x(self):
         return self.read_axis(self.register['OUT_X_L']) / self._mult
@@ -228,8 +341,9 @@ class LIS3MDL(object):
         return self.read_axis(self.register['OUT_Z_L']) / self._mult
 
     def read_gauss_xyz(self):
-        gauss = self.read_xyz()
-        return gauss[0] / self._mult, gauss[1] / self._mult, gauss[2] / self._mult
+        x, y, z = self.read_xyz()
+        scale = 1.0 / self._mult
+        return x * scale, y * scale, z * scale
 
     def read_calibrate_xyz(self):
         return self.calibrate()
@@ -239,24 +353,38 @@ class LIS3MDL(object):
         return calibrate_gauss[0] / self._mult, calibrate_gauss[1] / self._mult, calibrate_gauss[2] / self._mult
 
     def calibrate(self):
-        calibrated_values = []
-        uncalibrated_values = []
-        read_values = self.read_xyz()
-        for i in range(0, 3):
-            uncalibrated_values.append(read_values[i] - self._bias[i])
-
-        for i in range(0, 3):
-            result = 0
-            for j in range(0, 3):
-                result += self._calibration_matrix[i][j] * uncalibrated_values[j]
-            calibrated_values.append(result)
-        return calibrated_values
+        x, y, z = self.read_xyz()
+        x -= self._bias[0]
+        y -= self._bias[1]
+        z -= self._bias[2]
+        m = self._calibration_matrix
+        return [m[0][0] * x + m[0][1] * y + m[0][2] * z,
+                m[1][0] * x + m[1][1] * y + m[1][2] * z,
+                m[2][0] * x + m[2][1] * y + m[2][2] * z]
 
     def calibrate_matrix(self, calibration_matrix, bias):
-        self._bias = bias
-        self._calibration_matrix = calibration_matrix
+        self._bias = [float(value) for value in bias]
+        self._calibration_matrix = [[float(value) for value in row] for row in calibration_matrix]
         return None
 
+    # Fits bias and soft-iron matrix to the raw readings of a rotation session
+    # (ellipsoid fit, see calibration.py) and starts using them
+    def fit_calibration(self, raw_xyz):
+        from calibration import fit_ellipsoid
+        calibration_matrix, bias = fit_ellipsoid(raw_xyz)
+        self.calibrate_matrix(calibration_matrix, bias)
+        return calibration_matrix, bias
+
+    # Calibrated values for an (N, 3) array of raw readings in one vectorized pass
+    def calibrate_batch(self, raw_xyz):
+        from calibration import apply_calibration
+        return apply_calibration(raw_xyz, self._calibration_matrix, self._bias)
+
+    # Headings in degrees for an (N, 3) array of raw readings
+    def read_azimut_batch(self, raw_xyz):
+        from calibration import azimuth
+        return azimuth(self.calibrate_batch(raw_xyz))
+
     def read_azimut(self):
         if (self._bias[0] + self._bias[1] + self._bias[2]) != 0 and self._calibration_matrix[0][0] != 0:
             sensor = self.calibrate()
@@ -293,9 +421,13 @@ class LIS3MDL(object):
             return number | ~65535
         else:
             return number & 65535
+
+
 class TroykaIMU(object):
-    def __init__(self):
-        self.magnetometer = LIS3MDL()
-		
-imu = TroykaIMU()
-print(imu.magnetometer.read_xyz())
+    def __init__(self, bus=None):
+        self.magnetometer = LIS3MDL(bus=bus)
+
+
+if __name__ == '__main__':
+    imu = TroykaIMU()
+    print(imu.magnetometer.read_xyz())
@@ -0,0 +1,210 @@
+# -*- coding: utf-8 -*-
+# Low-overhead instrumentation of the sampling client.
+#
+# Metrics keeps
+#   stage histograms   seconds per call of every pipeline stage (I2C read per
+#                      sensor, buffering, serialization, POST), in fixed
+#                      log-spaced buckets, so recording is one bisect and two adds
+#   counters           samples, duplicates, dropped samples, retries, bytes sent, ...
+#   collectors         callables read only when a snapshot is taken, for
+#                      numbers other objects already keep (queue depth, skipped ticks)
+#
+#   metrics = Metrics()
+#   start = time.perf_counter()
+#   xyz = imu.accelerometer.read_xyz()
+#   metrics.observe('read_accelerometer', time.perf_counter() - start)
+#   metrics.inc('samples_accelerometer')
+#
+# Reporter turns snapshots into a rate-limited one-line summary and/or a JSONL
+# file, MetricsServer serves the Prometheus text format on /metrics.
+from bisect import bisect_left
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+# Upper bounds in seconds, 10 us .. 10 s
+BUCKETS = (1e-5, 2.5e-5, 5e-5, 1e-4, 2.5e-4, 5e-4, 1e-3, 2.5e-3, 5e-3,
+           1e-2, 2.5e-2, 5e-2, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+PREFIX = 'smartchair_'
+
+
+class Histogram(object):
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        # The last count is everything above the largest bound
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds):
+        self.counts[bisect_left(self.buckets, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    # Upper bound of the bucket holding the q-th percentile
+    def percentile(self, q):
+        if not self.count:
+            return 0.0
+        rank = q / 100.0 * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def snapshot(self):
+        return {
+            'count': self.count,
+            'mean_ms': self.sum / self.count * 1e3 if self.count else 0.0,
+            'p50_ms': self.percentile(50) * 1e3,
+            'p99_ms': self.percentile(99) * 1e3,
+            'max_ms': self.max * 1e3,
+        }
+
+
+class Metrics(object):
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.started = time.monotonic()
+        self.histograms = {}
+        self.counters = {}
+        self._collectors = []
+
+    # Stages are observed from the sampling loop and the upload threads
+    def observe(self, stage, seconds):
+        with self._lock:
+            histogram = self.histograms.get(stage)
+            if histogram is None:
+                histogram = self.histograms[stage] = Histogram()
+            histogram.observe(seconds)
+
+    def inc(self, name, value=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    # collector() returns {name: number}, called at snapshot time only
+    def add_collector(self, collector):
+        self._collectors.append(collector)
+
+    def gauges(self):
+        gauges = {}
+        for collector in self._collectors:
+            gauges.update(collector())
+        return gauges
+
+    def snapshot(self):
+        with self._lock:
+            snapshot = {
+                'uptime_s': time.monotonic() - self.started,
+                'counters': dict(self.counters),
+                'stages': dict((stage, histogram.snapshot()) for stage, histogram in self.histograms.items()),
+            }
+        snapshot['gauges'] = self.gauges()
+        return snapshot
+
+    def prometheus(self):
+        lines = []
+        with self._lock:
+            lines.append('# TYPE %sstage_seconds histogram' % PREFIX)
+            for stage, histogram in sorted(self.histograms.items()):
+                cumulative = 0
+                for bound, count in zip(histogram.buckets, histogram.counts):
+                    cumulative += count
+                    lines.append('%sstage_seconds_bucket{stage="%s",le="%g"} %d' % (PREFIX, stage, bound, cumulative))
+                lines.append('%sstage_seconds_bucket{stage="%s",le="+Inf"} %d' % (PREFIX, stage, histogram.count))
+                lines.append('%sstage_seconds_sum{stage="%s"} %.9f' % (PREFIX, stage, histogram.sum))
+                lines.append('%sstage_seconds_count{stage="%s"} %d' % (PREFIX, stage, histogram.count))
+            for name, value in sorted(self.counters.items()):
+                lines.append('# TYPE %s%s_total counter' % (PREFIX, name))
+                lines.append('%s%s_total %s' % (PREFIX, name, value))
+        for name, value in sorted(self.gauges().items()):
+            lines.append('# TYPE %s%s gauge' % (PREFIX, name))
+            lines.append('%s%s %s' % (PREFIX, name, value))
+        return '\n'.join(lines) + '\n'
+
+
+class Reporter(object):
+    # Every `interval` seconds: one summary line on stdout (if verbose) and one
+    # JSON snapshot appended to jsonl_path (if given). tick() is cheap enough
+    # to call for every sample.
+
+    def __init__(self, metrics, interval=5.0, jsonl_path=None, verbose=True, rate_counter='ticks'):
+        self.metrics = metrics
+        self.interval = interval
+        self.jsonl_path = jsonl_path
+        self.verbose = verbose
+        self.rate_counter = rate_counter
+        self._next = time.monotonic() + interval
+        self._last_time = metrics.started
+        self._last_count = 0
+
+    def tick(self):
+        now = time.monotonic()
+        if now >= self._next:
+            self._next = now + self.interval
+            self.report(now)
+
+    def report(self, now=None):
+        if now is None:
+            now = time.monotonic()
+        snapshot = self.metrics.snapshot()
+        count = snapshot['counters'].get(self.rate_counter, 0)
+        elapsed = now - self._last_time
+        snapshot['achieved_rate_hz'] = (count - self._last_count) / elapsed if elapsed > 0 else 0.0
+        self._last_time, self._last_count = now, count
+        if self.jsonl_path is not None:
+            snapshot['time'] = time.time()
+            with open(self.jsonl_path, 'a') as f:
+                f.write(json.dumps(snapshot) + '\n')
+        if self.verbose:
+            print(self.summary(snapshot))
+        return snapshot
+
+    @staticmethod
+    def summary(snapshot):
+        parts = ['%.1f Hz' % snapshot['achieved_rate_hz']]
+        for name, value in sorted(snapshot['counters'].items()):
+            parts.append('%s=%s' % (name, value))
+        for stage, stats in sorted(snapshot['stages'].items()):
+            parts.append('%s p50/p99 %.2f/%.2f ms' % (stage, stats['p50_ms'], stats['p99_ms']))
+        for name, value in sorted(snapshot['gauges'].items()):
+            parts.append('%s=%s' % (name, value))
+        return 'Metrics: ' + ', '.join(parts)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path != '/metrics':
+            self.send_error(404)
+            return
+        body = self.server.metrics.prometheus().encode('utf-8')
+        self.send_response(200)
+        self.send_header('content-type', 'text/plain; version=0.0.4')
+        self.send_header('content-length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class MetricsServer(HTTPServer):
+    # GET /metrics in the Prometheus text format, served from a daemon thread
+
+    def __init__(self, metrics, address=('127.0.0.1', 9100)):
+        HTTPServer.__init__(self, address, _MetricsHandler)
+        self.metrics = metrics
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return thread
@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+# Stress classifier inference on the device, NumPy only.
+#
+# Data_Analysis/export_model.py writes a fitted model into one .npz file:
+#   feature_names, data_min, data_max   the minmax_scale bounds of the training data
+#   classes                             class labels in model order
+#   kind 'linear'  coef (n_outputs, n_features), intercept, link, multi_class
+#                  (LogisticRegression, LinearSVC, OneVsRestClassifier of either);
+#                  probabilities are the softmax of the decision values for
+#                  'multinomial', normalized sigmoids for 'ovr'
+#   kind 'forest'  every tree's nodes in flat arrays (children with global
+#                  indices, -1 at leaves), tree_roots, and leaf class
+#                  fractions in value (RandomForestClassifier, DecisionTreeClassifier)
+# Loading is a single np.load, no pickle and no scikit-learn.
+#
+#   model = StressModel.load('stress_model.npz')
+#   model.predict_window({'Lean back': 0.1, 'Momentum': 0.02, ...})
+import numpy as np
+
+
+class StressModel(object):
+
+    def __init__(self, arrays):
+        self.kind = str(arrays['kind'])
+        self.feature_names = [str(name) for name in arrays['feature_names']]
+        self.classes = arrays['classes']
+        self.multilabel = bool(arrays['multilabel'])
+        data_min = arrays['data_min'].astype(np.float64)
+        data_range = arrays['data_max'].astype(np.float64) - data_min
+        # Same as sklearn's minmax_scale: constant features are only shifted
+        data_range[data_range == 0.0] = 1.0
+        self._data_min = data_min
+        self._scale = 1.0 / data_range
+        if self.kind == 'linear':
+            self.coef = arrays['coef'].astype(np.float64)
+            self.intercept = arrays['intercept'].astype(np.float64)
+            self.link = str(arrays['link'])
+            # Files exported before multi_class was written hold ovr models
+            self.multi_class = str(arrays.get('multi_class', 'ovr'))
+        elif self.kind == 'forest':
+            self.children_left = arrays['children_left']
+            self.children_right = arrays['children_right']
+            self.feature = arrays['feature']
+            self.threshold = arrays['threshold']
+            self.value = arrays['value']
+            self.tree_roots = arrays['tree_roots']
+        else:
+            raise ValueError('unknown model kind ' + self.kind)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path, allow_pickle=False) as arrays:
+            return cls(dict((name, arrays[name]) for name in arrays.files))
+
+    def scale(self, X):
+        return (np.atleast_2d(np.asarray(X, dtype=np.float64)) - self._data_min) * self._scale
+
+    def decision_function(self, X):
+        if self.kind != 'linear':
+            raise ValueError('decision_function needs a linear model')
+        return self.scale(X).dot(self.coef.T) + self.intercept
+
+    # All trees walked at once, one step per tree level
+    def _leaves(self, X):
+        # sklearn compares float32 features against the thresholds
+        X = self.scale(X).astype(np.float32)
+        rows = np.arange(len(X))[:, None]
+        nodes = np.broadcast_to(self.tree_roots, (len(X), len(self.tree_roots))).copy()
+        while True:
+            left = self.children_left[nodes]
+            inner = left >= 0
+            if not inner.any():
+                return nodes
+            go_left = X[rows, self.feature[nodes]] <= self.threshold[nodes]
+            nodes = np.where(inner, np.where(go_left, left, self.children_right[nodes]), nodes)
+
+    def predict_proba(self, X):
+        if self.kind == 'forest':
+            return self.value[self._leaves(X)].mean(axis=1)
+        scores = self.decision_function(X)
+        if self.link != 'logistic':
+            raise ValueError('predict_proba needs a logistic model')
+        if scores.shape[1] > 1 and not self.multilabel and self.multi_class == 'multinomial':
+            probabilities = np.exp(scores - scores.max(axis=1, keepdims=True))
+            return probabilities / probabilities.sum(axis=1, keepdims=True)
+        probabilities = 1.0 / (1.0 + np.exp(-scores))
+        if scores.shape[1] == 1:
+            return np.hstack([1 - probabilities, probabilities])
+        if self.multilabel:
+            return probabilities
+        return probabilities / probabilities.sum(axis=1, keepdims=True)
+
+    def predict(self, X):
+        if self.kind == 'forest':
+            return self.classes[self.predict_proba(X).argmax(axis=1)]
+        scores = self.decision_function(X)
+        if self.multilabel:
+            return (scores > 0).astype(int)
+        if scores.shape[1] == 1:
+            return self.classes[(scores[:, 0] > 0).astype(int)]
+        return self.classes[scores.argmax(axis=1)]
+
+    # One window of features as produced by streaming_features, by name
+    def predict_window(self, window):
+        x = [window[name] for name in self.feature_names]
+        return self.predict([x])[0]
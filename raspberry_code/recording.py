@@ -0,0 +1,232 @@
+# -*- coding: utf-8 -*-
+# Append-only columnar recording format for Measurements.py.
+#
+# File layout:
+#   header  HEADER_BYTES   magic, version, chunk_rows, n_rows, JSON column list
+#   chunk 0, chunk 1, ...  CHUNK_DTYPE each: every column stored contiguously
+#                          for chunk_rows rows (int64 t_ns, float32 sensors)
+# The file grows by whole preallocated chunks, only n_rows in the header says
+# how many rows are valid. Rows are in time order, so the first t_ns of every
+# chunk is the index used to slice by time without touching other chunks.
+# Reading is numpy.memmap over the chunks, no parsing:
+#
+#   recording = Recording('2018-10-19/recording.screc')
+#   recording.slice_time(start, stop)['accel_z']
+#
+# An existing file is never overwritten: RecordingWriter raises
+# FileExistsError unless append=True, which reuses its header and continues
+# after its last row. Times are stored as epoch ns (UTC) and come back from
+# to_dataframe as naive local times, like the datetime.now() they were taken from.
+#
+# Old joblib batch folders convert with
+#   python recording.py --convert 12:30:00 --output 12:30:00.screc [--append 1]
+import argparse
+import json
+import os
+import struct
+import sys
+from datetime import datetime
+
+import numpy as np
+
+MAGIC = b'SCREC\x00\x00\x01'
+VERSION = 1
+HEADER_BYTES = 4096
+_HEADER = struct.Struct('<8sIIq')
+
+SENSOR_COLUMNS = (
+    'accel_x', 'accel_y', 'accel_z',
+    'gyro_x', 'gyro_y', 'gyro_z',
+    'mag_x', 'mag_y', 'mag_z',
+)
+COLUMNS = ('t_ns',) + SENSOR_COLUMNS
+
+
+def chunk_dtype(chunk_rows):
+    return np.dtype([('t_ns', '<i8', (chunk_rows,))] +
+                    [(name, '<f4', (chunk_rows,)) for name in SENSOR_COLUMNS])
+
+
+def _to_ns(value):
+    if isinstance(value, datetime):
+        # Whole seconds and microseconds separately, a float would round the ns
+        return int(value.replace(microsecond=0).timestamp()) * 10 ** 9 + value.microsecond * 1000
+    return int(value)
+
+
+def _read_header(path, header):
+    magic, version, chunk_rows, n_rows = _HEADER.unpack_from(header, 0)
+    if magic != MAGIC:
+        raise ValueError(path + ' is not a smart chair recording')
+    if version != VERSION:
+        raise ValueError('unsupported recording version: ' + str(version))
+    columns = tuple(json.loads(header[_HEADER.size:].rstrip(b'\x00').decode('utf-8'))['columns'])
+    return chunk_rows, n_rows, columns
+
+
+class RecordingWriter(object):
+
+    # append: continue an existing recording at path (its chunk_rows wins),
+    # otherwise an existing file raises FileExistsError
+    def __init__(self, path, chunk_rows=4096, append=False):
+        self.path = path
+        self.n_rows = 0
+        if append and os.path.exists(path):
+            self._file = open(path, 'r+b')
+            chunk_rows, self.n_rows, columns = _read_header(path, self._file.read(HEADER_BYTES))
+            if columns != COLUMNS:
+                self._file.close()
+                raise ValueError(path + ' has other columns: ' + ', '.join(columns))
+        else:
+            self._file = open(path, 'x+b')
+        self.chunk_rows = chunk_rows
+        self.dtype = chunk_dtype(chunk_rows)
+        self._columns = dict((name, []) for name in COLUMNS)
+        self._flushed_rows = self.n_rows
+        self._write_header()
+
+    def _write_header(self):
+        header = _HEADER.pack(MAGIC, VERSION, self.chunk_rows, self.n_rows)
+        header += json.dumps({'columns': COLUMNS}).encode('utf-8')
+        self._file.seek(0)
+        self._file.write(header.ljust(HEADER_BYTES, b'\x00'))
+
+    # t_ns: time.time_ns() or a datetime, then the nine sensor values
+    def append(self, t_ns, *values):
+        columns = self._columns
+        columns['t_ns'].append(_to_ns(t_ns))
+        for name, value in zip(SENSOR_COLUMNS, values):
+            columns[name].append(value)
+        self.n_rows += 1
+        if self.n_rows % self.chunk_rows == 0:
+            self.flush()
+
+    # Same keys as the dicts Measurements.py used to collect
+    def append_result(self, result):
+        self.append(result['datetime_now'], *[result[name] for name in SENSOR_COLUMNS])
+
+    def flush(self):
+        if self.n_rows == self._flushed_rows:
+            return
+        start_row = self._flushed_rows
+        while start_row < self.n_rows:
+            chunk_index = start_row // self.chunk_rows
+            offset_in_chunk = start_row % self.chunk_rows
+            count = min(self.n_rows - start_row, self.chunk_rows - offset_in_chunk)
+            chunk_offset = HEADER_BYTES + chunk_index * self.dtype.itemsize
+            # Preallocate the whole chunk the first time it is touched
+            if offset_in_chunk == 0:
+                self._file.truncate(chunk_offset + self.dtype.itemsize)
+            buffered = start_row - self._flushed_rows
+            column_offset = 0
+            for name in COLUMNS:
+                field_dtype = self.dtype.fields[name][0]
+                item_size = field_dtype.base.itemsize
+                values = np.asarray(self._columns[name][buffered:buffered + count], dtype=field_dtype.base)
+                self._file.seek(chunk_offset + column_offset + offset_in_chunk * item_size)
+                self._file.write(values.tobytes())
+                column_offset += item_size * self.chunk_rows
+            start_row += count
+        self._columns = dict((name, []) for name in COLUMNS)
+        self._flushed_rows = self.n_rows
+        self._write_header()
+        self._file.flush()
+
+    def close(self):
+        self.flush()
+        self._file.close()
+
+
+class Recording(object):
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            header = f.read(HEADER_BYTES)
+        self.chunk_rows, self.n_rows, self.columns = _read_header(path, header)
+        self.dtype = chunk_dtype(self.chunk_rows)
+        n_chunks = (self.n_rows + self.chunk_rows - 1) // self.chunk_rows
+        if n_chunks:
+            self.chunks = np.memmap(path, dtype=self.dtype, mode='r', offset=HEADER_BYTES, shape=(n_chunks,))
+        else:
+            self.chunks = np.empty(0, dtype=self.dtype)
+
+    def __len__(self):
+        return self.n_rows
+
+    # First timestamp of every chunk
+    def index(self):
+        return np.asarray(self.chunks['t_ns'][:, 0])
+
+    # Rows [start, stop) of one column; a view if they fall into one chunk
+    def column(self, name, start=0, stop=None):
+        stop = self.n_rows if stop is None else min(stop, self.n_rows)
+        if start >= stop:
+            return np.empty(0, dtype=self.dtype.fields[name][0].base)
+        first_chunk, last_chunk = start // self.chunk_rows, (stop - 1) // self.chunk_rows
+        parts = []
+        for chunk in range(first_chunk, last_chunk + 1):
+            lo = start - chunk * self.chunk_rows if chunk == first_chunk else 0
+            hi = stop - chunk * self.chunk_rows if chunk == last_chunk else self.chunk_rows
+            parts.append(self.chunks[name][chunk, lo:hi])
+        return parts[0] if len(parts) == 1 else np.concatenate(parts)
+
+    # Row range [start, stop) covering t_start <= t_ns < t_stop (ns or datetime)
+    def time_rows(self, t_start=None, t_stop=None):
+        index = self.index()
+        start, stop = 0, self.n_rows
+        if t_start is not None:
+            t_start = _to_ns(t_start)
+            chunk = max(int(np.searchsorted(index, t_start, side='right')) - 1, 0)
+            rows = self.column('t_ns', chunk * self.chunk_rows, (chunk + 1) * self.chunk_rows)
+            start = chunk * self.chunk_rows + int(np.searchsorted(rows, t_start, side='left'))
+        if t_stop is not None:
+            t_stop = _to_ns(t_stop)
+            chunk = max(int(np.searchsorted(index, t_stop, side='right')) - 1, 0)
+            rows = self.column('t_ns', chunk * self.chunk_rows, (chunk + 1) * self.chunk_rows)
+            stop = chunk * self.chunk_rows + int(np.searchsorted(rows, t_stop, side='left'))
+        return start, max(start, stop)
+
+    def slice_time(self, t_start=None, t_stop=None, columns=None):
+        start, stop = self.time_rows(t_start, t_stop)
+        return dict((name, self.column(name, start, stop)) for name in (columns or self.columns))
+
+    # datetime_now as naive local time, the way Measurements.py took it
+    def to_dataframe(self, t_start=None, t_stop=None):
+        import pandas as pd
+        from dateutil.tz import tzlocal
+        data = self.slice_time(t_start, t_stop)
+        frame = pd.DataFrame(dict((name, data[name]) for name in SENSOR_COLUMNS))
+        times = pd.to_datetime(data['t_ns'], unit='ns', utc=True).tz_convert(tzlocal()).tz_localize(None)
+        frame.insert(0, 'datetime_now', times)
+        return frame
+
+
+# Converts a folder of numbered joblib batches written by the old Measurements.py
+def convert_joblib_folder(folder, output, chunk_rows=4096, append=False):
+    import joblib
+    names = sorted((name for name in os.listdir(folder) if name.isdigit()), key=int)
+    writer = RecordingWriter(output, chunk_rows, append)
+    for name in names:
+        for result in joblib.load(os.path.join(folder, name)):
+            writer.append_result(result)
+    writer.close()
+    return writer.n_rows
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--convert', type=str, required=True)
+    parser.add_argument('--output', type=str, default=None)
+    parser.add_argument('--append', type=bool, default=False)
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    output = args.output or args.convert.rstrip('/') + '.screc'
+    try:
+        n_rows = convert_joblib_folder(args.convert, output, append=args.append)
+    except FileExistsError:
+        sys.exit('%s exists, pass --append 1 to add to it' % output)
+    print('%d rows in %s' % (n_rows, output))
@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+import math
+import time
+
+from metrics import Histogram
+
+
+class FixedRateScheduler(object):
+    # Keeps an absolute grid of ticks t0 + k * period instead of sleeping a fixed
+    # timestep after the work is done, so the time spent on I2C reads, prints and
+    # buffering does not add up into drift.
+    # If the work overruns a tick, the missed ticks are skipped (counted in
+    # skipped_ticks) and the loop resumes on the grid, never bursts to catch up.
+    # Wake-up jitter goes into a fixed-size metrics.Histogram, so an all-day
+    # run keeps constant memory.
+
+    def __init__(self, period, clock=time.monotonic, sleep=time.sleep):
+        self.period = float(period)
+        self._clock = clock
+        self._sleep = sleep
+        self._t0 = None
+        self._started = None
+        self._tick = 0
+
+        self.ticks = 0
+        self.overruns = 0
+        self.skipped_ticks = 0
+        self.jitter = Histogram()
+
+    def start(self):
+        self._t0 = self._started = self._clock()
+        self._tick = 0
+        return self._t0
+
+    # New period from now on (adaptive_rate.py), the grid restarts at the
+    # current time, counters and achieved rate carry on
+    def set_period(self, period):
+        self.period = float(period)
+        if self._t0 is not None:
+            self._t0 = self._clock()
+            self._tick = 0
+
+    # Blocks until the next tick of the grid. Returns the tick deadline.
+    def wait(self):
+        if self._t0 is None:
+            self.start()
+
+        self._tick += 1
+        deadline = self._t0 + self._tick * self.period
+        now = self._clock()
+        if now > deadline:
+            self.overruns += 1
+            next_tick = int(math.floor((now - self._t0) / self.period)) + 1
+            self.skipped_ticks += next_tick - self._tick
+            self._tick = next_tick
+            deadline = self._t0 + self._tick * self.period
+
+        delay = deadline - self._clock()
+        if delay > 0:
+            self._sleep(delay)
+        self.jitter.observe(self._clock() - deadline)
+        self.ticks += 1
+        return deadline
+
+    def elapsed(self):
+        if self._started is None:
+            return 0.0
+        return self._clock() - self._started
+
+    def achieved_rate(self):
+        elapsed = self.elapsed()
+        if elapsed <= 0:
+            return 0.0
+        return self.ticks / elapsed
+
+    def report(self):
+        return {
+            'nominal_rate': 1.0 / self.period,
+            'achieved_rate': self.achieved_rate(),
+            'ticks': self.ticks,
+            'overruns': self.overruns,
+            'skipped_ticks': self.skipped_ticks,
+            'jitter_p50_ms': self.jitter.percentile(50) * 1e3,
+            'jitter_p99_ms': self.jitter.percentile(99) * 1e3,
+        }
+
+    def print_report(self):
+        report = self.report()
+        print('Sampling rate: %.2f Hz achieved / %.2f Hz nominal' % (report['achieved_rate'], report['nominal_rate']))
+        print('Overruns: %d, skipped ticks: %d of %d' % (report['overruns'], report['skipped_ticks'],
+                                                        report['ticks'] + report['skipped_ticks']))
+        print('Jitter p50: %.3f ms, p99: %.3f ms' % (report['jitter_p50_ms'], report['jitter_p99_ms']))
+
+
+# Nearest-rank percentile, numpy is not available on every board
+def percentile(values, q):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = int(math.ceil(q / 100.0 * len(ordered))) - 1
+    return ordered[min(max(rank, 0), len(ordered) - 1)]
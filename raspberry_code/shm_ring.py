@@ -0,0 +1,209 @@
+# -*- coding: utf-8 -*-
+# Fixed-size ring buffers of raw sensor frames in shared memory, written by a
+# dedicated acquisition process and read by any number of consumers (uploader,
+# local recorder, on-device feature extraction) as NumPy views, without copies.
+#
+# Layout of one ring:
+#   header  int64[4]   write_seq (frames written so far), capacity, 0, 0
+#   frames  FRAME_DTYPE[capacity]
+# Frame number `seq` lives in slot seq % capacity and carries its own seq, so a
+# consumer that falls more than `capacity` frames behind sees the overwrite
+# and knows exactly how many frames it lost.
+#
+# Consumers may be unrelated processes attaching by name. Before Python 3.13
+# every process that attaches registers the segment with its own resource
+# tracker, which unlinks it when that process exits; attach() takes the
+# registration back (track=False from 3.13 on). The flip side is that only
+# the creator's tracker cleans up a segment left behind by a crash.
+import multiprocessing
+import sys
+import time
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+
+FRAME_DTYPE = np.dtype([
+    ('seq', '<i8'),
+    ('t_ns', '<i8'),    # time.monotonic_ns() of the reading
+    ('xyz', '<i2', 3),
+])
+_HEADER_ITEMS = 4
+_HEADER_BYTES = _HEADER_ITEMS * 8
+
+
+# Opens an existing segment without letting this process's exit unlink it
+def attach(name):
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(name=name, track=False)
+    shm = shared_memory.SharedMemory(name=name)
+    # Child processes of the creator share its resource tracker, where the
+    # segment is registered already and must stay until the creator unlinks it
+    if multiprocessing.parent_process() is None:
+        resource_tracker.unregister(shm._name, 'shared_memory')
+    return shm
+
+
+class SharedRing(object):
+
+    def __init__(self, name, capacity=None, create=False):
+        if create:
+            size = _HEADER_BYTES + capacity * FRAME_DTYPE.itemsize
+            self.shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        else:
+            self.shm = attach(name)
+        self.name = name
+        self.header = np.ndarray((_HEADER_ITEMS,), dtype='<i8', buffer=self.shm.buf)
+        if create:
+            self.header[:] = 0
+            self.header[1] = capacity
+        self.capacity = int(self.header[1])
+        self.frames = np.ndarray((self.capacity,), dtype=FRAME_DTYPE, buffer=self.shm.buf, offset=_HEADER_BYTES)
+        self._owner = create
+
+    def write_seq(self):
+        return int(self.header[0])
+
+    # Single writer only: the acquisition process
+    def append(self, x, y, z, t_ns=None):
+        seq = int(self.header[0])
+        frame = self.frames[seq % self.capacity]
+        frame['t_ns'] = time.monotonic_ns() if t_ns is None else t_ns
+        frame['xyz'] = (x, y, z)
+        frame['seq'] = seq
+        # Publish after the frame is complete
+        self.header[0] = seq + 1
+
+    def close(self):
+        # Views into the buffer must go before the mapping can be closed
+        self.header = None
+        self.frames = None
+        try:
+            self.shm.close()
+        except BufferError:
+            # A consumer still holds a view, the mapping goes away with the process
+            pass
+        if self._owner:
+            self.shm.unlink()
+
+
+class RingConsumer(object):
+    # Independent read cursor over a SharedRing. Every consumer keeps its own
+    # position, so a slow uploader never holds back a fast feature extractor.
+
+    def __init__(self, ring, from_start=False):
+        if not isinstance(ring, SharedRing):
+            ring = SharedRing(ring)
+        self.ring = ring
+        self.next_seq = 0 if from_start else ring.write_seq()
+        self.frames_read = 0
+        self.frames_lost = 0
+
+    def available(self):
+        return self.ring.write_seq() - self.next_seq
+
+    # Returns a view of up to max_frames new frames (contiguous in the ring, so
+    # it may stop at the ring end; call again for the rest). Frames the writer
+    # already overwrote are skipped and counted in frames_lost.
+    def read(self, max_frames=None):
+        write_seq = self.ring.write_seq()
+        capacity = self.ring.capacity
+        if write_seq - self.next_seq > capacity:
+            self.frames_lost += write_seq - self.next_seq - capacity
+            self.next_seq = write_seq - capacity
+        start = self.next_seq % capacity
+        count = min(write_seq - self.next_seq, capacity - start)
+        if max_frames is not None:
+            count = min(count, max_frames)
+        view = self.ring.frames[start:start + count]
+        self.next_seq += count
+        self.frames_read += count
+        return view
+
+    # After processing a view: True if the writer has not lapped it meanwhile.
+    # Frames of an invalid view may have been replaced by newer ones.
+    def still_valid(self, view):
+        if not len(view):
+            return True
+        return self.ring.write_seq() - int(view['seq'][0]) <= self.ring.capacity
+
+    # Copies of every frame available right now, in order
+    def read_all(self):
+        parts = []
+        while True:
+            view = self.read()
+            if not len(view):
+                break
+            parts.append(view.copy())
+        if not parts:
+            return np.empty(0, dtype=FRAME_DTYPE)
+        frames = np.concatenate(parts)
+        # Drop frames that were overwritten while copying
+        expected = np.arange(self.next_seq - len(frames), self.next_seq)
+        intact = frames['seq'] == expected
+        self.frames_lost += int((~intact).sum())
+        return frames[intact]
+
+
+def _sample(ring_names, timestep_detect, acquisition, simulate, stop_event):
+    bus = None
+    if simulate:
+        from sim_bus import SimulatedSMBus
+        bus = SimulatedSMBus()
+    from accel import LIS331DLH
+    from magnet import LIS3MDL
+    sensors = {
+        'accelerometer': LIS331DLH(bus=bus),
+        'magnetometer': LIS3MDL(bus=bus),
+    }
+    rings = dict((name, SharedRing(ring_name)) for name, ring_name in ring_names.items())
+    try:
+        if acquisition == 'data_ready':
+            from acquisition import DataReadyReader
+            reader = DataReadyReader(sensors)
+            while not stop_event.is_set():
+                reader.run(0.1, lambda name, xyz: rings[name].append(*xyz))
+        else:
+            from scheduler import FixedRateScheduler
+            scheduler = FixedRateScheduler(timestep_detect)
+            scheduler.start()
+            while not stop_event.is_set():
+                for name, sensor in sensors.items():
+                    rings[name].append(*sensor.read_xyz())
+                scheduler.wait()
+    finally:
+        for ring in rings.values():
+            ring.close()
+
+
+class SamplerProcess(object):
+    # Owns one SharedRing per sensor and a child process that does nothing but
+    # read the sensors into them, on its own core and its own timing loop.
+
+    def __init__(self, timestep_detect=0.1, capacity=1 << 14, acquisition='timer', simulate=False, prefix=None):
+        if prefix is None:
+            prefix = 'smart_chair_%d' % multiprocessing.current_process().pid
+        self.ring_names = {
+            'accelerometer': prefix + '_acc',
+            'magnetometer': prefix + '_mag',
+        }
+        self.rings = dict((name, SharedRing(ring_name, capacity, create=True))
+                          for name, ring_name in self.ring_names.items())
+        self._stop_event = multiprocessing.Event()
+        self.process = multiprocessing.Process(
+            target=_sample,
+            args=(self.ring_names, timestep_detect, acquisition, simulate, self._stop_event))
+        self.process.daemon = True
+
+    def start(self):
+        self.process.start()
+
+    def consumer(self, typeSensor, from_start=False):
+        return RingConsumer(self.rings[typeSensor], from_start)
+
+    def stop(self, timeout=5.0):
+        self._stop_event.set()
+        self.process.join(timeout)
+        if self.process.is_alive():
+            self.process.terminate()
+        for ring in self.rings.values():
+            ring.close()
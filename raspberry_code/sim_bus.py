@@ -0,0 +1,232 @@
+# -*- coding: utf-8 -*-
+# In-process stand-in for smbus.SMBus with the Troyka IMU register maps, so
+# the acquisition stack runs and can be benchmarked on any Linux box:
+#
+#   bus = SimulatedSMBus()
+#   imu = TroykaIMU(bus=bus)
+#
+# Each device keeps its registers in a bytearray. CTRL_REGx writes are stored
+# and decide the output data rate, STATUS_REG reports ZYXDA/ZYXOR from the
+# time elapsed since the last read of the output registers, and OUT_* hold a
+# deterministic synthetic signal (gravity or the earth field plus sway and noise).
+import errno
+import math
+import random
+import time
+
+from accel import LIS331DLH
+from magnet import LIS3MDL
+
+AUTO_INCREMENT = 1 << 7
+STATUS_ZYXDA = 1 << 3
+STATUS_ZYXOR = 1 << 7
+
+
+class SimulatedDevice(object):
+    who_am_i = 0x00
+    status_reg = 0x27
+    out_x_l = 0x28
+    out_z_h = 0x2D
+    # Value of the raw axes at rest and noise amplitude, in LSB
+    rest = (0, 0, 0)
+    noise = 0
+    sway = (0, 0, 0)
+
+    def __init__(self, clock=time.monotonic, seed=0):
+        self.clock = clock
+        self.seed = seed
+        self.regs = bytearray(256)
+        self.reset()
+
+    def reset(self):
+        self.regs[:] = bytearray(256)
+        self.regs[0x0F] = self.who_am_i
+        self._t0 = self.clock()
+        self._last_index = -1
+        self._latched = -1
+
+    # Output data rate in Hz from the control registers, 0 when powered down
+    def odr_hz(self):
+        return 0
+
+    def sample_index(self):
+        odr = self.odr_hz()
+        if not odr:
+            return self._last_index
+        return int((self.clock() - self._t0) * odr)
+
+    # Synthetic raw reading number `index`, same index always gives the same values
+    def sample(self, index):
+        rng = random.Random(self.seed * 1000003 + index)
+        t = index / float(self.odr_hz() or 1)
+        values = []
+        for axis in range(3):
+            value = self.rest[axis] + self.sway[axis] * math.sin(0.5 * t + axis) + rng.gauss(0, self.noise)
+            values.append(max(-32768, min(32767, int(value))))
+        return values
+
+    def write(self, reg, value):
+        odr = self.odr_hz()
+        self.regs[reg] = value & 0xFF
+        # A new data rate starts a new sample grid
+        if self.odr_hz() != odr:
+            self._t0 = self.clock()
+            self._last_index = -1
+            self._latched = -1
+
+    def read(self, reg):
+        if reg == self.status_reg:
+            index = self.sample_index()
+            status = 0
+            if index > self._last_index:
+                status |= STATUS_ZYXDA | 0x07
+            if index > self._last_index + 1:
+                status |= STATUS_ZYXOR | 0x70
+            return status
+        if self.out_x_l <= reg <= self.out_z_h:
+            self._latch()
+        return self.regs[reg]
+
+    # Output registers hold the newest sample, reading them clears data ready
+    def _latch(self):
+        index = self.sample_index()
+        if index != self._latched:
+            x, y, z = self.sample(max(index, 0))
+            for offset, value in enumerate((x, y, z)):
+                value &= 0xFFFF
+                self.regs[self.out_x_l + 2 * offset] = value & 0xFF
+                self.regs[self.out_x_l + 2 * offset + 1] = value >> 8
+            self._latched = index
+        self._last_index = index
+
+    def read_block(self, reg, length):
+        # One transaction latches the sample once, so the axes come from the same reading
+        if reg <= self.out_z_h and reg + length > self.out_x_l:
+            status = self.read(self.status_reg) if reg <= self.status_reg else None
+            self._latch()
+            values = [self.regs[r] for r in range(reg, reg + length)]
+            if status is not None:
+                values[self.status_reg - reg] = status
+            return values
+        return [self.read(r) for r in range(reg, reg + length)]
+
+
+class SimulatedLIS331DLH(SimulatedDevice):
+    who_am_i = LIS331DLH.I2C_IDENTITY
+    # 2G range: 16384 LSB per g, chair seat tilted a little
+    rest = (3472, 976, 16512)
+    noise = 30
+    sway = (200, 120, 60)
+
+    def odr_hz(self):
+        return LIS331DLH.data_rate_hz.get((self.regs[0x20] >> 3) & 0b11111, 0)
+
+    def write(self, reg, value):
+        # CTRL_REG2 BOOT
+        if reg == 0x21 and value & (1 << 7):
+            self.reset()
+            value &= ~(1 << 7)
+        SimulatedDevice.write(self, reg, value)
+
+
+class SimulatedLIS3MDL(SimulatedDevice):
+    who_am_i = LIS3MDL.I2C_IDENTITY
+    rest = (1288, -4376, 5602)
+    noise = 15
+    sway = (300, 300, 80)
+    temperature_c = 22.0
+
+    def reset(self):
+        SimulatedDevice.reset(self)
+        # CTRL_REG3 default: power-down
+        self.regs[0x22] = 0x03
+
+    def odr_hz(self):
+        # MD1 MD0 = 1x: power-down
+        if self.regs[0x22] & 0b10:
+            return 0
+        # LP: 0.625 Hz
+        if self.regs[0x22] & (1 << 5):
+            return LIS3MDL.data_rate_hz[0]
+        ctrl1 = self.regs[0x20]
+        if ctrl1 & (1 << 1):
+            return LIS3MDL.fast_data_rate_hz[ctrl1 & 0b01100000]
+        return LIS3MDL.data_rate_hz[ctrl1 & 0b0011100]
+
+    def write(self, reg, value):
+        # CTRL_REG2 SOFT_RST / REBOOT
+        if reg == 0x21 and value & 0b1100:
+            self.reset()
+            value &= ~0b1100
+        SimulatedDevice.write(self, reg, value)
+
+    def read(self, reg):
+        if reg in (0x2E, 0x2F):
+            raw = int((self.temperature_c - 25.0) * 8) & 0xFFFF
+            return raw & 0xFF if reg == 0x2E else raw >> 8
+        return SimulatedDevice.read(self, reg)
+
+    def read_block(self, reg, length):
+        values = SimulatedDevice.read_block(self, reg, length)
+        for n in range(length):
+            if reg + n in (0x2E, 0x2F):
+                values[n] = self.read(reg + n)
+        return values
+
+
+class SimulatedSMBus(object):
+    # Same methods as smbus.SMBus that the drivers use. bus_hz > 0 makes every
+    # transaction take as long as it would on a real I2C bus of that clock
+    # (9 bits per byte plus address and register bytes).
+
+    def __init__(self, devices=None, bus_hz=0, clock=time.monotonic, seed=0):
+        if devices is None:
+            devices = {
+                LIS331DLH.I2C_DEFAULT_ADDRESS: SimulatedLIS331DLH(clock, seed),
+                LIS3MDL.I2C_DEFAULT_ADDRESS: SimulatedLIS3MDL(clock, seed + 1),
+            }
+        self.devices = devices
+        self.bus_hz = bus_hz
+        self.transactions = 0
+        self.bytes_transferred = 0
+
+    def _device(self, address):
+        device = self.devices.get(address)
+        if device is None:
+            # What the kernel reports for a missing device
+            raise IOError(errno.EREMOTEIO, 'Remote I/O error')
+        return device
+
+    def _transfer(self, n_bytes):
+        self.transactions += 1
+        self.bytes_transferred += n_bytes
+        if self.bus_hz:
+            time.sleep((n_bytes + 2) * 9.0 / self.bus_hz)
+
+    def write_byte_data(self, address, register, value):
+        self._device(address).write(register & ~AUTO_INCREMENT, value)
+        self._transfer(1)
+
+    def read_byte_data(self, address, register):
+        value = self._device(address).read(register & ~AUTO_INCREMENT)
+        self._transfer(1)
+        return value
+
+    def read_word_data(self, address, register):
+        low, high = self._device(address).read_block(register & ~AUTO_INCREMENT, 2)
+        self._transfer(2)
+        return low | high << 8
+
+    def read_i2c_block_data(self, address, register, length=32):
+        values = self._device(address).read_block(register & ~AUTO_INCREMENT, length)
+        self._transfer(length)
+        return values
+
+    def write_i2c_block_data(self, address, register, values):
+        device = self._device(address)
+        for offset, value in enumerate(values):
+            device.write((register & ~AUTO_INCREMENT) + offset, value)
+        self._transfer(len(values))
+
+    def close(self):
+        pass
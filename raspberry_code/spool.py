@@ -0,0 +1,325 @@
+# -*- coding: utf-8 -*-
+# Durable on-disk spool for batches that are not acknowledged by the server yet.
+#
+# Records are appended to segment files (<first record id>.seg), a new segment
+# is started on every open and whenever the active one grows over
+# segment_bytes. Each record is
+#   length I, record id Q, crc32 I, payload
+# and acknowledgements are appended as record ids to acked.log. A segment is
+# deleted once every record in it is acknowledged. A record torn by a power cut
+# fails its length or crc check and ends the scan of that segment; a torn
+# acknowledgement is cut off acked.log before new ones are appended.
+#
+# fsync is batched and runs on the spool's own thread: it syncs after
+# fsync_every records or fsync_interval seconds, whichever comes first, so a
+# crash loses at most that window while the sampler only ever pays for
+# sequential buffered writes. Record ids keep growing across restarts, also
+# past segments that were acknowledged and deleted, as acked.log remembers them.
+import collections
+import itertools
+import os
+import struct
+import threading
+import time
+import zlib
+
+_RECORD = struct.Struct('<IQI')
+_ACK = struct.Struct('<Q')
+SEGMENT_SUFFIX = '.seg'
+ACK_LOG = 'acked.log'
+
+
+class Spool(object):
+
+    def __init__(self, directory, segment_bytes=1 << 20, max_bytes=64 << 20,
+                 fsync_every=16, fsync_interval=5.0):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.max_bytes = max_bytes
+        self.fsync_every = fsync_every
+        self.fsync_interval = fsync_interval
+
+        self._lock = threading.Lock()
+        # first id -> {'path', 'size', 'ids', 'pending'}, oldest first;
+        # 'pending' counts the records of the segment not acknowledged yet
+        self._segments = collections.OrderedDict()
+        # record id -> (segment first id, payload offset, payload length), oldest first
+        self._pending = collections.OrderedDict()
+        self._acked = set()
+        self._live_records = 0
+        self._next_id = 1
+        self._active = None
+        self._active_file = None
+        self._ack_file = None
+        self._unsynced = 0
+        # Descriptors of rolled segments still to be synced
+        self._rolled_fds = []
+        self._sync_wanted = threading.Event()
+        self._closing = threading.Event()
+
+        self.appended_records = 0
+        self.acked_records = 0
+        self.evicted_records = 0
+        self.recovered_records = 0
+
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self._recover()
+        self._ack_file = open(os.path.join(directory, ACK_LOG), 'ab')
+        self._sync_thread = threading.Thread(target=self._sync_loop)
+        self._sync_thread.daemon = True
+        self._sync_thread.start()
+
+    def _recover(self):
+        ack_path = os.path.join(self.directory, ACK_LOG)
+        if os.path.exists(ack_path):
+            with open(ack_path, 'rb') as f:
+                data = f.read()
+            complete = len(data) - len(data) % _ACK.size
+            for offset in range(0, complete, _ACK.size):
+                self._acked.add(_ACK.unpack_from(data, offset)[0])
+            if complete < len(data):
+                with open(ack_path, 'r+b') as f:
+                    f.truncate(complete)
+            # Acknowledged ids of deleted segments are never handed out again
+            if self._acked:
+                self._next_id = max(self._acked) + 1
+
+        names = sorted(name for name in os.listdir(self.directory) if name.endswith(SEGMENT_SUFFIX))
+        for name in names:
+            first_id = int(name[:-len(SEGMENT_SUFFIX)])
+            path = os.path.join(self.directory, name)
+            segment = {'path': path, 'size': os.path.getsize(path), 'ids': [], 'pending': 0}
+            with open(path, 'rb') as f:
+                data = f.read()
+            offset = 0
+            while offset + _RECORD.size <= len(data):
+                length, record_id, crc = _RECORD.unpack_from(data, offset)
+                start = offset + _RECORD.size
+                payload = data[start:start + length]
+                if len(payload) < length or zlib.crc32(payload) & 0xffffffff != crc:
+                    break
+                segment['ids'].append(record_id)
+                if record_id not in self._acked:
+                    self._pending[record_id] = (first_id, start, length)
+                    segment['pending'] += 1
+                    self.recovered_records += 1
+                self._next_id = max(self._next_id, record_id + 1)
+                offset = start + length
+            self._segments[first_id] = segment
+            self._live_records += len(segment['ids'])
+        self._collect()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._pending)
+
+    def size_bytes(self):
+        with self._lock:
+            return sum(segment['size'] for segment in self._segments.values())
+
+    def append(self, payload):
+        with self._lock:
+            if self._active is None or self._segments[self._active]['size'] >= self.segment_bytes:
+                self._roll()
+            record_id = self._next_id
+            self._next_id += 1
+            segment = self._segments[self._active]
+            self._active_file.write(_RECORD.pack(len(payload), record_id, zlib.crc32(payload) & 0xffffffff))
+            self._active_file.write(payload)
+            self._pending[record_id] = (self._active, segment['size'] + _RECORD.size, len(payload))
+            segment['ids'].append(record_id)
+            segment['pending'] += 1
+            segment['size'] += _RECORD.size + len(payload)
+            self._live_records += 1
+            self.appended_records += 1
+            self._unsynced += 1
+            self._maybe_sync()
+            return record_id
+
+    # Oldest unacknowledged records as (record id, payload). Only the index is
+    # read under the lock, the payloads are read after it with one handle per
+    # segment so appends and acks do not wait on the disk.
+    def pending(self, limit=None):
+        with self._lock:
+            if self._active_file is not None:
+                self._active_file.flush()
+            index = list(itertools.islice(self._pending.items(), limit))
+            paths = dict((first_id, self._segments[first_id]['path']) for _, (first_id, _, _) in index)
+        items = []
+        files = {}
+        try:
+            for record_id, (first_id, offset, length) in index:
+                if first_id not in files:
+                    try:
+                        files[first_id] = open(paths[first_id], 'rb')
+                    except FileNotFoundError:
+                        # Evicted since, its records are not pending anymore
+                        files[first_id] = None
+                f = files[first_id]
+                if f is None:
+                    continue
+                f.seek(offset)
+                items.append((record_id, f.read(length)))
+        finally:
+            for f in files.values():
+                if f is not None:
+                    f.close()
+        return items
+
+    def ack(self, record_id):
+        with self._lock:
+            entry = self._pending.pop(record_id, None)
+            if entry is None:
+                return
+            self._acked.add(record_id)
+            self._ack_file.write(_ACK.pack(record_id))
+            self.acked_records += 1
+            self._unsynced += 1
+            self._maybe_sync()
+            segment = self._segments[entry[0]]
+            segment['pending'] -= 1
+            if not segment['pending'] and entry[0] != self._active:
+                self._delete(entry[0])
+            self._trim_acked()
+
+    # Syncs everything written so far, in the calling thread
+    def sync(self):
+        with self._lock:
+            fds = self._flush()
+        self._fsync(fds)
+
+    def close(self):
+        self._closing.set()
+        self._sync_wanted.set()
+        self._sync_thread.join()
+        with self._lock:
+            fds = self._flush()
+            if self._active_file is not None:
+                self._active_file.close()
+                self._active_file = None
+            self._ack_file.close()
+        self._fsync(fds)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'pending_records': len(self._pending),
+                'segments': len(self._segments),
+                'bytes': sum(segment['size'] for segment in self._segments.values()),
+                'appended_records': self.appended_records,
+                'acked_records': self.acked_records,
+                'evicted_records': self.evicted_records,
+                'recovered_records': self.recovered_records,
+            }
+
+    def _roll(self):
+        if self._active_file is not None:
+            # Synced later by the sync thread
+            self._active_file.flush()
+            self._rolled_fds.append(os.dup(self._active_file.fileno()))
+            self._active_file.close()
+            self._sync_wanted.set()
+        self._active = self._next_id
+        path = os.path.join(self.directory, '%012d%s' % (self._active, SEGMENT_SUFFIX))
+        self._active_file = open(path, 'ab')
+        self._segments[self._active] = {'path': path, 'size': 0, 'ids': [], 'pending': 0}
+        self._evict()
+        self._collect()
+
+    def _maybe_sync(self):
+        if self._unsynced >= self.fsync_every:
+            self._sync_wanted.set()
+
+    def _sync_loop(self):
+        while not self._closing.is_set():
+            self._sync_wanted.wait(self.fsync_interval)
+            self._sync_wanted.clear()
+            self.sync()
+
+    # Flushes the open files into the kernel under the lock and returns
+    # duplicated descriptors for _fsync, which runs without it
+    def _flush(self):
+        fds, self._rolled_fds = self._rolled_fds, []
+        if not self._unsynced:
+            return fds
+        for f in (self._active_file, self._ack_file):
+            if f is not None:
+                f.flush()
+                fds.append(os.dup(f.fileno()))
+        self._unsynced = 0
+        return fds
+
+    @staticmethod
+    def _fsync(fds):
+        for fd in fds:
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+
+    # Drops the oldest closed segments while the spool is over max_bytes
+    def _evict(self):
+        total = sum(segment['size'] for segment in self._segments.values())
+        for first_id in list(self._segments):
+            if total <= self.max_bytes or first_id == self._active:
+                break
+            segment = self._segments[first_id]
+            for record_id in segment['ids']:
+                if self._pending.pop(record_id, None) is not None:
+                    self.evicted_records += 1
+            total -= segment['size']
+            self._delete(first_id)
+
+    def _delete(self, first_id):
+        segment = self._segments.pop(first_id)
+        self._live_records -= len(segment['ids'])
+        os.remove(segment['path'])
+
+    # Deletes fully acknowledged segments
+    def _collect(self):
+        for first_id in list(self._segments):
+            if first_id != self._active and not self._segments[first_id]['pending']:
+                self._delete(first_id)
+        self._trim_acked()
+
+    # Keeps acked.log from growing forever: only the ids of live segments and
+    # the highest one (which seeds the next id after a restart) are kept
+    def _trim_acked(self):
+        if len(self._acked) > 2 * self._live_records + 1024:
+            live = set()
+            for segment in self._segments.values():
+                live.update(segment['ids'])
+            highest = max(self._acked)
+            self._acked &= live
+            self._acked.add(highest)
+            self._rewrite_ack_log()
+
+    def _rewrite_ack_log(self):
+        path = os.path.join(self.directory, ACK_LOG)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            for record_id in sorted(self._acked):
+                f.write(_ACK.pack(record_id))
+            f.flush()
+            os.fsync(f.fileno())
+        if self._ack_file is not None:
+            self._ack_file.close()
+        os.rename(tmp_path, path)
+        if self._ack_file is not None:
+            self._ack_file = open(path, 'ab')
+
+
+class RateLimiter(object):
+    # Lets at most `rate` events per second through, sleeping when ahead
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self._next = time.monotonic()
+
+    def wait(self):
+        now = time.monotonic()
+        if now < self._next:
+            time.sleep(self._next - now)
+            now = self._next
+        self._next = now + self.interval
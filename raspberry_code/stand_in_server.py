@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+# Local stand-in for the smart chair backend. Accepts the same POSTs as
+# /api/accelerometer and /api/magnetometer in every payload format the client
+# can send, and the window summaries of /api/summary, and keeps per-sensor counters, so uploads can be tried without AWS.
+#
+#   python stand_in_server.py --port 8080
+#   python SimpleRequest.py --payload binary  (with url pointed at localhost)
+import argparse
+from datetime import datetime
+import gzip
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+from buffers import SampleBatch, SummaryBatch
+from wire_format import decode_record, CONTENT_TYPE
+
+ENDPOINTS = {
+    '/api/accelerometer': 'accelerometer',
+    '/api/magnetometer': 'magnetometer',
+    '/api/summary': 'summary',
+}
+
+
+# Turns a request body in any supported payload format into a SampleBatch
+def decode_payload(body, content_type, typeSensor):
+    if content_type.startswith(CONTENT_TYPE):
+        return decode_record(body)
+    data = json.loads(body.decode('utf-8'))
+    if typeSensor == SummaryBatch.typeSensor:
+        return SummaryBatch.from_dict(data)
+    if isinstance(data, dict):
+        return SampleBatch.from_dict(data)
+    batch = SampleBatch(typeSensor)
+    if data:
+        first = data[0]
+        batch.set_meta(first.get('label', ''), first.get('metaInfo', ''), first.get('peopleId', ''))
+        batch.rate_hz = first.get('rateHz')
+    ax, ay, az = batch.axes
+    for record in data:
+        timestamp = int(datetime.fromisoformat(record['dateCreated']).timestamp() * 1e9)
+        batch.append(record[ax], record[ay], record[az], timestamp=timestamp)
+    # Record timestamps are wall-clock already
+    batch.anchor_wall_ns = batch.anchor_monotonic_ns
+    return batch
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+
+    def do_POST(self):
+        typeSensor = ENDPOINTS.get(self.path)
+        if typeSensor is None:
+            self.send_error(404)
+            return
+        length = int(self.headers.get('content-length', 0))
+        body = self.rfile.read(length)
+        n_bytes = len(body)
+        if self.headers.get('content-encoding', '') == 'gzip':
+            body = gzip.decompress(body)
+        try:
+            batch = decode_payload(body, self.headers.get('content-type', ''), typeSensor)
+        except Exception as e:
+            self.send_error(400, str(e))
+            return
+
+        self.server.record(typeSensor, batch, n_bytes)
+        response = json.dumps({'received': len(batch)}).encode('utf-8')
+        self.send_response(200)
+        self.send_header('content-type', 'application/json')
+        self.send_header('content-length', str(len(response)))
+        self.end_headers()
+        self.wfile.write(response)
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            BaseHTTPRequestHandler.log_message(self, format, *args)
+
+
+class StandInServer(HTTPServer):
+
+    def __init__(self, address=('127.0.0.1', 8080), verbose=False):
+        HTTPServer.__init__(self, address, StandInHandler)
+        self.verbose = verbose
+        self.lock = threading.Lock()
+        self.counters = dict((name, {'requests': 0, 'samples': 0, 'bytes': 0}) for name in ENDPOINTS.values())
+        self.batches = []
+        self.keep_batches = False
+
+    def record(self, typeSensor, batch, n_bytes):
+        with self.lock:
+            counters = self.counters[typeSensor]
+            counters['requests'] += 1
+            counters['samples'] += len(batch)
+            counters['bytes'] += n_bytes
+            if self.keep_batches:
+                self.batches.append(batch)
+
+    def url(self):
+        host, port = self.server_address[:2]
+        return 'http://%s:%d' % (host, port)
+
+    # Serves from a background thread, handy for benchmarks and notebooks
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return thread
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--host', type=str, default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--verbose', type=bool, default=True)
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    server = StandInServer((args.host, args.port), verbose=args.verbose)
+    print('Stand-in server on ' + server.url())
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    print(json.dumps(server.counters, indent=2))
@@ -0,0 +1,353 @@
+# -*- coding: utf-8 -*-
+# Lean back / Momentum / Oscillations / Rotational movement computed on the
+# device while sampling.
+#
+# The notebook functions need a whole window: the 10/50/90 percentiles and the
+# std of the samples between the 10th and 90th percentile. By default every
+# open window keeps its readings (window_len * 3 values) and computes Momentum
+# and Oscillations at its end exactly like features.acc_masks; one sort per
+# window costs less CPU than any per-reading estimate.
+#
+# exact=False (SimpleRequest.py --p2_features 1) keeps constant memory per
+# window instead: every axis keeps three P2 quantile estimators (Jain &
+# Chlamtac, 1985) and running moments of the samples inside the current
+# 10..90 estimate. A reading counts as calm if it lies within
+# median +- n_sigma * std of the estimates at the time it arrives; the first
+# `warmup` readings of a window wait in a small buffer until the estimates
+# have settled, and up to `max_flagged` readings judged messy are kept and
+# tested again with the final estimates at the end of the window.
+#
+# Lean back is exact in both: the threshold comes from the empty chair
+# statistics. Against Data_Analysis/features.py on accelerometer2/3.csv,
+# 150-reading windows (python Data_Analysis/compare_streaming_features.py):
+#                          batch values     |error| mean   95%     max
+#   Momentum (P2)          0 .. 0.107       0.0066         0.027   0.107
+#   Oscillations (P2)      0.030 .. 1.08    0.025          0.059   0.121
+#   Momentum, Oscillations (exact)          0              0       0
+#   Rotational movement    0 .. 0.907       0.0065         0.017   0.020
+# The P2 Momentum outliers are windows where the band of the final estimates
+# is narrower than the one a reading was tested against on arrival. A larger
+# max_flagged does not help, and even the final P2 band applied to every
+# reading is off by up to 0.073, as large as the feature itself.
+#
+# Rotational movement uses the Savitzky-Golay derivative of features.py
+# (polyorder 2, so the coefficients are k / sum(k^2)) on the continuous
+# magnetometer stream, delayed by savgol_window // 2 readings. Magnetometer
+# readings count towards the accelerometer windows open when they arrive,
+# which is where its error comes from: the batch version differentiates each
+# window on its own, with shifted filters at the edges.
+#
+#   features = StreamingFeatures(acc_z_mean=16790, acc_z_std=27.9, window_len=150)
+#   for window in features.update(ax, ay, az):
+#       print(window)
+#   features.update_magnetometer(x, y, z)
+import math
+from collections import deque
+
+
+class P2Quantile(object):
+    # Streaming estimate of the q-quantile from five markers
+
+    def __init__(self, q):
+        self.q = q
+        self.count = 0
+        self._initial = []
+        self._heights = None
+        self._positions = [0, 1, 2, 3, 4]
+        self._desired = [0, 2 * q, 4 * q, 2 + 2 * q, 4]
+        self._increments = [0, q / 2.0, q, (1 + q) / 2.0, 1]
+
+    def add(self, x):
+        self.count += 1
+        if self._heights is None:
+            self._initial.append(x)
+            if len(self._initial) == 5:
+                self._heights = sorted(self._initial)
+            return
+        heights, positions, desired = self._heights, self._positions, self._desired
+        if x < heights[0]:
+            heights[0] = x
+            k = 0
+        elif x >= heights[4]:
+            heights[4] = x
+            k = 3
+        else:
+            k = 0
+            while x >= heights[k + 1]:
+                k += 1
+        for i in range(k + 1, 5):
+            positions[i] += 1
+        for i in range(5):
+            desired[i] += self._increments[i]
+        for i in (1, 2, 3):
+            d = desired[i] - positions[i]
+            if (d >= 1 and positions[i + 1] - positions[i] > 1) or (d <= -1 and positions[i - 1] - positions[i] < -1):
+                d = 1 if d > 0 else -1
+                height = self._parabolic(i, d)
+                if not heights[i - 1] < height < heights[i + 1]:
+                    height = heights[i] + d * (heights[i + d] - heights[i]) / float(positions[i + d] - positions[i])
+                heights[i] = height
+                positions[i] += d
+
+    def _parabolic(self, i, d):
+        h, n = self._heights, self._positions
+        return h[i] + d / float(n[i + 1] - n[i - 1]) * (
+            (n[i] - n[i - 1] + d) * (h[i + 1] - h[i]) / float(n[i + 1] - n[i]) +
+            (n[i + 1] - n[i] - d) * (h[i] - h[i - 1]) / float(n[i] - n[i - 1]))
+
+    def value(self):
+        if self._heights is not None:
+            return self._heights[2]
+        if not self._initial:
+            return None
+        # Fewer than five readings: exact
+        return percentile(sorted(self._initial), self.q)
+
+
+# q-quantile of sorted values, interpolated like np.percentile
+def percentile(ordered, q):
+    rank = q * (len(ordered) - 1)
+    low = int(math.floor(rank))
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
+
+
+# features.acc_masks for one window of (x, y, z) readings: returns Momentum
+# and the Acc_z Oscillations
+def exact_acc_features(readings, percentile2crop=10, n_sigma=10):
+    bands = []
+    for axis in range(3):
+        values = [reading[axis] for reading in readings]
+        ordered = sorted(values)
+        lower = percentile(ordered, percentile2crop / 100.0)
+        upper = percentile(ordered, (100 - percentile2crop) / 100.0)
+        median = percentile(ordered, 0.5)
+        inner = [value for value in values if lower < value < upper]
+        if inner:
+            mean = sum(inner) / float(len(inner))
+            std = math.sqrt(sum((value - mean) ** 2 for value in inner) / len(inner))
+        else:
+            std = float('nan')
+        bands.append((median - n_sigma * std, median + n_sigma * std))
+    # NaN bounds compare False, every reading is messy as in the batch version
+    messy = sum(1 for reading in readings
+                if not all(lower < value < upper for (lower, upper), value in zip(bands, reading)))
+    return messy / float(len(readings)), std / (25 * n_sigma)
+
+
+class RunningMoments(object):
+    # Welford's mean and population variance
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self._m2 = 0.0
+
+    def add(self, x):
+        self.count += 1
+        delta = x - self.mean
+        self.mean += delta / self.count
+        self._m2 += delta * (x - self.mean)
+
+    def std(self):
+        if not self.count:
+            return float('nan')
+        return math.sqrt(self._m2 / self.count)
+
+
+class SavgolDerivative(object):
+    # First derivative by a centred Savitzky-Golay filter of polyorder 2: each
+    # update returns the derivative at the reading window // 2 updates back,
+    # None until the filter is full
+
+    def __init__(self, window=5):
+        if window < 3 or window % 2 == 0:
+            raise ValueError('window must be odd and at least 3')
+        half = window // 2
+        norm = float(sum(k * k for k in range(-half, half + 1)))
+        self.coefficients = [k / norm for k in range(-half, half + 1)]
+        self._readings = deque(maxlen=window)
+
+    def update(self, x):
+        self._readings.append(x)
+        if len(self._readings) < self._readings.maxlen:
+            return None
+        return sum(c * value for c, value in zip(self.coefficients, self._readings))
+
+
+class _AxisState(object):
+
+    def __init__(self, percentile2crop):
+        self.lower = P2Quantile(percentile2crop / 100.0)
+        self.median = P2Quantile(0.5)
+        self.upper = P2Quantile(1 - percentile2crop / 100.0)
+        self.inner = RunningMoments()
+
+    def add(self, x):
+        self.lower.add(x)
+        self.median.add(x)
+        self.upper.add(x)
+        if self.lower.value() < x < self.upper.value():
+            self.inner.add(x)
+
+    def band(self, n_sigma):
+        median, std = self.median.value(), self.inner.std()
+        return median - n_sigma * std, median + n_sigma * std
+
+
+class _Window(object):
+    # One tumbling window of accelerometer readings
+
+    def __init__(self, lean_back_threshold, percentile2crop, n_sigma, warmup, max_flagged, exact=True):
+        self.lean_back_threshold = lean_back_threshold
+        self.percentile2crop = percentile2crop
+        self.n_sigma = n_sigma
+        self.warmup = warmup
+        self.max_flagged = max_flagged
+        self.axes = [_AxisState(percentile2crop) for _ in range(3)]
+        self.count = 0
+        self.lean_back = 0
+        self.messy = 0
+        self.mag_count = 0
+        self.mag_messy = 0
+        self._pending = []
+        self._flagged = []
+        self._readings = [] if exact else None
+
+    def _is_calm(self, xyz):
+        for axis, value in zip(self.axes, xyz):
+            lower, upper = axis.band(self.n_sigma)
+            # NaN bounds (no inner readings yet) compare False, as in the batch version
+            if not lower < value < upper:
+                return False
+        return True
+
+    def _check(self, readings):
+        for reading in readings:
+            if self._is_calm(reading):
+                continue
+            self.messy += 1
+            # Kept for a second look with the final estimates
+            if len(self._flagged) < self.max_flagged:
+                self._flagged.append(reading)
+
+    def add(self, xyz):
+        self.count += 1
+        if xyz[2] < self.lean_back_threshold:
+            self.lean_back += 1
+        if self._readings is not None:
+            self._readings.append(xyz)
+            return
+        for axis, value in zip(self.axes, xyz):
+            axis.add(value)
+        if self._pending is None:
+            self._check((xyz,))
+            return
+        self._pending.append(xyz)
+        if len(self._pending) >= self.warmup:
+            pending, self._pending = self._pending, None
+            self._check(pending)
+
+    def add_magnetometer(self, calm):
+        self.mag_count += 1
+        if not calm:
+            self.mag_messy += 1
+
+    def result(self):
+        if self._readings is not None:
+            momentum, oscillations = exact_acc_features(self._readings, self.percentile2crop, self.n_sigma)
+            return self._result(momentum, oscillations)
+        if self._pending:
+            pending, self._pending = self._pending, None
+            self._check(pending)
+        # Readings flagged against early estimates (a posture change halfway
+        # through the window widens the band later) are tested again
+        for reading in self._flagged:
+            if self._is_calm(reading):
+                self.messy -= 1
+        self._flagged = []
+        return self._result(self.messy / float(self.count), self.axes[2].inner.std() / (25 * self.n_sigma))
+
+    def _result(self, momentum, oscillations):
+        return {
+            'Lean back': self.lean_back / float(self.count),
+            'Momentum': momentum,
+            'Oscillations': oscillations,
+            'Rotational movement': self.mag_messy / float(self.mag_count) if self.mag_count else None,
+        }
+
+
+class StreamingFeatures(object):
+    # Tumbling windows of window_len readings, or sliding ones with a new window
+    # every `step` readings (window_len must be a multiple of step; that costs
+    # window_len / step overlapping windows of state). exact=False estimates
+    # Momentum and Oscillations with P2 instead of storing the readings.
+
+    def __init__(self, acc_z_mean, acc_z_std, window_len=150, step=None, n_sigma_lean=5,
+                 percentile2crop=10, n_sigma_acc=10, warmup=16, max_flagged=32,
+                 max_calm_derivative=30, savgol_window=5, exact=True):
+        if step is None:
+            step = window_len
+        if window_len % step:
+            raise ValueError('window_len must be a multiple of step')
+        self.window_len = window_len
+        self.step = step
+        self.n_sigma_lean = n_sigma_lean
+        self.lean_back_threshold = acc_z_mean - n_sigma_lean * acc_z_std
+        self.percentile2crop = percentile2crop
+        self.n_sigma_acc = n_sigma_acc
+        self.warmup = warmup
+        self.max_flagged = max_flagged
+        self.exact = exact
+        self.max_calm_derivative = max_calm_derivative
+        self._derivatives = [SavgolDerivative(savgol_window) for _ in range(3)]
+        self.count = 0
+        self.windows_emitted = 0
+        self._windows = []
+
+    # New empty chair statistics (e.g. an updated baseline.Baseline), used from
+    # the next window on
+    def set_empty_chair(self, acc_z_mean, acc_z_std):
+        self.lean_back_threshold = acc_z_mean - self.n_sigma_lean * acc_z_std
+
+    def _new_window(self):
+        return _Window(self.lean_back_threshold, self.percentile2crop, self.n_sigma_acc, self.warmup,
+                       self.max_flagged, self.exact)
+
+    # One accelerometer reading; returns the windows it completed (usually none)
+    def update(self, ax, ay, az):
+        if self.count % self.step == 0:
+            self._windows.append((self.count, self._new_window()))
+        self.count += 1
+        xyz = (ax, ay, az)
+        for start, window in self._windows:
+            window.add(xyz)
+        completed = []
+        if self._windows and self._windows[0][1].count == self.window_len:
+            start, window = self._windows.pop(0)
+            result = window.result()
+            result['start'] = start
+            completed.append(result)
+            self.windows_emitted += 1
+        return completed
+
+    # Closes the open windows at the end of a run and returns their results,
+    # computed from the readings they have so far
+    def flush(self):
+        completed = []
+        for start, window in self._windows:
+            result = window.result()
+            result['start'] = start
+            completed.append(result)
+            self.windows_emitted += 1
+        self._windows = []
+        return completed
+
+    # One magnetometer reading, counted in every open window
+    def update_magnetometer(self, x, y, z):
+        slopes = [derivative.update(value) for derivative, value in zip(self._derivatives, (x, y, z))]
+        if slopes[0] is None:
+            return
+        calm = all(abs(slope) < self.max_calm_derivative for slope in slopes)
+        for start, window in self._windows:
+            window.add_magnetometer(calm)
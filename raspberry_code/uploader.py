@@ -0,0 +1,294 @@
+# -*- coding: utf-8 -*-
+import collections
+import json
+import os
+import threading
+import time
+
+from spool import RateLimiter
+from wire_format import decode_record
+
+# What to do with a finished batch when the upload queue is full:
+#   block       - the sampler waits until the uploader frees a slot
+#   drop_oldest - the oldest queued batch is discarded to make room
+#   spill       - the new batch is written to disk and uploaded later
+BACKPRESSURE_POLICIES = ('block', 'drop_oldest', 'spill')
+SPILL_SUFFIX = '.json'
+
+
+class UploadQueue(object):
+    # Spilled batches are numbered by a counter that carries on from the files
+    # already on disk, written to a temporary file and renamed into place, and
+    # only deleted once the worker reports them sent (done). While any are on
+    # disk new batches are spilled behind them, so batches go out in order.
+
+    def __init__(self, max_batches=6, policy='drop_oldest', spill_dir='spill'):
+        if policy not in BACKPRESSURE_POLICIES:
+            raise ValueError('unknown backpressure policy: ' + str(policy))
+        self.max_batches = max_batches
+        self.policy = policy
+        self.spill_dir = spill_dir
+
+        self._batches = collections.deque()
+        self._lock = threading.Lock()
+        self._not_empty = threading.Condition(self._lock)
+        self._not_full = threading.Condition(self._lock)
+        self._closed = False
+
+        self.put_batches = 0
+        self.dropped_batches = 0
+        self.dropped_samples = 0
+        self.spilled_batches = 0
+        self.max_depth = 0
+
+        # Names of the spilled batches waiting on disk, oldest first, and of
+        # those handed to the worker: id(batch) -> name
+        self._spilled = collections.deque()
+        self._unspilled = {}
+        self._next_spill = 1
+        if policy == 'spill' and os.path.isdir(spill_dir):
+            for name in sorted(os.listdir(spill_dir)):
+                if name.endswith(SPILL_SUFFIX):
+                    self._spilled.append(name)
+                    self._next_spill = int(name[:-len(SPILL_SUFFIX)]) + 1
+                else:
+                    # A spill cut short by a crash
+                    os.remove(os.path.join(spill_dir, name))
+
+    def depth(self):
+        with self._lock:
+            return len(self._batches)
+
+    # Called from the sampling loop. Never blocks unless policy is 'block'.
+    def put(self, batch):
+        with self._lock:
+            if self._closed:
+                raise RuntimeError('upload queue is closed')
+            self.put_batches += 1
+            if self._spilled:
+                self._spill(batch)
+                self._not_empty.notify()
+                return
+            if len(self._batches) >= self.max_batches:
+                if self.policy == 'block':
+                    while len(self._batches) >= self.max_batches and not self._closed:
+                        self._not_full.wait()
+                elif self.policy == 'drop_oldest':
+                    self._drop(self._batches.popleft())
+                else:
+                    self._spill(batch)
+                    self._not_empty.notify()
+                    return
+            self._batches.append(batch)
+            self.max_depth = max(self.max_depth, len(self._batches))
+            self._not_empty.notify()
+
+    # Called from the upload worker. Returns None once the queue is closed and drained.
+    def get(self):
+        with self._lock:
+            while not self._batches:
+                spilled = self._unspill()
+                if spilled is not None:
+                    return spilled
+                if self._closed:
+                    return None
+                self._not_empty.wait()
+            batch = self._batches.popleft()
+            self._not_full.notify()
+            return batch
+
+    # Puts a batch back at the head of the queue after a failed upload.
+    def requeue(self, batch):
+        with self._lock:
+            name = self._unspilled.pop(id(batch), None)
+            if name is not None:
+                # Still on disk
+                self._spilled.appendleft(name)
+            elif len(self._batches) >= self.max_batches and self.policy == 'drop_oldest':
+                self._drop(batch)
+            else:
+                self._batches.appendleft(batch)
+                self.max_depth = max(self.max_depth, len(self._batches))
+
+    # The worker sent `batch`, a spilled one can go
+    def done(self, batch):
+        with self._lock:
+            name = self._unspilled.pop(id(batch), None)
+        if name is not None:
+            os.remove(os.path.join(self.spill_dir, name))
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+            self._not_empty.notify_all()
+            self._not_full.notify_all()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'depth': len(self._batches),
+                'max_depth': self.max_depth,
+                'put_batches': self.put_batches,
+                'dropped_batches': self.dropped_batches,
+                'dropped_samples': self.dropped_samples,
+                'spilled_batches': self.spilled_batches,
+                'spill_depth': len(self._spilled),
+            }
+
+    def _drop(self, batch):
+        self.dropped_batches += 1
+        self.dropped_samples += sum(len(sensor_batch) for sensor_batch in batch.values())
+
+    def _spill(self, batch):
+        if not os.path.isdir(self.spill_dir):
+            os.makedirs(self.spill_dir)
+        name = '%020d%s' % (self._next_spill, SPILL_SUFFIX)
+        self._next_spill += 1
+        path = os.path.join(self.spill_dir, name)
+        with open(path + '.tmp', 'w') as f:
+            json.dump(batch, f, default=_to_dict)
+        os.replace(path + '.tmp', path)
+        self._spilled.append(name)
+        self.spilled_batches += 1
+
+    def _unspill(self):
+        if not self._spilled:
+            return None
+        name = self._spilled.popleft()
+        with open(os.path.join(self.spill_dir, name)) as f:
+            batch = json.load(f)
+        self._unspilled[id(batch)] = name
+        return batch
+
+
+# Sensor batches (buffers.SampleBatch) are spilled in their compact dict form
+def _to_dict(obj):
+    return obj.to_dict()
+
+
+class UploadWorker(threading.Thread):
+
+    def __init__(self, simple_request, upload_queue, retry_delay=5.0):
+        super(UploadWorker, self).__init__()
+        self.daemon = True
+        self.simple_request = simple_request
+        self.upload_queue = upload_queue
+        self.retry_delay = retry_delay
+
+        self.sent_batches = 0
+        self.failed_batches = 0
+
+    def run(self):
+        while True:
+            batch = self.upload_queue.get()
+            if batch is None:
+                break
+            try:
+                ok = self.simple_request.sendData(batch)
+            except Exception as e:
+                print('upload failed: ' + str(e))
+                ok = False
+            if ok:
+                self.sent_batches += 1
+                self.upload_queue.done(batch)
+            else:
+                self.failed_batches += 1
+                self.upload_queue.requeue(batch)
+                time.sleep(self.retry_delay)
+
+    def stop(self, timeout=None):
+        self.upload_queue.close()
+        self.join(timeout)
+
+    def stats(self):
+        stats = self.upload_queue.stats()
+        stats['sent_batches'] = self.sent_batches
+        stats['failed_batches'] = self.failed_batches
+        return stats
+
+
+class SpoolWorker(threading.Thread):
+    # Uploads what the sampler wrote to a spool.Spool, oldest first, and
+    # acknowledges records only after the server accepted them. A backlog left
+    # from an earlier run or an outage is replayed at no more than replay_rate
+    # requests per second so it does not starve the live batches.
+
+    def __init__(self, simple_request, spool, replay_rate=2.0, poll_interval=0.5, retry_delay=5.0):
+        super(SpoolWorker, self).__init__()
+        self.daemon = True
+        self.simple_request = simple_request
+        self.spool = spool
+        self.limiter = RateLimiter(replay_rate)
+        self.poll_interval = poll_interval
+        self.retry_delay = retry_delay
+
+        self._wake = threading.Event()
+        self._halt = threading.Event()
+        self._draining = False
+
+        self.sent_records = 0
+        self.failed_batches = 0
+
+    # Tells the worker that new records are in the spool
+    def notify(self):
+        self._wake.set()
+
+    def run(self):
+        while not self._halt.is_set():
+            items = self.spool.pending(limit=32)
+            if not items:
+                if self._draining:
+                    break
+                self._wake.wait(self.poll_interval)
+                self._wake.clear()
+                continue
+
+            for record_ids, batch in self._group(items):
+                if self._halt.is_set():
+                    break
+                # More records on disk than one upload of every stream: replaying
+                if len(self.spool) > len(self.simple_request.endpoints):
+                    self.limiter.wait()
+                try:
+                    self.simple_request.sendData(batch)
+                except Exception as e:
+                    print('upload failed: ' + str(e))
+                # sendData removes every stream the server acknowledged
+                for typeSensor, record_id in record_ids.items():
+                    if typeSensor not in batch:
+                        self.spool.ack(record_id)
+                        self.sent_records += 1
+                if batch:
+                    self.failed_batches += 1
+                    self._halt.wait(self.retry_delay)
+                    break
+
+    # Pairs consecutive records of different sensors back into one batch so
+    # both streams are posted together
+    @staticmethod
+    def _group(items):
+        record_ids, batch = {}, {}
+        for record_id, payload in items:
+            sensor_batch = decode_record(payload)
+            if sensor_batch.typeSensor in batch:
+                yield record_ids, batch
+                record_ids, batch = {}, {}
+            record_ids[sensor_batch.typeSensor] = record_id
+            batch[sensor_batch.typeSensor] = sensor_batch
+        if batch:
+            yield record_ids, batch
+
+    # Keeps uploading until the spool is empty or timeout runs out, whatever is
+    # left stays on disk for the next run
+    def stop(self, timeout=None):
+        self._draining = True
+        self._wake.set()
+        self.join(timeout)
+        self._halt.set()
+        self.join(self.retry_delay)
+
+    def stats(self):
+        stats = self.spool.stats()
+        stats['sent_records'] = self.sent_records
+        stats['failed_batches'] = self.failed_batches
+        return stats
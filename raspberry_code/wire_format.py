@@ -0,0 +1,194 @@
+# -*- coding: utf-8 -*-
+# Binary encoding of one SampleBatch for /api/accelerometer and /api/magnetometer.
+#
+# Layout, all integers little-endian:
+#   magic       4s   b'SCB1'
+#   flags       B    bit 0: body is zlib-compressed, bit 1: rate follows the strings,
+#                    bit 2: time steps are q instead of I
+#   body (optionally compressed):
+#     sensor    B    0 - accelerometer, 1 - magnetometer
+#     n         I    number of samples
+#     anchor    q q  wall clock ns, monotonic ns of the first sample
+#     label, metaInfo, peopleId: H length + utf-8 bytes each
+#     rate      f    SampleBatch.rate_hz, only with flag bit 1
+#     timestamps n * I   microseconds since the previous sample (first since anchor);
+#                n * q   with flag bit 2, set only when a step does not fit in I
+#                        (a gap over 2 ** 32 us, about 71.6 minutes, or a step back)
+#     x, y, z    n * h   deltas from the previous value, wrapping modulo 2 ** 16
+#
+# Delta coding keeps the slowly changing chair signals close to zero, which
+# is what makes the zlib pass effective.
+#
+# Window summaries (buffers.SummaryBatch) go to the spool as
+#   magic       4s   b'SCS1'
+#   flags       B    bit 0: body is zlib-compressed
+#   body        the JSON of SummaryBatch.to_dict()
+# encode_record / decode_record pick the right encoding for either kind.
+from array import array
+import json
+import struct
+import sys
+import zlib
+
+from buffers import SampleBatch, SummaryBatch
+
+MAGIC = b'SCB1'
+SUMMARY_MAGIC = b'SCS1'
+FLAG_ZLIB = 0x01
+FLAG_RATE = 0x02
+FLAG_WIDE_STEPS = 0x04
+CONTENT_TYPE = 'application/x-smartchair-batch'
+
+SENSOR_CODES = {
+    'accelerometer': 0,
+    'magnetometer': 1,
+}
+SENSOR_NAMES = dict((code, name) for name, code in SENSOR_CODES.items())
+
+_PREFIX = struct.Struct('<4sB')
+_HEADER = struct.Struct('<BIqq')
+_STRING_LENGTH = struct.Struct('<H')
+_RATE = struct.Struct('<f')
+_BIG_ENDIAN = sys.byteorder == 'big'
+_STEP_SIZES = {'I': 4, 'q': 8}
+
+
+def _delta_encode(values):
+    deltas = array('h')
+    previous = 0
+    for value in values:
+        deltas.append((value - previous + 32768) % 65536 - 32768)
+        previous = value
+    return deltas
+
+
+def _delta_decode(deltas):
+    values = array('h')
+    value = 0
+    for delta in deltas:
+        value = (value + delta + 32768) % 65536 - 32768
+        values.append(value)
+    return values
+
+
+def _to_bytes(values):
+    if _BIG_ENDIAN:
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+
+def _from_bytes(typecode, data):
+    values = array(typecode)
+    values.frombytes(data)
+    if _BIG_ENDIAN:
+        values.byteswap()
+    return values
+
+
+def encode_batch(batch, compress=True):
+    anchor = batch.anchor_monotonic_ns or 0
+    previous = 0
+    intervals = array('q')
+    for timestamp in batch.timestamps:
+        offset_us = (timestamp - anchor) // 1000
+        intervals.append(offset_us - previous)
+        previous = offset_us
+
+    parts = [_HEADER.pack(SENSOR_CODES[batch.typeSensor], len(batch),
+                          batch.anchor_wall_ns or 0, anchor)]
+    for text in (batch.label, batch.metaInfo, batch.peopleId):
+        encoded = text.encode('utf-8')
+        parts.append(_STRING_LENGTH.pack(len(encoded)))
+        parts.append(encoded)
+    flags = 0
+    if batch.rate_hz is not None:
+        parts.append(_RATE.pack(batch.rate_hz))
+        flags |= FLAG_RATE
+    if intervals and (min(intervals) < 0 or max(intervals) > 0xffffffff):
+        flags |= FLAG_WIDE_STEPS
+    else:
+        intervals = array('I', intervals)
+    parts.append(_to_bytes(intervals))
+    for axis in (batch.x, batch.y, batch.z):
+        parts.append(_to_bytes(_delta_encode(axis)))
+
+    body = b''.join(parts)
+    if compress:
+        body = zlib.compress(body, 6)
+        flags |= FLAG_ZLIB
+    return _PREFIX.pack(MAGIC, flags) + body
+
+
+def decode_batch(data):
+    magic, flags = _PREFIX.unpack_from(data, 0)
+    if magic != MAGIC:
+        raise ValueError('not a smart chair batch')
+    body = data[_PREFIX.size:]
+    if flags & FLAG_ZLIB:
+        body = zlib.decompress(body)
+
+    sensor, n, anchor_wall_ns, anchor_monotonic_ns = _HEADER.unpack_from(body, 0)
+    offset = _HEADER.size
+    strings = []
+    for _ in range(3):
+        length, = _STRING_LENGTH.unpack_from(body, offset)
+        offset += _STRING_LENGTH.size
+        strings.append(body[offset:offset + length].decode('utf-8'))
+        offset += length
+
+    batch = SampleBatch(SENSOR_NAMES[sensor], *strings)
+    if flags & FLAG_RATE:
+        batch.rate_hz, = _RATE.unpack_from(body, offset)
+        offset += _RATE.size
+    if n:
+        batch.anchor_wall_ns = anchor_wall_ns
+        batch.anchor_monotonic_ns = anchor_monotonic_ns
+
+    typecode = 'q' if flags & FLAG_WIDE_STEPS else 'I'
+    size = _STEP_SIZES[typecode] * n
+    intervals = _from_bytes(typecode, body[offset:offset + size])
+    offset += size
+    offset_us = 0
+    for interval in intervals:
+        offset_us += interval
+        batch.timestamps.append(anchor_monotonic_ns + offset_us * 1000)
+
+    axes = []
+    for _ in range(3):
+        axes.append(_delta_decode(_from_bytes('h', body[offset:offset + 2 * n])))
+        offset += 2 * n
+    batch.x, batch.y, batch.z = axes
+    return batch
+
+
+def encode_summaries(batch, compress=True):
+    body = json.dumps(batch.to_dict()).encode('utf-8')
+    flags = 0
+    if compress:
+        body = zlib.compress(body, 6)
+        flags |= FLAG_ZLIB
+    return _PREFIX.pack(SUMMARY_MAGIC, flags) + body
+
+
+def decode_summaries(data):
+    magic, flags = _PREFIX.unpack_from(data, 0)
+    if magic != SUMMARY_MAGIC:
+        raise ValueError('not a smart chair summary batch')
+    body = data[_PREFIX.size:]
+    if flags & FLAG_ZLIB:
+        body = zlib.decompress(body)
+    return SummaryBatch.from_dict(json.loads(body.decode('utf-8')))
+
+
+# Spool records: sensor batches in the binary layout, summaries as JSON
+def encode_record(batch, compress=True):
+    if isinstance(batch, SummaryBatch):
+        return encode_summaries(batch, compress)
+    return encode_batch(batch, compress)
+
+
+def decode_record(data):
+    if data[:len(SUMMARY_MAGIC)] == SUMMARY_MAGIC:
+        return decode_summaries(data)
+    return decode_batch(data)